@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    adaptive.py
+#
+#    Utility functions to adaptively choose the number of
+#    structures generated for each mutation by flexddg steps.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import logging as log
+import math
+import os.path
+import statistics
+# RosettaDDGPrediction
+from . import aggregation
+from .defaults import (
+    MUT_DIR_NAME,
+    ROSETTA_DF_COLS
+)
+from . import util
+
+
+
+def group_runs(runs):
+    """Group the runs of a ΔΔG step by mutation (each run
+    being a tuple whose last element is the mutation in PDB
+    numbering), keeping their order.
+    """
+
+    # Create an empty dictionary to store the runs
+    groups = {}
+
+    # For each run
+    for run in runs:
+
+        # Add it to the group of its mutation
+        groups.setdefault(run[-1][MUT_DIR_NAME], []).append(run)
+
+    # Return the groups
+    return groups
+
+
+def get_ddg_samples(muts_wd,
+                    step_name,
+                    step_opts):
+    """Get the total ΔΔG scores of the structures generated
+    for a mutation, skipping the structures whose run is not
+    complete.
+    """
+
+    # Get the column names
+    tot_score_col = ROSETTA_DF_COLS["tot_score"]
+
+    # Get the name of the output file
+    out_name = util.get_ddg_output_file(step_name = step_name,
+                                        step_opts = step_opts)
+
+    # Create an empty list to store the scores
+    samples = []
+
+    # For each structure's working directory
+    for mut_wd in muts_wd:
+
+        # Skip the structures whose run is not complete
+        if not util.check_run_completed(wd = mut_wd,
+                                        step_name = step_name,
+                                        step_opts = step_opts):
+            continue
+
+        # Parse the output file
+        df = aggregation.parse_output_flexddg(\
+                db3_out = os.path.join(mut_wd, out_name),
+                traj_stride = 1,
+                struct_num = None,
+                scf_name = None,
+                list_contributions = [])
+
+        # Get the ΔΔG scores at the end of the backrub trajectory
+        _, _, ddg = \
+            aggregation.aggregate_data_flexddg(df = df,
+                                               list_contributions = [])
+
+        # Add them to the list
+        samples.extend(ddg[tot_score_col].tolist())
+
+    # Return the scores
+    return samples
+
+
+def _get_t_quantile(p,
+                    dof):
+    """Get the p-th quantile of Student's t distribution with
+    the given degrees of freedom (Cornish-Fisher expansion
+    around the normal quantile, accurate to a few parts per
+    thousand for more than four degrees of freedom).
+    """
+
+    # Get the quantile of the standard normal distribution
+    z = statistics.NormalDist().inv_cdf(p)
+
+    # Return the corrected quantile
+    return z \
+           + (z**3 + z) / (4 * dof) \
+           + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * dof**2) \
+           + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) \
+             / (384 * dof**3)
+
+
+def check_convergence(samples,
+                      adaptive_opts):
+    """Check whether the mean of the ΔΔG scores sampled for a
+    mutation has converged. Return whether it has converged,
+    the standard error of the mean and the width of its
+    confidence interval (None if fewer than two samples are
+    available).
+    """
+
+    # Get the number of samples
+    n = len(samples)
+
+    # The standard error cannot be estimated from less than
+    # two samples
+    if n < 2:
+        return False, None, None
+
+    # Get the standard error of the mean
+    sterr = statistics.stdev(samples) / math.sqrt(n)
+
+    # Get the width of the confidence interval of the mean
+    p = (1 + adaptive_opts["confidence"]) / 2
+    ci_width = 2 * _get_t_quantile(p, n - 1) * sterr
+
+    # Get the thresholds
+    max_sterr = adaptive_opts["maxsterr"]
+    max_ci_width = adaptive_opts["maxciwidth"]
+
+    # The mean has converged if enough samples were collected
+    # and any of the thresholds is met
+    converged = \
+        n >= adaptive_opts["minnstruct"] \
+        and ((max_sterr is not None and sterr <= max_sterr) \
+             or (max_ci_width is not None \
+                 and ci_width <= max_ci_width))
+
+    # Return the convergence status and the statistics
+    return converged, sterr, ci_width
+
+
+def get_next_wave(mut_name,
+                  mut_runs,
+                  mut_pending,
+                  adaptive_opts,
+                  step_name,
+                  step_opts):
+    """Get the next wave of runs to be performed for a mutation,
+    given all its runs (one per structure, at most 'nstruct')
+    and those not performed yet (the runs in the wave are
+    removed from them). Return an empty list if the ΔΔG has
+    converged or no more structures can be generated.
+    """
+
+    # Get the ΔΔG scores sampled so far
+    samples = \
+        get_ddg_samples(muts_wd = [run[1] for run in mut_runs],
+                        step_name = step_name,
+                        step_opts = step_opts)
+
+    # Check whether they have converged
+    converged, sterr, ci_width = \
+        check_convergence(samples = samples,
+                          adaptive_opts = adaptive_opts)
+
+    # If they have converged or the maximum number of structures
+    # has been reached
+    if converged or not mut_pending:
+
+        # Get the reason why sampling stops
+        reason = \
+            "converged" if converged \
+            else "reached the maximum number of structures"
+
+        # Format the statistics
+        stats = \
+            f"SE = {sterr:.3f}, CI width = {ci_width:.3f}" \
+            if sterr is not None else "SE not available"
+
+        # Inform the user
+        logstr = \
+            f"Sampling for {mut_name} {reason} with " \
+            f"{len(samples)} structure(s) ({stats})."
+        log.info(logstr)
+
+        # No more runs are needed
+        return []
+
+    # Get how many runs are needed (enough to reach the minimum
+    # number of structures, or a full wave otherwise)
+    n_runs = \
+        max(adaptive_opts["minnstruct"] - len(samples),
+            adaptive_opts["wavesize"])
+
+    # Get the runs of the next wave
+    wave = mut_pending[:n_runs]
+    del mut_pending[:n_runs]
+
+    # Return them
+    return wave
@@ -29,31 +29,30 @@
 
 
 # Standard library
+import itertools
 import os.path
+import pathlib
+import re
 import sqlite3
 # Third-party packages
+import numpy as np
 import pandas as pd
 # RosettaDDGProtocols
+from . import columnar
+from .dask_patches import reset_worker_logger
 from .defaults import ROSETTA_DF_COLS
 
 
 
-def parse_output_cartddg(ddg_out,
-                         list_contributions,
-                         scf_name):
-    """Parse the output file from cartddg protocols and
-    return a data frame.
+def read_output_cartddg(ddg_out,
+                        list_contributions):
+    """Read the output file from cartddg protocols and return
+    the scores of the rounds run for the wild-type and for the
+    mutant.
     """
 
     # Get the column names
-    scf_name_col = ROSETTA_DF_COLS["scf_name"]
-    state_col = ROSETTA_DF_COLS["state"]
-    struct_num_col = ROSETTA_DF_COLS["struct_num"]
     tot_score_col = ROSETTA_DF_COLS["tot_score"]
-    
-    # State names  
-    wt = "wt"
-    mut = "mut"
 
     with open(ddg_out, "r") as f:
         
@@ -93,7 +92,222 @@ def parse_output_cartddg(ddg_out,
                     wt_dgs.append(dg_data)
                 elif mut_status.startswith("MUT"):
                     mut_dgs.append(dg_data)
-        
+
+        # Return the wild-type and mutant ΔGs
+        return wt_dgs, mut_dgs
+
+
+def _read_complex_lines(ddg_out):
+    """Read the 'COMPLEX:' lines of an output file from cartddg
+    protocols (the whole file is read at once).
+    """
+
+    with open(ddg_out, "r") as f:
+        return re.findall(r"^COMPLEX:.*$", f.read(), re.MULTILINE)
+
+
+def _get_complex_line_number(ddg_out,
+                             index):
+    """Get the line number (starting from 1) of the 'index'-th
+    (starting from 0) 'COMPLEX:' line of an output file from
+    cartddg protocols.
+    """
+
+    with open(ddg_out, "r") as f:
+
+        # Get the numbers of the 'COMPLEX:' lines
+        line_nums = (num for num, line in enumerate(f, 1) \
+                     if line.startswith("COMPLEX:"))
+
+        # Return the number of the line requested
+        return next(itertools.islice(line_nums, index, None))
+
+
+def read_outputs_cartddg(ddg_outs,
+                         list_contributions):
+    """Read the output files from cartddg protocols and return,
+    for each file, the scores of the rounds run for the
+    wild-type and for the mutant, as 2D arrays whose columns
+    are the energy contributions followed by the total score,
+    together with the names of the columns.
+
+    The lines of all files are tokenized together and all
+    numeric fields are converted in a single NumPy operation.
+    A ValueError is raised if a line has a different number
+    of fields than the others in the same file (i.e. it was
+    truncated).
+    """
+
+    # Get the column names
+    tot_score_col = ROSETTA_DF_COLS["tot_score"]
+
+    # Read the lines of interest of all files
+    lines = [_read_complex_lines(ddg_out) for ddg_out in ddg_outs]
+
+    # Get the number of lines in each file
+    n_lines = np.array([len(file_lines) for file_lines in lines])
+
+    # Tokenize the lines of all files
+    lines_tokens = \
+        [line.split() for file_lines in lines for line in file_lines]
+
+    # Get the number of tokens in each line (the label, the round,
+    # the state, the total score and a name/value pair per energy
+    # contribution)
+    lines_n_tokens = np.array([len(t) for t in lines_tokens],
+                              dtype = int)
+
+    # Get the rows where the lines of each file start and end
+    ends = np.cumsum(n_lines)
+    starts = ends - n_lines
+
+    # For each file and the rows where its lines start and end
+    for ddg_out, start, end in zip(ddg_outs, starts, ends):
+
+        # Get the number of tokens in each of its lines
+        file_n_tokens = lines_n_tokens[start:end]
+
+        # Get the lines that are not laid out as expected or have
+        # a different number of tokens than the first line of the
+        # file (i.e. lines truncated or merged with another one)
+        bad = \
+            np.flatnonzero((file_n_tokens < 4) \
+                           | ((file_n_tokens - 4) % 2 != 0) \
+                           | (file_n_tokens != file_n_tokens[:1]))
+
+        # If there are any, raise an error
+        if bad.size:
+            line_num = _get_complex_line_number(ddg_out, bad[0])
+            errstr = \
+                f"Line {line_num} of {ddg_out} has " \
+                f"{file_n_tokens[bad[0]]} fields, while " \
+                f"{file_n_tokens[0]} were expected. Please " \
+                f"check your run."
+            raise ValueError(errstr)
+
+    # Get the number of tokens per line
+    n_tokens = lines_n_tokens[0] if len(lines_n_tokens) else 4
+
+    # If the files report different numbers of contributions,
+    # they cannot be read as a single table, so fall back to
+    # reading the files line by line
+    if (lines_n_tokens != n_tokens).any():
+        return _read_outputs_cartddg_by_line(ddg_outs,
+                                             list_contributions)
+
+    # Flatten the tokens of all lines
+    tokens = [token for line_tokens in lines_tokens \
+              for token in line_tokens]
+
+    # Arrange the tokens in a table (one row per line)
+    table = np.array(tokens, dtype = str).reshape(-1, n_tokens)
+
+    # Get the energy contributions found in the files (any
+    # value beyond the contributions listed is ignored)
+    contributions = list_contributions[:(n_tokens - 4) // 2]
+
+    # Get the columns of the table storing the values of the
+    # contributions, followed by the column of the total score
+    cols = list(range(5, 5 + 2 * len(contributions), 2)) + [3]
+
+    # Convert all numeric fields into a preallocated block
+    values = np.empty((len(table), len(cols)), dtype = np.float64)
+    values[:] = table[:, cols]
+
+    # Get which rows refer to wild-type or mutant structures
+    is_wt = np.char.startswith(table[:, 2], "WT")
+    is_mut = np.char.startswith(table[:, 2], "MUT")
+
+    # Split the scores by file and by state
+    dgs = [(values[start:end][is_wt[start:end]],
+            values[start:end][is_mut[start:end]]) \
+           for start, end in zip(starts, ends)]
+
+    # Return the scores and the names of the columns
+    return dgs, contributions + [tot_score_col]
+
+
+def _read_outputs_cartddg_by_line(ddg_outs,
+                                  list_contributions):
+    """Read the output files from cartddg protocols line by line
+    (used for files reporting different numbers of energy
+    contributions), returning the same data as
+    'read_outputs_cartddg'.
+    """
+
+    # Get the column names
+    tot_score_col = ROSETTA_DF_COLS["tot_score"]
+
+    # Read the scores from all files
+    dgs = \
+        [read_output_cartddg(ddg_out = ddg_out,
+                             list_contributions = list_contributions) \
+         for ddg_out in ddg_outs]
+
+    # Get the columns found in the files
+    cols = \
+        list(pd.DataFrame(\
+            [dg for wt_dgs, mut_dgs in dgs for dg in wt_dgs + mut_dgs],
+            columns = list_contributions + [tot_score_col]).dropna(\
+                axis = 1, how = "all").columns)
+
+    # Return the scores as arrays and the names of the columns
+    return [(pd.DataFrame(wt_dgs, columns = cols).to_numpy(),
+             pd.DataFrame(mut_dgs, columns = cols).to_numpy()) \
+            for wt_dgs, mut_dgs in dgs], cols
+
+
+def parse_outputs_cartddg(ddg_outs,
+                          list_contributions,
+                          scf_name,
+                          wt_ddg_outs = None):
+    """Parse the output files from cartddg protocols and return
+    a single data frame, indexed by the output file and by the
+    position of the rows in the data frame that
+    'parse_output_cartddg' would return for the file.
+
+    If the wild-type reference was computed only once for
+    all mutations at the same position(s), 'wt_ddg_outs' are
+    the output files containing it (one per file in 'ddg_outs'),
+    and the wild-type rounds are taken from there.
+    """
+
+    # Get the column names
+    scf_name_col = ROSETTA_DF_COLS["scf_name"]
+    state_col = ROSETTA_DF_COLS["state"]
+    struct_num_col = ROSETTA_DF_COLS["struct_num"]
+
+    # If no shared wild-type references were given
+    if wt_ddg_outs is None:
+        wt_ddg_outs = [None] * len(ddg_outs)
+
+    # Get the shared wild-type references (each one is read once,
+    # even if it is shared by several mutations)
+    wt_refs = list(dict.fromkeys(f for f in wt_ddg_outs if f is not None))
+
+    # Read all files at once
+    dgs, cols = \
+        read_outputs_cartddg(ddg_outs = list(ddg_outs) + wt_refs,
+                             list_contributions = list_contributions)
+
+    # Map each shared wild-type reference to its wild-type scores
+    wt_ref_dgs = \
+        {wt_ref : wt_dgs for wt_ref, (wt_dgs, _) \
+         in zip(wt_refs, dgs[len(ddg_outs):])}
+
+    # Create empty lists to store the blocks of scores, states,
+    # structure numbers and rows of each file
+    blocks, states, struct_nums, rows = [], [], [], []
+
+    # For each output file
+    for ddg_out, wt_ddg_out, (wt_dgs, mut_dgs) \
+        in zip(ddg_outs, wt_ddg_outs, dgs):
+
+        # If the wild-type reference is shared, take the
+        # wild-type scores from the shared output file
+        if wt_ddg_out is not None:
+            wt_dgs = wt_ref_dgs[wt_ddg_out]
+
         # The protocol must have run the same number
         # of rounds for both WT and MUT
         if len(wt_dgs) != len(mut_dgs):
@@ -105,24 +319,58 @@ def parse_output_cartddg(ddg_out,
                 f"and {len(mut_dgs)} for the mutant. " \
                 f"Please check your run."
             raise ValueError(errstr)
-        
-        # Get the number of structures generated
-        n_structs = [str(i) for i in range(1, len(wt_dgs)+1)]
-        
-        # Scores for wild-type structures
-        df_wt = pd.DataFrame(wt_dgs)
-        df_wt[state_col] = wt
-        df_wt[struct_num_col] = n_structs
-        df_wt[scf_name_col] = scf_name
-        
-        # Scores for mutant structures
-        df_mut = pd.DataFrame(mut_dgs)
-        df_mut[state_col] = mut
-        df_mut[struct_num_col] = n_structs
-        df_mut[scf_name_col] = scf_name
-        
-        # Concatenate the results in a data frame
-        return pd.concat([df_wt, df_mut]).reset_index(drop = True)
+
+        # Get the number of rounds
+        n_rounds = len(wt_dgs)
+
+        # Add the scores of the wild-type and mutant structures
+        blocks.extend([wt_dgs, mut_dgs])
+        states.extend([np.repeat("wt", n_rounds),
+                       np.repeat("mut", n_rounds)])
+        struct_nums.extend([np.arange(1, n_rounds + 1)] * 2)
+        rows.append(np.arange(2 * n_rounds))
+
+    # Create the index of the data frame
+    index = \
+        pd.MultiIndex.from_arrays(\
+            [np.repeat(ddg_outs, [len(r) for r in rows]),
+             np.concatenate(rows)])
+
+    # Create the data frame with the scores
+    df = pd.DataFrame(np.concatenate(blocks),
+                      index = index,
+                      columns = cols)
+
+    # Add the states, the structure numbers (as strings) and
+    # the name of the scoring function
+    df[state_col] = np.concatenate(states)
+    df[struct_num_col] = np.concatenate(struct_nums).astype(str)
+    df[scf_name_col] = scf_name
+
+    # Return the data frame
+    return df
+
+
+def parse_output_cartddg(ddg_out,
+                         list_contributions,
+                         scf_name,
+                         wt_ddg_out = None):
+    """Parse the output file from cartddg protocols and
+    return a data frame.
+
+    If the wild-type reference was computed only once for
+    all mutations at the same position(s), 'wt_ddg_out' is
+    the output file containing it, and the wild-type rounds
+    are taken from there.
+    """
+
+    # Parse the file and drop the level of the index storing
+    # the file name
+    return parse_outputs_cartddg(\
+                ddg_outs = [ddg_out],
+                list_contributions = list_contributions,
+                scf_name = scf_name,
+                wt_ddg_outs = [wt_ddg_out]).reset_index(drop = True)
 
 
 def aggregate_data_cartddg(df,
@@ -154,91 +402,140 @@ def aggregate_data_cartddg(df,
     return (dg_wt, dg_mut, ddg)
 
 
+def _connect_read_only(db3_out):
+    """Open a connection to a .db3 file in read-only mode (the
+    file is never created if it does not exist). The usual
+    locking is kept, since Rosetta may still be writing to the
+    file (i.e. when the outputs are aggregated or sampled
+    during a run).
+    """
+
+    # Get the URI of the file
+    uri = pathlib.Path(os.path.abspath(db3_out)).as_uri()
+
+    # Return the connection
+    return sqlite3.connect(f"{uri}?mode=ro", uri = True)
+
+
+def _quote_identifier(name):
+    """Quote a name to be used as a column name in a SQL query.
+    """
+
+    # Double the quotes inside the name and quote it
+    return '"' + name.replace('"', '""') + '"'
+
+
 def parse_output_flexddg(db3_out,
                          traj_stride,
                          struct_num,
-                         scf_name):
+                         scf_name,
+                         list_contributions = None):
     """Parse the .db3 output from flexddg protocols
     and return a data frame.
+
+    Only the structures scored at the end of the backrub
+    trajectory are selected, the scores are pivoted to one
+    column per score type in the query and, if
+    'list_contributions' is given, only those contributions
+    (and the total score) are retrieved.
     """
 
     # Get the column names
-    struct_id_col = ROSETTA_DF_COLS["struct_id"]
-    name_col = ROSETTA_DF_COLS["name"]
     state_col = ROSETTA_DF_COLS["state"]
     scf_name_col = ROSETTA_DF_COLS["scf_name"]
     b_steps_col = ROSETTA_DF_COLS["b_steps"]
-    sc_type_col = ROSETTA_DF_COLS["sc_type"]
-    sc_value_col = ROSETTA_DF_COLS["sc_value"]
+    tot_score_col = ROSETTA_DF_COLS["tot_score"]
     struct_num_col = ROSETTA_DF_COLS["struct_num"]
     
-    # Open the connection
+    # Open the connection (read-only, so that the output is
+    # never created or modified)
     db3_out = os.path.abspath(db3_out)
-    connection = sqlite3.connect(db3_out)
-    connection.row_factory = sqlite3.Row
-    
-    # Create the cursor
-    cursor = connection.cursor()
-    
-    # Selection string to get the total number of batches
-    sel_str = f'SELECT max(batch_id) from batches'
-    n_batches = cursor.execute(sel_str).fetchone()[0]
-    
-    # Selection string for the structure scores
-    sel = \
-        "batches.name, structure_scores.struct_id," \
-        "score_types.score_type_name, structure_scores.score_value," \
-        "score_function_method_options.score_function_name"
-    
-    # Selection string for the inner join on batches
-    injoin_batches = \
-        "batches.batch_id=structure_scores.batch_id"
-    
-    # Selection string for the inner join on the scoring function
-    injoin_scfunc = \
-        "score_function_method_options.batch_id=batches.batch_id"
-    
-    # Selection string for the inner join on the score type
-    injoin_sctype = \
-        "score_types.batch_id=structure_scores.batch_id " \
-        "AND score_types.score_type_id=structure_scores.score_type_id"
-    
-    # Assemble the query string
-    query = \
-        f"SELECT {sel} from structure_scores\n" \
-        f"INNER JOIN batches ON {injoin_batches}\n" \
-        f"INNER JOIN score_function_method_options ON {injoin_scfunc}\n" \
-        f"INNER JOIN score_types ON {injoin_sctype}"
-    
-    # Try to read the query into a data frame
+    connection = _connect_read_only(db3_out)
+
+    # Try to query the database
     try:
-        df = pd.read_sql_query(query, connection)
-    
+
+        # Create the cursor
+        cursor = connection.cursor()
+    
+        # Get the total number of batches and the highest
+        # structure ID (the structures are numbered consecutively
+        # for each backrub step, batch after batch)
+        n_batches, = \
+            cursor.execute("SELECT max(batch_id) FROM batches").fetchone()
+        max_struct_id, = \
+            cursor.execute(\
+                "SELECT max(struct_id) FROM structure_scores").fetchone()
+
+        # Get the ID of the last structure before the final backrub
+        # step (the final step's structures come after it)
+        last_id = ((max_struct_id - 1) // n_batches) * n_batches
+
+        # Get the score types stored in the database
+        sc_types = \
+            [row[0] for row in cursor.execute(\
+                "SELECT DISTINCT score_type_name FROM score_types")]
+
+        # Keep only the score types requested, sorted by name
+        sc_types = \
+            sorted(t for t in sc_types \
+                   if list_contributions is None \
+                   or t in list_contributions or t == tot_score_col)
+
+        # Selection string for the columns of the pivot table
+        # (one per score type)
+        sel_sc_types = \
+            ",\n".join(\
+                f"avg(CASE WHEN score_types.score_type_name = ? " \
+                f"THEN structure_scores.score_value END) " \
+                f"AS {_quote_identifier(t)}" for t in sc_types)
+
+        # Selection string for the state (the name of the batch,
+        # without the '_dbreport' suffix)
+        sel_state = \
+            "CASE WHEN substr(batches.name, -9) = '_dbreport' " \
+            "THEN substr(batches.name, 1, length(batches.name) - 9) " \
+            "ELSE batches.name END"
+
+        # Selection string for the backrub step
+        sel_b_steps = \
+            "? * (1 + (structure_scores.struct_id - 1) / ?)"
+    
+        # Assemble the query string
+        query = \
+            f"SELECT {sel_state} AS {state_col},\n" \
+            f"{sel_b_steps} AS {b_steps_col},\n" \
+            f"score_function_method_options.score_function_name " \
+            f"AS {scf_name_col}" \
+            f"{',' if sc_types else ''}\n{sel_sc_types}\n" \
+            f"FROM structure_scores\n" \
+            f"INNER JOIN batches " \
+            f"ON batches.batch_id=structure_scores.batch_id\n" \
+            f"INNER JOIN score_function_method_options " \
+            f"ON score_function_method_options.batch_id=" \
+            f"batches.batch_id\n" \
+            f"INNER JOIN score_types " \
+            f"ON score_types.batch_id=structure_scores.batch_id " \
+            f"AND score_types.score_type_id=" \
+            f"structure_scores.score_type_id\n" \
+            f"WHERE structure_scores.struct_id > ?\n" \
+            f"GROUP BY 1, 2, 3\n" \
+            f"ORDER BY 1, 2, 3"
+    
+        # Read the query into a data frame
+        df = pd.read_sql_query(\
+                query,
+                connection,
+                params = [traj_stride, n_batches, *sc_types, last_id])
+
     # If something went wrong, raise an error
     except Exception as e:
         errstr = f"Could not query the .db3 file ({db3_out}): {e}"
         raise IOError(errstr)
-    
-    # Function to renumber the structure IDs
-    get_new_id = \
-        lambda x: traj_stride * (1 + (int(x - 1) // n_batches))
-    
-    # Function to rename the structures
-    get_new_name = \
-        lambda x: x.replace("_dbreport", "") \
-        if x.endswith('_dbreport') else x
-    
-    # Renumber the structure IDs
-    df[b_steps_col] = df[struct_id_col].apply(get_new_id)
-    
-    # Rename the structures
-    df[state_col] = df[name_col].apply(get_new_name)
-    
-    # Convert the dataframe into a pivot table
-    df = \
-        df.pivot_table(index = [state_col, b_steps_col, scf_name_col],
-                       columns = sc_type_col,
-                       values = sc_value_col).reset_index()
+
+    # Close the connection
+    finally:
+        connection.close()
     
     # Add a column for the structure number
     df[struct_num_col] = struct_num
@@ -246,12 +543,6 @@ def parse_output_flexddg(db3_out,
     # Add the complete score function name to the
     # score function name column
     df[scf_name_col] = scf_name
-    
-    # Remove unnecessary column names
-    df.columns.names = [None]
-    
-    # Close the connection
-    connection.close()
 
     # Return the data frame
     return df
@@ -461,6 +752,146 @@ def generate_output_dataframes(dg_wt,
     return (aggr_df, struct_df)
 
 
+def try_parse_output_flexddg(db3_out,
+                             traj_stride,
+                             struct_num,
+                             scf_name,
+                             list_contributions = None):
+    """Parse the .db3 output from flexddg protocols and return
+    a data frame, or None (with a warning) if the output could
+    not be parsed, so that a broken structure does not prevent
+    the aggregation of the others.
+    """
+
+    # Try to parse the output
+    try:
+        return parse_output_flexddg(\
+                    db3_out = db3_out,
+                    traj_stride = traj_stride,
+                    struct_num = struct_num,
+                    scf_name = scf_name,
+                    list_contributions = list_contributions)
+
+    # If something went wrong, warn the user
+    except Exception as e:
+        logger = reset_worker_logger()
+        logger.warning(f"Could not parse {db3_out}: {e}")
+        return None
+
+
+def aggregate_mutation(df,
+                       family,
+                       mutation,
+                       mut_label,
+                       pos_label,
+                       rescale,
+                       list_contributions,
+                       conv_fact,
+                       out_files,
+                       dfs_options,
+                       out_format = "csv",
+                       df_key = None):
+    """Aggregate the data parsed for a mutation (a data frame for
+    cartddg protocols, a list of data frames, one per structure,
+    for flexddg protocols), generate the aggregated and
+    all-structures data frames, write them to 'out_files' and
+    return them.
+
+    If 'out_format' is a columnar format, 'out_files' are the
+    paths to the aggregated and all-structures datasets, and
+    the data frames are written there as fragments named after
+    the mutation's label.
+
+    For cartddg protocols, 'df' may hold the data parsed for
+    several mutations at once (see 'parse_outputs_cartddg'): in
+    this case, 'df_key' is the output file of the mutation.
+    """
+
+    # If the data frame holds the data of several mutations,
+    # select the data of the mutation
+    if df_key is not None:
+        df = df.loc[df_key].reset_index(drop = True)
+
+    # If the protocol is a flexddg protocol
+    if family == "flexddg":
+
+        # Get the data frames of the structures that could be
+        # parsed
+        dfs = [struct_df for struct_df in df if struct_df is not None]
+
+        # If no structure could be parsed, raise an error
+        if not dfs:
+            errstr = "no structure could be parsed."
+            raise ValueError(errstr)
+
+        # Aggregate the data
+        dg_wt, dg_mut, ddg = \
+            aggregate_data_flexddg(\
+                df = pd.concat(dfs),
+                list_contributions = list_contributions)
+
+    # If the protocol is a cartddg protocol
+    else:
+
+        # Aggregate the data
+        dg_wt, dg_mut, ddg = \
+            aggregate_data_cartddg(\
+                df = df,
+                list_contributions = list_contributions)
+
+    # Generate the aggregated and all-structures data frames
+    aggr_df, struct_df = \
+        generate_output_dataframes(\
+            dg_wt = dg_wt,
+            dg_mut = dg_mut,
+            ddg = ddg,
+            mutation = mutation,
+            mut_label = mut_label,
+            pos_label = pos_label,
+            rescale = rescale,
+            list_contributions = list_contributions,
+            conv_fact = conv_fact,
+            family = family)
+
+    # Write the data frames (here, so that writing overlaps with
+    # the aggregation of other mutations)
+    if out_format == "csv":
+        aggr_df.to_csv(out_files[0], **dfs_options)
+        struct_df.to_csv(out_files[1], **dfs_options)
+
+    # If the data frames should be written as part of columnar
+    # datasets
+    else:
+        for out_df, dataset_path in zip((aggr_df, struct_df), out_files):
+            columnar.write_fragment(df = out_df,
+                                    dataset_path = dataset_path,
+                                    name = mut_label,
+                                    out_format = out_format)
+
+    # Return the data frames
+    return aggr_df, struct_df
+
+
+def load_mutation(out_files,
+                  mut_label,
+                  out_format = "csv"):
+    """Load the aggregated and all-structures data frames of a
+    mutation written by a previous aggregation.
+    """
+
+    # If the data frames were written as CSV files
+    if out_format == "csv":
+        return tuple(pd.read_csv(out_file) for out_file in out_files)
+
+    # Otherwise, load the mutation's fragments of the datasets
+    return tuple(\
+        columnar.load_dataframe(\
+            columnar.get_fragment_path(dataset_path = dataset_path,
+                                       name = mut_label,
+                                       out_format = out_format)) \
+        for dataset_path in out_files)
+
+
 def write_mutatex_df(dfs,
                      mutatex_file,
                      index,
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    aggregationindex.py
+#
+#    Utility functions to keep track of the outputs already
+#    parsed during data aggregation, so that only new or
+#    modified outputs are parsed again.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+
+
+
+# Standard library
+import hashlib
+import json
+import logging as log
+import os
+import os.path
+import tempfile
+# RosettaDDGPrediction
+from . import caching
+
+
+
+def get_settings_key(**settings):
+    """Get a key identifying the settings the aggregated data
+    depend on (i.e. the energy contributions, the conversion
+    factor or the output format), so that the index is discarded
+    if any of them changes.
+    """
+
+    # Return the hash of the settings (serialized with sorted
+    # keys so that it does not depend on their order)
+    return hashlib.sha256(\
+        json.dumps(settings, sort_keys = True).encode()).hexdigest()
+
+
+def get_file_record(file_path):
+    """Get the record of an output file stored in the index
+    (its size, modification time and SHA-256 hash).
+    """
+
+    # Get the file status
+    stat = os.stat(file_path)
+
+    # Return the record
+    return {"size" : stat.st_size,
+            "mtime_ns" : stat.st_mtime_ns,
+            "sha256" : caching.get_file_hash(file_path)}
+
+
+def get_file_records(files):
+    """Get the records of the output files parsed for a mutation.
+    """
+
+    # Return a dictionary mapping each file to its record
+    return {f : get_file_record(f) for f in files}
+
+
+def load_index(index_file,
+               settings_key):
+    """Load the entries of the aggregation index. An empty index
+    is returned if the file does not exist, cannot be read or
+    was written with different settings.
+    """
+
+    # If the index does not exist, all outputs must be parsed
+    if not os.path.exists(index_file):
+        return {}
+
+    # Try to load the index
+    try:
+        with open(index_file, "r") as f:
+            index = json.load(f)
+
+    # If the index cannot be read, warn the user and ignore it
+    except (OSError, ValueError) as e:
+        warnstr = f"Could not read the aggregation index " \
+                  f"{index_file} ({e}). All outputs will be parsed."
+        log.warning(warnstr)
+        return {}
+
+    # If the index was written with different settings,
+    # ignore it
+    if index.get("settings") != settings_key:
+        infostr = f"The aggregation settings changed since " \
+                  f"{index_file} was written. All outputs will " \
+                  f"be parsed."
+        log.info(infostr)
+        return {}
+
+    # Return the entries of the index
+    return index["entries"]
+
+
+def check_entry(entry,
+                mutation,
+                files):
+    """Check whether the entry of a mutation in the index is
+    still valid, i.e. whether the mutation is the same and its
+    output files are the same, with the same contents. Return
+    the (possibly refreshed) records of the files if it is
+    valid, None otherwise.
+    """
+
+    # If the mutation is not in the index or it changed (i.e. its
+    # label), it must be parsed
+    if entry is None or entry["mutation"] != list(mutation):
+        return None
+
+    # Get the records of the files parsed for the mutation
+    records = entry["files"]
+
+    # If files were added or removed (i.e. more structures were
+    # generated), the mutation must be parsed again
+    if set(records) != set(files):
+        return None
+
+    # Create an empty dictionary to store the refreshed records
+    new_records = {}
+
+    # For each file
+    for f in files:
+
+        # Try to get the file status
+        try:
+            stat = os.stat(f)
+
+        # If the file does not exist anymore, the mutation must
+        # be parsed again
+        except FileNotFoundError:
+            return None
+
+        # Get the record of the file in the index
+        record = records[f]
+
+        # If the size and the modification time did not change,
+        # assume the file did not change (cheap check)
+        if stat.st_size == record["size"] \
+        and stat.st_mtime_ns == record["mtime_ns"]:
+            new_records[f] = record
+            continue
+
+        # If the size changed, the file changed
+        if stat.st_size != record["size"]:
+            return None
+
+        # Otherwise, compare the contents (the file may just have
+        # been touched or copied)
+        new_record = get_file_record(f)
+        if new_record["sha256"] != record["sha256"]:
+            return None
+
+        # Refresh the record
+        new_records[f] = new_record
+
+    # The entry is valid
+    return new_records
+
+
+def write_index(index_file,
+                settings_key,
+                entries):
+    """Write the aggregation index. The index is first written
+    to a temporary file, so that an interrupted write does not
+    corrupt it.
+    """
+
+    # Assemble the index
+    index = {"settings" : settings_key,
+             "entries" : entries}
+
+    # Create a temporary file in the same directory
+    fd, tmp_file = \
+        tempfile.mkstemp(dir = os.path.dirname(index_file),
+                         prefix = ".")
+
+    # Try to write the index
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+
+        # Move the file in place (atomic on POSIX file systems)
+        os.replace(tmp_file, index_file)
+
+    # If something went wrong, remove the temporary file
+    except BaseException:
+        os.remove(tmp_file)
+        raise
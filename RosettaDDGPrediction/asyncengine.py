@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    asyncengine.py
+#
+#    A lightweight, single-node alternative to a Dask cluster,
+#    running the tasks in threads and the Rosetta processes on
+#    an asyncio event loop.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import os
+import signal
+import subprocess
+import threading
+import uuid
+
+
+
+# Thread-local storage for the engine running the current task
+# and the key of the task
+_local = threading.local()
+
+
+def get_current_engine():
+    """Get the engine running the current task, if the task is
+    being run by an engine (None otherwise).
+    """
+
+    return getattr(_local, "engine", None)
+
+
+def get_current_key():
+    """Get the key of the task currently being run by an engine
+    in the current thread (None if no task is being run).
+    """
+
+    return getattr(_local, "key", None)
+
+
+def _find_futures(obj):
+    """Find the futures in an object (possibly nested in lists,
+    tuples and dictionaries).
+    """
+
+    # If the object is a future, return it
+    if isinstance(obj, AsyncioFuture):
+        return [obj]
+
+    # If the object is a list or a tuple, look in its items
+    if isinstance(obj, (list, tuple)):
+        return [f for item in obj for f in _find_futures(item)]
+
+    # If the object is a dictionary, look in its values
+    if isinstance(obj, dict):
+        return [f for val in obj.values() for f in _find_futures(val)]
+
+    # Otherwise, there are no futures
+    return []
+
+
+def _resolve(obj):
+    """Replace the futures in an object (possibly nested in lists,
+    tuples and dictionaries) with their results, as Dask does with
+    the arguments of a task.
+    """
+
+    # If the object is a future, return its result
+    if isinstance(obj, AsyncioFuture):
+        return obj.result()
+
+    # If the object is a named tuple, resolve its fields
+    if isinstance(obj, tuple) and hasattr(obj, "_fields"):
+        return type(obj)(*(_resolve(item) for item in obj))
+
+    # If the object is a list or a tuple, resolve its items
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_resolve(item) for item in obj)
+
+    # If the object is a dictionary, resolve its values
+    if isinstance(obj, dict):
+        return {key : _resolve(val) for key, val in obj.items()}
+
+    # Otherwise, return the object itself
+    return obj
+
+
+class AsyncioFuture:
+    """The future of a task submitted to an 'AsyncioClient',
+    exposing the subset of the interface of Dask futures used
+    by RosettaDDGPrediction.
+    """
+
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self._future = concurrent.futures.Future()
+
+    def __repr__(self):
+        return f"<AsyncioFuture: {self.status}, key: {self.key}>"
+
+    @property
+    def status(self):
+        """The status of the task ('pending', 'finished', 'error'
+        or 'cancelled').
+        """
+
+        if self._future.cancelled():
+            return "cancelled"
+        if not self._future.done():
+            return "pending"
+        if self._future.exception() is not None:
+            return "error"
+        return "finished"
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout = None):
+        return self._future.result(timeout = timeout)
+
+    def exception(self, timeout = None):
+        return self._future.exception(timeout = timeout)
+
+    def cancel(self):
+        return self._future.cancel()
+
+    def add_done_callback(self, fn):
+        self._future.add_done_callback(lambda f: fn(self))
+
+
+class AsyncioClient:
+    """An engine running the tasks of a run on the local node,
+    exposing the subset of the interface of a Dask client used by
+    RosettaDDGPrediction. The tasks are run in a pool of threads
+    (in order of priority, as soon as their dependencies are
+    complete), while the Rosetta processes they launch are run
+    and reaped by a single asyncio event loop, no more than the
+    number of available cores at a time.
+    """
+
+    def __init__(self, n_proc, n_threads = None):
+
+        # Cores available to the Rosetta processes
+        self.n_cores = n_proc
+        self._free_cores = n_proc
+
+        # Tasks ready to be run (a heap of tuples (negated
+        # priority, submission order, task))
+        self._ready = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Start the event loop running the Rosetta processes
+        self._loop = asyncio.new_event_loop()
+        self._cores_cond = None
+        threading.Thread(target = self._loop.run_forever,
+                         name = "asyncengine-loop",
+                         daemon = True).start()
+        asyncio.run_coroutine_threadsafe(\
+            self._init_loop(), self._loop).result()
+
+        # Start the threads running the tasks (twice as many as
+        # the cores, so that tasks can prepare their inputs and
+        # clean up while others wait for the Rosetta processes)
+        for i in range(n_threads or 2 * n_proc):
+            threading.Thread(target = self._work,
+                             name = f"asyncengine-{i}",
+                             daemon = True).start()
+
+    def __repr__(self):
+        return f"<AsyncioClient: {self.n_cores} cores>"
+
+    async def _init_loop(self):
+        # The condition must be created inside the event loop
+        self._cores_cond = asyncio.Condition()
+
+    #-------------------------- Tasks --------------------------#
+
+    def submit(self,
+               func,
+               *args,
+               priority = 0,
+               resources = None,
+               pure = True,
+               key = None,
+               **kwargs):
+        """Submit a task. Futures among the arguments are replaced
+        by their results once complete. 'resources' and 'pure' are
+        accepted for compatibility with Dask and ignored (the cores
+        are reserved by the Rosetta processes themselves).
+        """
+
+        # Create the future of the task
+        future = \
+            AsyncioFuture(\
+                key = key or \
+                    f"{getattr(func, '__name__', 'task')}-" \
+                    f"{uuid.uuid4().hex}",
+                client = self)
+
+        # Get the task
+        task = (func, args, kwargs, future)
+
+        # Get the futures the task depends on
+        deps = _find_futures((args, kwargs))
+
+        # If it does not depend on any, it is ready
+        if not deps:
+            self._push(priority, task)
+            return future
+
+        # Otherwise, it will be ready once all of them are complete
+        remaining = [len(deps)]
+        lock = threading.Lock()
+
+        def on_dep_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._push(priority, task)
+
+        for dep in deps:
+            dep._future.add_done_callback(on_dep_done)
+
+        # Return the future
+        return future
+
+    def _push(self,
+              priority,
+              task):
+        """Add a task to the tasks ready to be run.
+        """
+
+        with self._cond:
+            heapq.heappush(self._ready,
+                           (-priority, next(self._order), task))
+            self._cond.notify()
+
+    def _work(self):
+        """Run the ready tasks, highest priority first.
+        """
+
+        # Make the engine available to the tasks run in this thread
+        _local.engine = self
+
+        while True:
+
+            # Wait for a task to be ready
+            with self._cond:
+                while not self._ready and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                _, _, (func, args, kwargs, future) = \
+                    heapq.heappop(self._ready)
+
+            # Skip tasks cancelled in the meantime
+            if not future._future.set_running_or_notify_cancel():
+                continue
+
+            # Run the task
+            _local.key = future.key
+            try:
+                result = func(*_resolve(args), **_resolve(kwargs))
+            except BaseException as e:
+                future._future.set_exception(e)
+            else:
+                future._future.set_result(result)
+            finally:
+                _local.key = None
+
+    def gather(self, futures):
+        """Wait for one or more futures and return their results
+        (raising the exception of the first failed task, if any).
+        """
+
+        # If a single future was passed, return its result
+        if isinstance(futures, AsyncioFuture):
+            return futures.result()
+
+        # Otherwise, return the results of all futures
+        return [f.result() for f in futures]
+
+    def cancel(self, futures):
+        """Cancel one or more tasks not started yet.
+        """
+
+        # If a single future was passed, cancel it
+        if isinstance(futures, AsyncioFuture):
+            futures = [futures]
+
+        # Cancel the futures
+        for f in futures:
+            f.cancel()
+
+    def run(self,
+            func,
+            *args,
+            **kwargs):
+        """Run a function on all "workers", i.e. in the current
+        process, returning a dictionary mapping each worker to
+        the result.
+        """
+
+        return {"local" : func(*args, **kwargs)}
+
+    def close(self):
+        """Stop the threads and the event loop.
+        """
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    #---------------------- Rosetta processes ----------------------#
+
+    def run_process(self,
+                    args,
+                    output,
+                    wd,
+                    n_cores = 1,
+                    timeout = None,
+                    on_start = None):
+        """Run a process on 'n_cores' cores (waiting for them to be
+        free) in a session of its own, writing its standard output
+        and error to 'output', and wait for it to complete (killing
+        it together with its process group after 'timeout' seconds,
+        if given). 'on_start' is called with the PID once the
+        process is launched. Return its PID, its return code,
+        whether it timed out and the resources it used (including
+        those of the processes it waited for, i.e. the MPI ranks).
+        """
+
+        return asyncio.run_coroutine_threadsafe(\
+            self._run_process(args = args,
+                              output = output,
+                              wd = wd,
+                              n_cores = min(n_cores, self.n_cores),
+                              timeout = timeout,
+                              on_start = on_start),
+            self._loop).result()
+
+    async def _run_process(self,
+                           args,
+                           output,
+                           wd,
+                           n_cores,
+                           timeout,
+                           on_start):
+
+        # Wait for the cores to be free and reserve them
+        async with self._cores_cond:
+            await self._cores_cond.wait_for(\
+                lambda: self._free_cores >= n_cores)
+            self._free_cores -= n_cores
+
+        try:
+
+            # Launch the process (it is reaped by the event loop,
+            # not by an asyncio child watcher, so that the
+            # resources it used can be collected)
+            with open(output, "w") as out:
+                popen = subprocess.Popen(args,
+                                         stdout = out,
+                                         stderr = subprocess.STDOUT,
+                                         cwd = wd,
+                                         start_new_session = True)
+
+            # Notify that the process was launched
+            if on_start is not None:
+                on_start(popen.pid)
+
+            # Set a timer killing the process with its process
+            # group when it runs out of time (if a time limit was
+            # set)
+            timed_out = []
+            timer = None
+            if timeout is not None:
+                def kill_timed_out():
+                    timed_out.append(True)
+                    try:
+                        os.killpg(popen.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                timer = self._loop.call_later(timeout, kill_timed_out)
+
+            # Wait for the process to complete
+            try:
+                status, rusage = await _wait_process(popen.pid)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+            # Let the Popen object know that the process has been
+            # reaped, so that it never waits for the same PID again
+            popen.returncode = os.waitstatus_to_exitcode(status)
+
+            # Return the PID, the return code, whether it timed out
+            # and the resources it used
+            return popen.pid, popen.returncode, bool(timed_out), rusage
+
+        finally:
+
+            # Release the cores
+            async with self._cores_cond:
+                self._free_cores += n_cores
+                self._cores_cond.notify_all()
+
+
+async def _wait_process(pid,
+                        poll = 0.1):
+    """Wait for a child process to exit without blocking the event
+    loop and reap it, returning its exit status and the resources
+    it used. The process is watched through a file descriptor
+    referring to it where supported (Linux), and polled every
+    'poll' seconds otherwise.
+    """
+
+    # Create a future to be set once the process is reaped
+    loop = asyncio.get_running_loop()
+    reaped = loop.create_future()
+
+    def reap():
+        # Reap the process if it has exited
+        if not reaped.done():
+            wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if wpid != 0:
+                reaped.set_result((status, rusage))
+
+    # Try to get a file descriptor referring to the process
+    # (readable once it has exited)
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None
+
+    # If there is none, poll the process
+    if pidfd is None:
+        while True:
+            reap()
+            if reaped.done():
+                return reaped.result()
+            await asyncio.sleep(poll)
+
+    # Otherwise, reap the process once it has exited
+    loop.add_reader(pidfd, reap)
+    try:
+        return await reaped
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+
+def wait(futures,
+         timeout = None,
+         return_when = "ALL_COMPLETED"):
+    """Wait for the futures of an 'AsyncioClient', mirroring
+    'distributed.wait' (a TimeoutError is raised if the waiting
+    condition is not met before the timeout).
+    """
+
+    # Get the futures
+    futures = list(futures)
+
+    # Wait for the underlying futures
+    done, not_done = \
+        concurrent.futures.wait([f._future for f in futures],
+                                timeout = timeout,
+                                return_when = return_when)
+
+    # If the condition was not met in time, raise an error
+    if (return_when == "ALL_COMPLETED" and not_done) \
+    or (futures and not done):
+        raise TimeoutError(f"Futures not done within {timeout} s.")
+
+    # Return the futures done and not done
+    return ({f for f in futures if f._future in done},
+            {f for f in futures if f._future in not_done})
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    backends.py
+#
+#    Utility functions to set up the Dask cluster the tasks
+#    are run on (local, existing scheduler or job queue).
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import importlib
+import logging as log
+# Third-party packages
+from dask.utils import parse_bytes
+import distributed
+from distributed import (
+    Client,
+    LocalCluster
+)
+from distributed.system import MEMORY_LIMIT
+# RosettaDDGPrediction
+from . import asyncengine
+
+
+
+def get_task_resources(settings,
+                       n_cores):
+    """Get the Dask resources to be reserved by a task running
+    Rosetta on 'n_cores' cores (one process per core), or None
+    if no resources should be reserved.
+    """
+
+    # Get the resources options
+    resources = settings["resources"]
+
+    # If no resources should be reserved, return None
+    if not resources["useresources"]:
+        return None
+
+    # The task reserves one core per Rosetta process
+    task_resources = {"cores" : n_cores}
+
+    # If the memory used by each Rosetta process is known
+    if resources["memoryperprocess"] is not None:
+
+        # The task also reserves the memory used by all of its
+        # Rosetta processes
+        task_resources["memory"] = \
+            n_cores * parse_bytes(resources["memoryperprocess"])
+
+    # Return the resources
+    return task_resources
+
+
+def get_worker_resources(settings,
+                         n_cores,
+                         memory = MEMORY_LIMIT):
+    """Get the Dask resources declared by a worker that can use
+    'n_cores' cores and 'memory' bytes of memory.
+    """
+
+    # The worker declares its cores
+    worker_resources = {"cores" : n_cores}
+
+    # If the tasks reserve memory, declare the memory too
+    if settings["resources"]["memoryperprocess"] is not None:
+        worker_resources["memory"] = memory
+
+    # Return the resources
+    return worker_resources
+
+
+def _format_worker_resources(worker_resources):
+    """Format the resources declared by a worker as the argument
+    of the --resources option of 'dask worker'.
+    """
+
+    return ",".join(f"{k}={int(v)}" \
+                    for k, v in worker_resources.items())
+
+
+def get_client(settings,
+               n_proc,
+               use_resources = False):
+    """Get a Dask client connected to the cluster defined in
+    the 'backend' section of the run settings, using 'n_proc'
+    workers when the workers are started by RosettaDDGPrediction.
+    If 'use_resources' is True and resources are enabled in the
+    settings, the workers declare the cores and memory they can
+    use, so that tasks reserving them are placed accordingly.
+    Return the client and the cluster (None if connecting to an
+    existing scheduler).
+    """
+
+    # Get whether the workers should declare their resources
+    use_resources = \
+        use_resources and settings["resources"]["useresources"]
+
+    # Get the backend options
+    backend = settings["backend"]
+
+    # Get the type of backend
+    backend_type = backend["type"]
+
+    # If a local cluster was requested
+    if backend_type == "local":
+
+        # If the workers should declare their resources
+        if use_resources:
+
+            # Use a single worker owning all cores, so that a task
+            # reserving several cores (i.e. an MPI run) and tasks
+            # reserving a single core can share the machine
+            # without oversubscribing it (each Rosetta process
+            # runs in a subprocess, therefore threads suffice)
+            cluster_opts = dict(settings["localcluster"])
+            cluster_opts["threads_per_worker"] = n_proc
+
+            # Create the local cluster
+            cluster = \
+                LocalCluster(n_workers = 1,
+                             resources = \
+                                get_worker_resources(settings, n_proc),
+                             **cluster_opts)
+
+        # Otherwise
+        else:
+
+            # Create the local cluster
+            cluster = LocalCluster(n_workers = n_proc,
+                                   **settings["localcluster"])
+
+    # If the lightweight asyncio engine was requested
+    elif backend_type == "asyncio":
+
+        # Inform the user about the engine
+        logstr = \
+            f"Running the tasks with the asyncio engine on " \
+            f"{n_proc} core(s)."
+        log.info(logstr)
+
+        # Return the engine (no cluster is managed, and the cores
+        # are reserved by the Rosetta processes themselves)
+        return asyncengine.AsyncioClient(n_proc = n_proc), None
+
+    # If an existing scheduler should be used
+    elif backend_type == "scheduler":
+
+        # Inform the user about the scheduler
+        logstr = \
+            f"Connecting to the Dask scheduler at " \
+            f"{backend['address']}."
+        log.info(logstr)
+
+        # Open the client connected to the scheduler (the workers
+        # are managed outside RosettaDDGPrediction)
+        client = Client(backend["address"])
+
+        # If the workers should declare their resources but none
+        # of the workers connected so far does
+        if use_resources \
+        and not any("cores" in w.get("resources", {}) for w in \
+                    client.scheduler_info()["workers"].values()):
+
+            # Warn the user that tasks will not be run until
+            # workers declaring their resources connect
+            warnstr = \
+                "No worker connected to the scheduler declares " \
+                "its 'cores' resource. Start the workers with " \
+                "'dask worker --resources cores=N' (and " \
+                "'memory=BYTES', if 'memoryperprocess' is set), " \
+                "or set 'useresources' to False in the " \
+                "'resources' section."
+            log.warning(warnstr)
+
+        # Return the client (no cluster is managed)
+        return client, None
+
+    # If the workers should be spawned through a job queue
+    elif backend_type == "jobqueue":
+
+        # Try to import dask-jobqueue (optional dependency)
+        try:
+            jobqueue = importlib.import_module("dask_jobqueue")
+
+        # If it is not installed, raise an error
+        except ImportError:
+            errstr = \
+                "The 'jobqueue' backend requires the " \
+                "'dask-jobqueue' package to be installed."
+            raise ImportError(errstr)
+
+        # Get the class of the cluster (i.e. SLURMCluster)
+        cluster_class = getattr(jobqueue, backend["jobqueuecluster"])
+
+        # Get the options for the cluster
+        jobqueue_opts = dict(backend["jobqueueoptions"])
+
+        # If the workers should declare their resources
+        if use_resources:
+
+            # Get the number of worker processes per job
+            n_processes = jobqueue_opts.get("processes", 1)
+
+            # Get the resources of each worker (the cores and
+            # memory of the job are split among its processes)
+            worker_resources = \
+                get_worker_resources(\
+                    settings = settings,
+                    n_cores = \
+                        jobqueue_opts.get("cores", 1) // n_processes,
+                    memory = \
+                        parse_bytes(jobqueue_opts.get("memory", "0")) \
+                        // n_processes)
+
+            # Declare them when starting the workers
+            jobqueue_opts["worker_extra_args"] = \
+                list(jobqueue_opts.get("worker_extra_args", [])) \
+                + ["--resources",
+                   _format_worker_resources(worker_resources)]
+
+        # Create the cluster
+        cluster = cluster_class(**jobqueue_opts)
+
+        # Request the workers
+        cluster.scale(n_proc)
+
+        # Inform the user about the job script used
+        logstr = \
+            f"Workers will be started through the following " \
+            f"job script:\n{cluster.job_script()}"
+        log.info(logstr)
+
+    # Otherwise, raise an error
+    else:
+        errstr = \
+            f"Unrecognized backend type '{backend_type}'. " \
+            f"Supported types are 'local', 'asyncio', " \
+            f"'scheduler' and 'jobqueue'."
+        raise ValueError(errstr)
+
+    # Open the client from the cluster
+    return Client(cluster), cluster
+
+
+def wait(futures,
+         timeout = None,
+         return_when = "ALL_COMPLETED"):
+    """Wait for futures of either a Dask client or the asyncio
+    engine (see 'distributed.wait').
+    """
+
+    # Get the futures
+    futures = list(futures)
+
+    # If they belong to the asyncio engine, wait for them there
+    if any(isinstance(f, asyncengine.AsyncioFuture) for f in futures):
+        return asyncengine.wait(futures = futures,
+                                timeout = timeout,
+                                return_when = return_when)
+
+    # Otherwise, wait for them with Dask
+    return distributed.wait(futures,
+                            timeout = timeout,
+                            return_when = return_when)
+
+
+def wait_in_flight(futures,
+                   max_in_flight):
+    """Wait until no more than 'max_in_flight' futures are still
+    pending and return the pending ones, so that the references
+    to the completed futures (and their results) can be dropped.
+    As when gathering the futures, the error of a failed future
+    is raised.
+    """
+
+    # Get the futures still pending
+    pending = [f for f in futures if not f.done()]
+
+    # While too many futures are pending
+    while len(pending) > max_in_flight:
+
+        # Wait for any of them to complete
+        wait(pending, return_when = "FIRST_COMPLETED")
+
+        # Update the futures still pending
+        pending = [f for f in pending if not f.done()]
+
+    # For each completed future
+    for f in futures:
+
+        # If it failed, raise its error
+        if f.done() and f.status == "error":
+            f.result()
+
+    # Return the futures still pending
+    return pending
+
+
+def as_completed(futures):
+    """Iterate over futures of either a Dask client or the asyncio
+    engine as they complete (see 'distributed.as_completed').
+    """
+
+    # Get the futures
+    futures = list(futures)
+
+    # If they belong to the asyncio engine
+    if any(isinstance(f, asyncengine.AsyncioFuture) for f in futures):
+
+        # Keep track of the futures not completed yet
+        not_done = futures
+
+        # While some futures are not completed
+        while not_done:
+
+            # Wait for any of them to complete
+            done, not_done = \
+                asyncengine.wait(futures = not_done,
+                                 return_when = "FIRST_COMPLETED")
+
+            # Yield the futures completed
+            yield from done
+
+    # Otherwise, let Dask iterate over them
+    else:
+        yield from distributed.as_completed(futures)
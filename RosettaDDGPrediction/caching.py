@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    caching.py
+#
+#    Utility functions to cache the results of the ΔΔG
+#    calculations so that they can be reused across runs.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import functools
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import uuid
+# RosettaDDGPrediction
+from .dask_patches import reset_worker_logger
+from .defaults import (
+    MUT_DIR_NAME,
+    MUT_DIR_PATH
+)
+
+
+
+def get_file_hash(file_path):
+    """Get the SHA-256 hash of the contents of a file.
+    """
+
+    # Create the hash
+    file_hash = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+
+        # Read the file in chunks to keep memory usage low
+        for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+            file_hash.update(chunk)
+
+    # Return the hexadecimal digest
+    return file_hash.hexdigest()
+
+
+@functools.lru_cache(maxsize = None)
+def get_executable_identity(executable):
+    """Get a string identifying a Rosetta executable (its
+    real path, size and modification time). Hashing the
+    executable itself would be too expensive, since Rosetta
+    executables are usually statically linked.
+    """
+
+    # Resolve possible symbolic links
+    real_path = os.path.realpath(executable)
+
+    # Get the file status
+    stat = os.stat(real_path)
+
+    # Return the identity of the executable
+    return f"{real_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _normalize_options(options,
+                       file_hashes):
+    """Return a copy of a dictionary of Rosetta options where
+    the paths to the input files are replaced by the hashes of
+    their contents, so that the same inputs stored in different
+    places map to the same options.
+    """
+
+    # Create an empty dictionary to store the normalized options
+    norm_options = {}
+
+    # For each option and associated value
+    for key, val in options.items():
+
+        # If the value is a dictionary (i.e. variable substitutions
+        # in a RosettaScript), normalize it recursively
+        if isinstance(val, dict):
+            norm_options[key] = _normalize_options(val, file_hashes)
+
+        # Otherwise, substitute the value with the hash of the
+        # file it points to, if any
+        else:
+            norm_options[key] = file_hashes.get(val, val)
+
+    # Return the normalized options
+    return norm_options
+
+
+def get_cache_key(options,
+                  mut,
+                  executable,
+                  in_files,
+                  extra = None):
+    """Get the key identifying the results of a ΔΔG calculation
+    in the cache, given the Rosetta options used to run it,
+    the mutation, the Rosetta executable, the input files whose
+    paths appear among the options (i.e. the input PDB file and
+    the RosettaScript, if any) and possibly extra data affecting
+    the results.
+    """
+
+    # Get the hashes of the input files
+    file_hashes = \
+        {f : f"sha256:{get_file_hash(f)}" for f in in_files \
+         if f is not None}
+
+    # Get the mutation attributes that define the mutation (the
+    # directory names are only related to where it is run)
+    mut_data = \
+        {k : v for k, v in mut.items() \
+         if k not in (MUT_DIR_PATH, MUT_DIR_NAME)}
+
+    # Assemble all data the results depend on
+    key_data = \
+        {"options" : _normalize_options(options, file_hashes),
+         "mutation" : mut_data,
+         "executable" : get_executable_identity(executable),
+         "extra" : extra}
+
+    # Return the hash of the data (serialized with sorted keys
+    # so that it does not depend on the order of the options)
+    return hashlib.sha256(\
+        json.dumps(key_data, sort_keys = True).encode()).hexdigest()
+
+
+def _get_entry_path(cache_dir,
+                    key):
+    """Get the path to the directory storing a cache entry.
+    """
+
+    # Entries are spread over sub-directories named after the
+    # first characters of the key to avoid huge directories
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def restore_from_cache(cache_dir,
+                       key,
+                       wd,
+                       link = False,
+                       keep = ()):
+    """Restore the results stored in a cache entry into a
+    working directory, replacing the files already there
+    (e.g. the outputs of a previous, incomplete run) except
+    for those in 'keep' (the input files written for the
+    current run). Return True if the entry was found, False
+    otherwise.
+    """
+
+    # Reset the worker's logger so that log messsages reach
+    # the output
+    logger = reset_worker_logger()
+
+    # Get the path to the entry
+    entry_path = _get_entry_path(cache_dir, key)
+
+    # If the entry does not exist, it is a cache miss
+    if not os.path.isdir(entry_path):
+        return False
+
+    # Make sure that the working directory exists. If not, create it.
+    os.makedirs(wd, exist_ok = True)
+
+    # For each item in the entry
+    for item in os.listdir(entry_path):
+
+        # Do not overwrite the input files already written for the
+        # current run (i.e. the flags file, whose paths refer to
+        # the current run)
+        if item in keep:
+            continue
+
+        # Get the paths to the cached item, to its destination
+        # and to the temporary copy it is restored through (so
+        # that a partially restored item is never seen in place
+        # of the destination)
+        src = os.path.join(entry_path, item)
+        dst = os.path.join(wd, item)
+        tmp = os.path.join(wd, f".{item}.tmp-{uuid.uuid4().hex}")
+
+        # If the item is a directory, copy it and replace the
+        # destination (a directory cannot replace a non-empty
+        # one in a single step)
+        if os.path.isdir(src):
+            shutil.copytree(src, tmp)
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+            os.replace(tmp, dst)
+            continue
+
+        # If linking the files has been requested
+        if link:
+
+            # Try to hard-link the file
+            try:
+                os.link(src, tmp)
+                os.replace(tmp, dst)
+                continue
+
+            # If the cache lives on a different file system,
+            # fall back to copying the file
+            except OSError:
+                pass
+
+        # Copy the file
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+
+    # Inform the user that the results were taken from the cache
+    logger.info(f"Results for {wd} were restored from the cache " \
+                f"({entry_path}).")
+
+    # It is a cache hit
+    return True
+
+
+def store_in_cache(cache_dir,
+                   key,
+                   wd):
+    """Store the contents of a working directory in a cache
+    entry.
+    """
+
+    # Get the path to the entry
+    entry_path = _get_entry_path(cache_dir, key)
+
+    # If the entry already exists (i.e. another run stored the
+    # same results in the meantime), there is nothing to do
+    if os.path.isdir(entry_path):
+        return
+
+    # Make sure that the parent directory exists. If not, create it.
+    os.makedirs(os.path.dirname(entry_path), exist_ok = True)
+
+    # Copy the results into a temporary directory first, so that
+    # an incomplete entry is never visible in the cache
+    tmp_path = f"{entry_path}.tmp-{uuid.uuid4().hex}"
+    shutil.copytree(wd, tmp_path)
+
+    # Try to move the temporary directory to the entry path
+    # (atomic on POSIX file systems)
+    try:
+        os.rename(tmp_path, entry_path)
+
+    # If another run stored the same entry in the meantime,
+    # discard the copy
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors = True)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    columnar.py
+#
+#    Utility functions to write the aggregated data as columnar
+#    (Parquet or Arrow IPC) datasets and to load them back.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+
+
+
+# Standard library
+import importlib
+import os
+import os.path
+import tempfile
+# RosettaDDGPrediction
+from .defaults import (
+    COLUMNAR_CATEGORICAL_COLS,
+    OUTPUT_FORMATS
+)
+
+
+
+def import_pyarrow():
+    """Import the 'pyarrow' modules needed to write and read
+    columnar datasets ('pyarrow' is an optional dependency).
+    """
+
+    # Try to import the modules
+    try:
+        pa = importlib.import_module("pyarrow")
+        ds = importlib.import_module("pyarrow.dataset")
+        fs = importlib.import_module("pyarrow.fs")
+        pq = importlib.import_module("pyarrow.parquet")
+        feather = importlib.import_module("pyarrow.feather")
+
+    # If 'pyarrow' is not installed, raise an error
+    except ImportError:
+        errstr = \
+            "Writing or reading Parquet/Arrow outputs requires " \
+            "the 'pyarrow' package to be installed."
+        raise ImportError(errstr)
+
+    # Return the modules
+    return pa, ds, fs, pq, feather
+
+
+def get_dataset_path(out_file,
+                     out_format):
+    """Get the path to the columnar dataset (a directory) that
+    replaces a CSV output file when the data are written in
+    another format.
+    """
+
+    # Replace the extension of the file with the one of the format
+    return os.path.splitext(out_file)[0] + OUTPUT_FORMATS[out_format]
+
+
+def get_format(path):
+    """Get the columnar format of a dataset or of a single file
+    from its extension, or None if it is not a columnar format.
+    """
+
+    # Get the extension of the path (datasets are directories
+    # named after the format, too)
+    ext = os.path.splitext(os.path.normpath(path))[1]
+
+    # For each columnar format and associated extension
+    for out_format, format_ext in OUTPUT_FORMATS.items():
+
+        # If the extension matches, return the format
+        if out_format != "csv" and ext == format_ext:
+            return out_format
+
+    # The path does not point to columnar data
+    return None
+
+
+def get_fragment_path(dataset_path,
+                      name,
+                      out_format):
+    """Get the path to a file (fragment) of a columnar dataset.
+    """
+
+    # Return the path to the fragment
+    return os.path.join(dataset_path, name + OUTPUT_FORMATS[out_format])
+
+
+def remove_stale_fragments(dataset_path,
+                           names,
+                           out_format):
+    """Remove the files of a columnar dataset whose names are
+    not among 'names' (i.e. mutations no longer aggregated).
+    """
+
+    # If the dataset does not exist, there is nothing to remove
+    if not os.path.isdir(dataset_path):
+        return
+
+    # Get the names of the fragments to keep
+    keep = \
+        {os.path.basename(get_fragment_path(dataset_path, name,
+                                            out_format)) \
+         for name in names}
+
+    # For each file in the dataset
+    for file_name in os.listdir(dataset_path):
+
+        # If it is not a fragment to keep, remove it
+        if file_name not in keep:
+            os.remove(os.path.join(dataset_path, file_name))
+
+
+def _to_table(df):
+    """Convert an aggregated data frame to an Arrow table with
+    typed columns.
+    """
+
+    # Import 'pyarrow'
+    pa, _, _, _, _ = import_pyarrow()
+
+    # Store the columns with few distinct values (i.e. the
+    # states or the energy units) as dictionary-encoded columns
+    df = df.astype(\
+        {col : "category" for col in COLUMNAR_CATEGORICAL_COLS \
+         if col in df.columns})
+
+    # Return the table (the index of the data frame carries
+    # no information)
+    return pa.Table.from_pandas(df, preserve_index = False)
+
+
+def write_fragment(df,
+                   dataset_path,
+                   name,
+                   out_format):
+    """Write a data frame as a single file (fragment) of a
+    columnar dataset. The file is first written under a hidden
+    name, so that readers never see an incomplete fragment.
+    """
+
+    # Import 'pyarrow'
+    _, _, _, pq, feather = import_pyarrow()
+
+    # Convert the data frame to an Arrow table
+    table = _to_table(df)
+
+    # Make sure that the dataset directory exists
+    os.makedirs(dataset_path, exist_ok = True)
+
+    # Get the path to the fragment
+    out_file = get_fragment_path(dataset_path, name, out_format)
+
+    # Create a temporary file in the same directory (files whose
+    # names start with '.' are ignored when reading the dataset)
+    fd, tmp_file = tempfile.mkstemp(dir = dataset_path, prefix = ".")
+    os.close(fd)
+
+    # Try to write the fragment
+    try:
+
+        # Parquet files are compressed and store per-column
+        # statistics, so that row filters can skip whole files
+        if out_format == "parquet":
+            pq.write_table(table, tmp_file)
+
+        # Arrow IPC files are left uncompressed so that they can
+        # be memory-mapped without copies when reading
+        elif out_format == "arrow":
+            feather.write_feather(table,
+                                  tmp_file,
+                                  compression = "uncompressed")
+
+        # Move the file in place (atomic on POSIX file systems)
+        os.replace(tmp_file, out_file)
+
+    # If something went wrong, remove the temporary file
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def load_dataset(path,
+                 columns = None,
+                 filter = None):
+    """Load a columnar dataset (or a single Parquet/Arrow file)
+    as an Arrow table. 'columns' and 'filter' (a
+    'pyarrow.dataset.Expression', i.e.
+    'pyarrow.dataset.field("state") == "ddg"') are pushed down
+    to the reader, so that only the data needed are read.
+    """
+
+    # Import 'pyarrow'
+    _, ds, fs, _, _ = import_pyarrow()
+
+    # Get the format of the data
+    in_format = get_format(path)
+
+    # Open the dataset (memory-mapping the files so that
+    # uncompressed Arrow IPC data are loaded without copies)
+    dataset = \
+        ds.dataset(os.path.abspath(path),
+                   format = "parquet" if in_format == "parquet" \
+                            else "ipc",
+                   filesystem = fs.LocalFileSystem(use_mmap = True))
+
+    # Return the table
+    return dataset.to_table(columns = columns, filter = filter)
+
+
+def load_dataframe(path):
+    """Load a columnar dataset (or a single Parquet/Arrow file)
+    as a data frame, with the same column types it would have
+    if read from a CSV file.
+    """
+
+    # Load the data
+    df = load_dataset(path).to_pandas()
+
+    # Convert the dictionary-encoded columns back to strings
+    return df.astype(\
+        {col : str for col in df.select_dtypes("category").columns})
@@ -68,9 +68,13 @@ ROSETTA_PROTOCOLS = \
 # are needed to correctly retrieve files/parameters
 ROSETTA_OPTIONS = \
     collections.defaultdict(str,
-        {"ddg_out" : ("-ddg:out", "-out"),
+        {"backrub_n_trials" : ("backrubntrials",),
+         "ddg_out" : ("-ddg:out", "-out"),
          "in_pdb_file" : ("-in:file:s", "-s"),
+         "iterations" : ("-ddg:iterations", "-iterations"),
          "mutfile" : ("-ddg:mut_file", "-mut_file"),
+         "mut_only" : ("-ddg:mut_only", "-mut_only"),
+         "nstruct" : ("-out:nstruct", "-nstruct"),
          "out_prefix" : ("-out:prefix", "-prefix"),
          "out_suffix" : ("-out:suffix", "-suffix"),
          "script_vars" : ("-parser:script_vars", "-script_vars"),
@@ -82,12 +86,99 @@ ROSETTA_OPTIONS = \
          "protocol" : ("-parser:protocol", "-protocol"),
          "resfile" : ("resfile",),
          "struct_db_file" : ("structdbfile",),
-         "db_name" : ("-inout:dbms:database_name",)})
+         "db_name" : ("-inout:dbms:database_name",),
+         "wt_only" : ("-ddg:wt_only", "-wt_only")})
+
+
+# Values of the Flex ddG RosettaScript variables used when they
+# are not set in the configuration of the step (the same set in
+# the configuration files shipped with the package)
+FLEXDDG_SCRIPT_VARS_DEFAULTS = {"backrub_n_trials" : 35000,
+                                "backrub_traj_stride" : 7000}
 
 
 # Default name for the Rosetta crash log
 ROSETTA_CRASH_LOG = "ROSETTA_CRASH.log"
 
+# Name of the manifest keeping track of the completed runs
+# (written in the directory where the protocol is run)
+RUN_MANIFEST_FILE = "run_manifest.jsonl"
+
+# Name of the report listing the Rosetta runs that failed
+# permanently (written in the directory where the protocol is run)
+FAILURE_REPORT_FILE = "failure_report.csv"
+
+# Patterns (in the crash log or in the Rosetta output) identifying
+# the cause of a failed Rosetta run (the 'input' patterns are only
+# searched for in the lines reporting Rosetta errors, i.e. starting
+# with FAILURE_ERROR_PREFIX)
+FAILURE_PATTERNS = \
+    {"oom" : (r"std::bad_alloc", r"[Oo]ut of memory",
+              r"[Cc]annot allocate memory"),
+     "segfault" : (r"[Ss]egmentation fault", r"SIGSEGV"),
+     "input" : (r"[Cc]annot open", r"[Uu]nable to open",
+                r"[Cc]ould not (open|find|read)", r"[Cc]an't find",
+                r"[Cc]an't read", r"[Nn]o such file",
+                r"does not exist", r"[Uu]nrecognized",
+                r"[Ee]rror reading", r"[Oo]ption .*not found")}
+
+# Prefix of the lines where Rosetta reports errors
+FAILURE_ERROR_PREFIX = r"^\s*(?:ERROR:|\[ ERROR \])"
+
+# Directory where the cgroup (v2) hierarchy is mounted (used to
+# find out whether a process was killed by the kernel for running
+# out of memory)
+CGROUP_DIR = "/sys/fs/cgroup"
+
+# Name of the file where the events of the tasks (submission, start,
+# end and resource usage) are recorded (written in the directory
+# where the protocol is run)
+TELEMETRY_FILE = "telemetry.jsonl"
+
+# Suffix of the file storing the index of the residues of a PDB
+# file (written next to the PDB file)
+RESIDUE_INDEX_SUFFIX = ".resindex.npz"
+
+# Number of mutations checked at a time against the residues of the
+# structure before starting a run
+VALIDATION_CHUNK_SIZE = 100000
+
+# Keys of the extra data associated with the mutations that name
+# chains of the structure (possibly more than one, comma-separated)
+CHAIN_EXTRA_KEYS = ("_chaintomove_",)
+
+# Maximum number of atom-atom distances computed at a time when
+# looking for the residues at the interface between chains
+INTERFACE_BLOCK_SIZE = 1000000
+
+# Scale of the maximum solvent accessibility of the residue types
+# used to compute the relative solvent accessibility (theoretical
+# values from Tien et al., 2013)
+RSA_SCALE = "Wilke"
+
+
+
+############################## SCHEDULING #############################
+
+
+
+# Number of side chain heavy atoms of each residue type (bulkier
+# residues have more rotamers to pack and take longer to model)
+SIDE_CHAIN_HEAVY_ATOMS = \
+    {"A" : 1, "C" : 2, "D" : 4, "E" : 5, "F" : 7,
+     "G" : 0, "H" : 6, "I" : 4, "K" : 5, "L" : 4,
+     "M" : 4, "N" : 4, "P" : 3, "Q" : 5, "R" : 7,
+     "S" : 2, "T" : 3, "V" : 3, "W" : 10, "Y" : 8}
+
+# Distance cutoff (in Å) used to define the neighborhood of a
+# mutated residue when estimating the cost of a run
+COST_NEIGHBORHOOD_CUTOFF = 8.0
+
+# Number of rounds of repacking and minimization performed by
+# Rosetta's FastRelax on each structure (its default), used to
+# estimate the cost of a relax step relative to the ΔΔG runs
+RELAX_ROUNDS = 5
+
 
 
 ########################## DIRECTORIES/FILES ##########################
@@ -160,6 +251,20 @@ MUT_DIR_PATH = "_dirpath_"
 # Mutation directory name
 MUT_DIR_NAME = "_dirname_"
 
+# Name of the directory (inside the directory where the ΔΔG step
+# is run) containing the wild-type references shared by all
+# mutations at the same position(s)
+WT_REF_DIR_NAME = "wt_reference"
+
+# Name of the directory (inside the directory where the ΔΔG step
+# is run) where batches of mutations run together are run
+BATCH_DIR_NAME = "batches"
+
+# Name of the directory (inside the directory where the ΔΔG step
+# is run) where duplicates of runs taking far longer than
+# expected are run
+SPECULATIVE_DIR_NAME = "speculative"
+
 # Separator for mutations that are performed simultaneously    
 MUT_SEP = ","
 
@@ -178,6 +283,19 @@ DIR_MUT_SEP = "_"
 # Separator for multiple mutations in the mutinfo file
 MULTI_MUT_SEP = ":"
 
+# Maximum number of mutations listed in the log when a run starts
+# (scans can include a very large number of mutations)
+MAX_LOGGED_MUTATIONS = 100
+
+# Methods available to sample the combinations of mutations when a
+# line of a saturation mutagenesis scan generates more combinations
+# than allowed
+SATURATION_SAMPLING_METHODS = ("random", "stratified")
+
+# Number of combinations of mutations generated by a single line of
+# a saturation mutagenesis scan above which the user is warned
+SATURATION_WARNING_COMBINATIONS = 10000
+
 
 
 ######################### STRUCTURE EXTRACTION ########################
@@ -219,6 +337,25 @@ ROSETTA_DF_COLS = {"b_steps" : "backrub_steps",
                    "struct_num" : "struct_num",
                    "tot_score" : "total_score"}
 
+# Formats in which the aggregated data can be written, associated
+# with the extension of the corresponding files ("arrow" is the
+# Arrow IPC file format, a.k.a. Feather V2)
+OUTPUT_FORMATS = {"csv" : ".csv",
+                  "parquet" : ".parquet",
+                  "arrow" : ".arrow"}
+
+# Number of cartddg output files parsed together in a single task
+CARTDDG_PARSE_BATCH_SIZE = 100
+
+# Name of the file (in the output directory) storing the index
+# of the outputs already parsed during data aggregation
+AGGREGATION_INDEX_FILE = "aggregation_index.json"
+
+# Columns of the aggregated data frames that are stored as
+# dictionary-encoded (categorical) columns in columnar outputs
+COLUMNAR_CATEGORICAL_COLS = \
+    ("position_label", "state", "energy_unit", "score_function_name")
+
 
 
 ############################### PLOTTING ##############################
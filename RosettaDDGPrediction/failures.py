@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    failures.py
+#
+#    Utility functions to classify failed Rosetta runs and
+#    report those that could not be recovered.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import os.path
+import re
+import signal
+# RosettaDDGPrediction
+from .defaults import (
+    CGROUP_DIR,
+    FAILURE_ERROR_PREFIX,
+    FAILURE_PATTERNS,
+    ROSETTA_CRASH_LOG
+)
+from . import telemetry
+
+
+
+def _read_tail(file_path,
+               n_bytes = 65536):
+    """Read the last bytes of a text file (an empty string if
+    the file does not exist).
+    """
+
+    # If the file does not exist, return an empty string
+    if not os.path.isfile(file_path):
+        return ""
+
+    with open(file_path, "rb") as f:
+
+        # Go to the start of the tail of the file
+        f.seek(max(os.path.getsize(file_path) - n_bytes, 0))
+
+        # Return the tail decoded as text
+        return f.read().decode(errors = "replace")
+
+
+def get_oom_kills():
+    """Get the number of processes killed by the kernel for
+    running out of memory in the control group of the current
+    process (and in those below it). Return None if it is not
+    known (i.e. cgroup v2 is not in use).
+    """
+
+    try:
+
+        # Get the control group of the current process (the one
+        # of the unified hierarchy, with ID 0)
+        with open("/proc/self/cgroup") as f:
+            cgroups = dict(line.rstrip("\n").split(":", 2)[::2] \
+                           for line in f)
+
+        # Read the memory events of the control group
+        with open(os.path.join(CGROUP_DIR,
+                               cgroups["0"].lstrip("/"),
+                               "memory.events")) as f:
+            events = dict(line.split() for line in f)
+
+        # Return the number of processes killed
+        return int(events["oom_kill"])
+
+    # The control group or its memory events are not available
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _search_errors(patterns,
+                   text):
+    """Search for any of the patterns in the lines of a text
+    reporting Rosetta errors.
+    """
+
+    return any(re.search(f"{FAILURE_ERROR_PREFIX}.*{p}",
+                         text,
+                         flags = re.MULTILINE) \
+               for p in patterns)
+
+
+def classify_failure(returncode,
+                     wd,
+                     output,
+                     killed = None):
+    """Classify the failure of a Rosetta run from its return
+    code, its crash log and its output. 'killed' is the reason
+    the process was killed for, if it was killed while running:
+    'timeout' (for running past its time limit), 'oom' (by the
+    kernel for running out of memory), 'supersede' or 'cancel'
+    (on request, when duplicated). Return None if the run did
+    not fail, otherwise one of 'timeout', 'cancelled' (killed
+    on request), 'oom' (out of memory), 'segfault', 'input'
+    (error in the input files or options), 'signal' (killed by
+    another signal, e.g. by the queuing system) and 'unknown'.
+    """
+
+    # The run was killed for running past its time limit
+    if killed == "timeout":
+        return "timeout"
+
+    # The run was killed on request
+    if killed in ("supersede", "cancel"):
+        return "cancelled"
+
+    # Get the path to the crash log
+    crash_log = os.path.join(wd, ROSETTA_CRASH_LOG)
+
+    # The run did not fail if it exited successfully without
+    # leaving a crash log
+    if returncode == 0 and not os.path.isfile(crash_log):
+        return None
+
+    # Get the text describing the failure
+    text = _read_tail(crash_log) + _read_tail(output)
+
+    # Get the signal that killed the process, if any (MPI
+    # launchers report it as 128 + the signal number)
+    sig = \
+        -returncode if returncode < 0 \
+        else returncode - 128 if returncode > 128 \
+        else None
+
+    # Processes killed by the kernel for running out of memory or
+    # allocation failures (a SIGKILL alone does not tell, since
+    # it is also sent by the queuing systems)
+    if killed == "oom" \
+    or any(re.search(p, text) for p in FAILURE_PATTERNS["oom"]):
+        return "oom"
+
+    # Segmentation faults
+    if sig == signal.SIGSEGV \
+    or any(re.search(p, text) for p in FAILURE_PATTERNS["segfault"]):
+        return "segfault"
+
+    # Errors in the input files or options
+    if _search_errors(patterns = FAILURE_PATTERNS["input"],
+                      text = text):
+        return "input"
+
+    # Other signals
+    if sig is not None:
+        return "signal"
+
+    # Unknown causes
+    return "unknown"
+
+
+def get_failure_message(wd,
+                        output,
+                        max_length = 300):
+    """Get a short message describing a failure (the last
+    error line found in the crash log or in the output).
+    """
+
+    # Get the lines of the crash log and of the output
+    lines = \
+        (_read_tail(os.path.join(wd, ROSETTA_CRASH_LOG)) \
+         + _read_tail(output)).splitlines()
+
+    # Get the lines reporting errors
+    errors = [l.strip() for l in lines if "ERROR" in l.upper()]
+
+    # Return the last one (or the last line, if no error line
+    # was found)
+    message = errors[-1] if errors else (lines[-1] if lines else "")
+    return message[:max_length]
+
+
+def write_failure_report(events_file,
+                         since,
+                         report_file):
+    """Write a report of the Rosetta runs that failed permanently
+    (recorded in the events of the run since a given time).
+    Return the number of failures reported.
+    """
+
+    # Read the events
+    df = telemetry.read_events(events_file = events_file,
+                               since = since)
+
+    # If no run failed permanently, there is nothing to report
+    if df.empty or "failed" not in set(df["event"]):
+        return 0
+
+    # Get the failures
+    failed = df[df["event"] == "failed"]
+
+    # Select the columns of interest
+    cols = ["time", "host", "step", "wd", "failure",
+            "returncode", "attempts", "message"]
+    failed = failed[[c for c in cols if c in failed.columns]]
+
+    # Integer columns are read as floats since other events
+    # lack them
+    failed = failed.astype({"returncode" : int, "attempts" : int})
+
+    # Write the report
+    failed.to_csv(report_file, index = False)
+
+    # Return the number of failures
+    return len(failed)
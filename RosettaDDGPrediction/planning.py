@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    planning.py
+#
+#    Utility functions to plan a run without launching Rosetta:
+#    the tasks to be run, their dependencies and estimates of the
+#    resources they need.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import os.path
+import statistics
+# RosettaDDGPrediction
+from .defaults import (
+    MUT_DIR_NAME,
+    ROSETTA_PROTOCOLS,
+    TELEMETRY_FILE
+)
+from . import scheduling
+from . import telemetry
+from . import util
+
+
+
+def _get_event_step(step_name):
+    """Get the name under which the Rosetta processes of a step
+    are recorded in the events of a run.
+    """
+
+    return {"relax2020" : "relax"}.get(step_name, step_name)
+
+
+def read_past_steps(run_dirs):
+    """Get, for each step, the typical wall time, output size and
+    peak memory of its Rosetta processes, as recorded in the
+    events of previous runs (only successful processes are
+    considered).
+    """
+
+    # Create an empty dictionary to store the timings of each step
+    walls, outbytes, maxrss = {}, {}, {}
+
+    # For each running directory
+    for run_dir in run_dirs:
+
+        # Read the events of the run
+        df = telemetry.read_events(os.path.join(run_dir,
+                                                TELEMETRY_FILE))
+
+        # Skip runs without any completed process
+        if df.empty or "finished" not in set(df["event"]):
+            continue
+
+        # Get the processes completed successfully
+        df = df[(df["event"] == "finished") & (df["returncode"] == 0)]
+
+        # Store their timings, output sizes and peak memory
+        for step, step_df in df.groupby("step"):
+            walls.setdefault(step, []).extend(step_df["wall"].dropna())
+            outbytes.setdefault(step, []).extend(\
+                step_df["outbytes"].dropna())
+            maxrss.setdefault(step, []).extend(\
+                step_df["maxrss"].dropna())
+
+    # Return the median wall time and output size and the maximum
+    # peak memory of each step
+    return {step : {"wall" : statistics.median(walls[step]),
+                    "outbytes" : statistics.median(outbytes[step]) \
+                                 if outbytes[step] else None,
+                    "maxrss" : max(maxrss[step]) \
+                               if maxrss[step] else None} \
+            for step in walls if walls[step]}
+
+
+def _sum_or_none(values):
+    """Sum a list of values, returning None if any of them is
+    None (i.e. not estimated).
+    """
+
+    return None if any(v is None for v in values) else sum(values)
+
+
+def _get_critical_path(tasks):
+    """Get the longest chain of dependent tasks and its length.
+    The length is in seconds if the times of all tasks could be
+    estimated, otherwise the chain is found from the tasks'
+    relative costs and its length is None. The tasks must be
+    sorted so that each task comes after the tasks it depends
+    on.
+    """
+
+    # Get whether the times of all tasks could be estimated
+    all_estimated = all(t["estimated_s"] is not None for t in tasks)
+
+    # Weigh the tasks by their estimated time or, failing that,
+    # by their relative cost (tasks without a cost, i.e. those
+    # run in Python, take no time)
+    weights = \
+        {t["id"] : (t["estimated_s"] if all_estimated \
+                    else t["cost"]) or 0 \
+         for t in tasks}
+
+    # Create dictionaries to store, for each task, the length of
+    # the longest chain ending with it and the previous task in
+    # the chain
+    length, prev = {}, {}
+
+    # For each task
+    for task in tasks:
+
+        # Get the task it depends on ending the longest chain
+        dep = max(task["depends_on"],
+                  key = lambda d: length[d],
+                  default = None)
+
+        # Update the length of the chain ending with the task
+        length[task["id"]] = \
+            (length[dep] if dep is not None else 0) \
+            + weights[task["id"]]
+        prev[task["id"]] = dep
+
+    # If there are no tasks, there is no path
+    if not length:
+        return [], 0
+
+    # Walk the longest chain back from its last task (the latest
+    # one among those ending chains of the same length, so that
+    # tasks taking no time are included)
+    path = [max(reversed(list(length)), key = lambda t: length[t])]
+    while prev[path[-1]] is not None:
+        path.append(prev[path[-1]])
+
+    # Return the chain (from the first task) and its length
+    return path[::-1], \
+           length[path[0]] if all_estimated else None
+
+
+def get_plan(steps,
+             family,
+             settings,
+             run_dir,
+             pdb_file,
+             mutations,
+             mutinfo_file,
+             n_proc,
+             pipeline = False,
+             resume = False,
+             manifest = None,
+             past_timings_dirs = ()):
+    """Plan a run: get the tasks that would be submitted (with
+    their dependencies, the Rosetta processes and cores they use
+    and estimates of the time and disk space they need), a
+    summary by step and the totals, including the estimated
+    core-hours, the critical path and the wall time of the whole
+    run. 'mutations' is a function generating the pairs of
+    mutations (with the numbering used for running and with the
+    original numbering). Times, disk space and memory are
+    estimated from the runs whose directories are in
+    'past_timings_dirs' (and from the current running directory,
+    if resuming) and are None if no past data are available (the
+    critical path is then found from the relative costs of the
+    tasks).
+    """
+
+    # Get the typical timings of the steps in past runs
+    past_dirs = [run_dir] + list(past_timings_dirs)
+    past_steps = read_past_steps(past_dirs)
+
+    # Get the timings of the single ΔΔG runs in past runs
+    timings, scale = scheduling.read_past_timings(past_dirs)
+
+    # Get the structure's information needed to estimate the
+    # costs of the steps
+    struct_info = scheduling.get_structure_info(pdb_file)
+
+    # Create empty lists to store the tasks and the summary of
+    # each step
+    tasks = []
+    steps_summary = []
+
+    # Create an empty list to store the tasks the next step
+    # depends on
+    prev_ids = []
+
+    # For each step
+    for step_name, step in steps.items():
+
+        # Get the step features
+        step_features = ROSETTA_PROTOCOLS[family][step_name]
+
+        # If the step is run in Python, it is a single task
+        # without Rosetta processes
+        if step_features["run_by"] == "python":
+            tasks.append({"id" : step_name,
+                          "step" : step_name,
+                          "wd" : run_dir,
+                          "mutations" : [],
+                          "processes" : 0,
+                          "cores" : 0,
+                          "depends_on" : prev_ids,
+                          "cost" : None,
+                          "estimated_s" : 0,
+                          "disk_bytes" : 0})
+            steps_summary.append({"name" : step_name,
+                                  "role" : "python",
+                                  "tasks" : 1,
+                                  "processes" : 0,
+                                  "skipped" : 0})
+            prev_ids = [step_name]
+            continue
+
+        # Get the step working directory and options
+        step_wd = util.get_step_wd(step = step,
+                                   run_dir = run_dir)
+        step_opts = step["options"]
+
+        # Get the typical timings of the step's processes
+        past = past_steps.get(_get_event_step(step_name), {})
+
+        # Create an empty list to store the step's tasks
+        step_tasks = []
+
+        # Keep track of the runs skipped because already completed
+        n_skipped = 0
+
+        # If it is a processing step
+        if step_features["role"] == "processing":
+
+            # If the step was already completed in the run being
+            # resumed, skip it
+            if resume \
+            and util.check_relax_output(step_wd = step_wd,
+                                        step_opts = step_opts,
+                                        pdb_file = pdb_file):
+                n_skipped = 1
+
+            # Otherwise, it is a single task (using as many
+            # processes and cores as MPI ranks if run with MPI)
+            else:
+                cores = n_proc if settings["mpi"]["usempi"] else 1
+                step_tasks.append(\
+                    {"id" : step_name,
+                     "step" : step_name,
+                     "wd" : step_wd,
+                     "mutations" : [],
+                     "processes" : cores,
+                     "cores" : cores,
+                     "depends_on" : prev_ids,
+                     "cost" : \
+                        scheduling.estimate_relax_cost(\
+                            struct_info = struct_info,
+                            step_opts = step_opts),
+                     "estimated_s" : past.get("wall"),
+                     "disk_bytes" : past.get("outbytes")})
+
+        # If it is a ΔΔG step
+        elif step_features["role"] == "ddg":
+
+            # Write out the file mapping the directory names to the
+            # mutations
+            util.write_mutinfo_file(\
+                mutations_original = \
+                    (mut_orig for _, mut_orig in mutations()),
+                out_dir = step_wd,
+                mutinfo_file = mutinfo_file)
+
+            # Get the runs of the step
+            runs = list(util.get_ddg_runs(\
+                step_name = step_name,
+                step = step,
+                step_wd = step_wd,
+                step_opts = step_opts,
+                mutations = mutations()))
+
+            # Get the runs still to be performed
+            pending_runs = \
+                [run for run in runs \
+                 if not (resume \
+                         and util.check_run_completed(\
+                            wd = run[1],
+                            step_name = step_name,
+                            step_opts = run[2],
+                            manifest = manifest))]
+            n_skipped = len(runs) - len(pending_runs)
+
+            # Estimate the cost of each run
+            costs = \
+                {run[1] : scheduling.estimate_run_cost(\
+                            struct_info = struct_info,
+                            mut_orig = run[4],
+                            step_name = step_name,
+                            step_opts = run[2]) \
+                 for run in pending_runs}
+
+            # Get the factor converting the costs into seconds
+            # (from the past timings of the same runs or, failing
+            # that, from the typical time taken by the step)
+            step_scale = scale
+            if step_scale is None and past and costs:
+                step_scale = \
+                    past["wall"] / statistics.median(costs.values())
+
+            # Get the extraction of the structures' options, if any
+            extract = \
+                step.get("extract_structures", {}).get("extract", False)
+
+            # Get the typical timings of the extraction
+            past_extract = past_steps.get("flexddg_extract", {})
+
+            # For each batch of runs performed by a single process
+            for batch in util.get_run_batches(\
+                runs = pending_runs,
+                batch_size = step.get("batchsize", 1)):
+
+                # Get the working directories of the runs
+                muts_wd = [run[1] for run in batch]
+
+                # Get the directory where the batch is run
+                wd = \
+                    muts_wd[0] if len(batch) == 1 \
+                    else os.path.join(step_wd,
+                                      util.get_batch_dir_path(muts_wd))
+
+                # Estimate the time taken by the batch
+                estimated_s = \
+                    sum(scheduling.get_run_estimate(\
+                            cost = costs[mut_wd],
+                            step_name = step_name,
+                            wd = mut_wd,
+                            run_dir = run_dir,
+                            timings = timings,
+                            scale = step_scale) \
+                        for mut_wd in muts_wd) \
+                    if step_scale is not None else None
+
+                # Add the time taken by the extraction, if any
+                if extract and estimated_s is not None:
+                    estimated_s = \
+                        _sum_or_none([estimated_s,
+                                      past_extract.get("wall")])
+
+                # Estimate the disk space used by the batch
+                disk_bytes = \
+                    past["outbytes"] * len(batch) \
+                    if past.get("outbytes") is not None else None
+
+                # Add the task
+                step_tasks.append(\
+                    {"id" : f"{step_name}:" \
+                            f"{os.path.relpath(wd, run_dir)}",
+                     "step" : step_name,
+                     "wd" : wd,
+                     "mutations" : \
+                        sorted({run[4][MUT_DIR_NAME] for run in batch}),
+                     "processes" : 2 if extract else 1,
+                     "cores" : 1,
+                     "depends_on" : prev_ids,
+                     "cost" : sum(costs[mut_wd] for mut_wd in muts_wd),
+                     "estimated_s" : estimated_s,
+                     "disk_bytes" : disk_bytes})
+
+        # Get the estimated peak memory of the step (all cores
+        # busy with its processes)
+        peak_memory = \
+            past["maxrss"] * min(n_proc,
+                                 sum(t["cores"] for t in step_tasks)) \
+            if past.get("maxrss") is not None else None
+
+        # Add the summary of the step
+        steps_summary.append(\
+            {"name" : step_name,
+             "role" : step_features["role"],
+             "wd" : step_wd,
+             "tasks" : len(step_tasks),
+             "processes" : sum(t["processes"] for t in step_tasks),
+             "skipped" : n_skipped,
+             "adaptive" : \
+                (step.get("adaptive") or {}).get("enabled", False),
+             "core_hours" : \
+                _sum_or_none([t["estimated_s"] * t["cores"] / 3600 \
+                              if t["estimated_s"] is not None \
+                              else None for t in step_tasks]),
+             "disk_bytes" : \
+                _sum_or_none([t["disk_bytes"] for t in step_tasks]),
+             "peak_memory_bytes" : peak_memory})
+
+        # Store the step's tasks
+        tasks.extend(step_tasks)
+
+        # The tasks of the next step depend on those of the
+        # current one, if any
+        if step_tasks:
+            prev_ids = [t["id"] for t in step_tasks]
+
+    # Get the critical path (and its length, if the times of all
+    # tasks could be estimated)
+    critical_path, critical_s = _get_critical_path(tasks)
+
+    # Get the estimated core-hours of the whole run
+    core_hours = _sum_or_none([s.get("core_hours", 0) \
+                               for s in steps_summary])
+
+    # Return the plan
+    return \
+        {"run_dir" : run_dir,
+         "pdb_file" : pdb_file,
+         "n_proc" : n_proc,
+         "pipeline" : pipeline,
+         "resume" : resume,
+         "n_mutations" : \
+            len({m[MUT_DIR_NAME] for _, m in mutations()}),
+         "estimated_from" : {"run_dirs" : past_dirs,
+                             "timed_runs" : len(timings)},
+         "steps" : steps_summary,
+         "tasks" : tasks,
+         "totals" : \
+            {"tasks" : len(tasks),
+             "processes" : sum(t["processes"] for t in tasks),
+             "core_hours" : core_hours,
+             "disk_bytes" : \
+                _sum_or_none([s.get("disk_bytes", 0) \
+                              for s in steps_summary]),
+             "peak_memory_bytes" : \
+                max((s["peak_memory_bytes"] for s in steps_summary \
+                     if s.get("peak_memory_bytes") is not None),
+                    default = None),
+             "critical_path" : \
+                {"tasks" : critical_path,
+                 "hours" : critical_s / 3600 \
+                           if critical_s is not None else None},
+             # The run takes at least as long as its critical path,
+             # and as long as its core-hours spread over all cores
+             "wall_hours" : \
+                max(critical_s / 3600, core_hours / n_proc) \
+                if critical_s is not None and core_hours is not None \
+                else None}}
@@ -41,6 +41,7 @@ import pandas as pd
 import seaborn as sns
 
 # RosettaDDGProtocols
+from . import columnar
 from .defaults import (
     CHAIN,
     CHAIN_SEP,
@@ -58,14 +59,22 @@ from .util import get_items, _recursive_traverse
 
 
 def load_aggregated_data(in_file, saturation=False):
-    """Load aggregated data from a CSV file."""
+    """Load aggregated data from a CSV file or from a columnar
+    (Parquet/Arrow) dataset or file."""
 
     # Columns containing data of interest in the aggregated
     # dataframe
     mutation_col = ROSETTA_DF_COLS["mutation"]
 
-    # Load the dataframe
-    df = pd.read_csv(in_file)
+    # If the data are stored in a columnar format
+    if columnar.get_format(in_file) is not None:
+        # Load the dataframe
+        df = columnar.load_dataframe(in_file)
+
+    # Otherwise
+    else:
+        # Load the dataframe
+        df = pd.read_csv(in_file)
 
     # If the aggregated data are from a saturation mutagenesis
     # scan
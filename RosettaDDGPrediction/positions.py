@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    positions.py
+#
+#    Utility functions to select the positions of a structure
+#    to be scanned (e.g. by saturation mutagenesis) and write
+#    them to a list file.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import re
+# Third-party packages
+import Bio.PDB as PDB
+from Bio.Data.PDBData import residue_sasa_scales
+from Bio.PDB.SASA import ShrakeRupley
+import numpy as np
+# RosettaDDGPrediction
+from .defaults import (
+    COMP_SEP,
+    INTERFACE_BLOCK_SIZE,
+    RSA_SCALE
+)
+from . import residueindex
+
+
+
+def parse_ranges(ranges):
+    """Parse selections of residue ranges in the form
+    'chain:start-end' (e.g. 'A:10-50') or 'chain:number' into
+    (chain, start, end) tuples.
+    """
+
+    # Create an empty list to store the ranges
+    parsed = []
+
+    # For each range
+    for sel in ranges:
+
+        # Match it against the expected format
+        match = re.fullmatch(r"(\w):(-?\d+)(?:-(-?\d+))?", sel)
+
+        # If it does not match, raise an error
+        if match is None:
+            errstr = \
+                f"Invalid residue range '{sel}'. Ranges must be " \
+                f"in the form 'chain:start-end' or 'chain:number'."
+            raise ValueError(errstr)
+
+        # Get the chain and the first and last residue
+        chain, start, end = match.groups()
+        start = int(start)
+        end = int(end) if end is not None else start
+
+        # Add the range
+        parsed.append((chain, start, end))
+
+    # Return the ranges
+    return parsed
+
+
+def _get_atoms(model):
+    """Get the coordinates of the heavy atoms of the amino acid
+    residues of a model, the indexes of the residues they belong
+    to (in the order of the residues in the model) and the atoms
+    themselves.
+    """
+
+    # Create empty lists to store the atoms and their residues
+    atoms, atom_res = [], []
+
+    # For each residue (in the same order as in the residue
+    # index)
+    for res_ix, res in enumerate(model.get_residues()):
+
+        # Skip hetero residues and waters
+        if res.id[0] != " ":
+            continue
+
+        # For each atom that is not a hydrogen
+        for atom in res:
+            if atom.element != "H":
+                atoms.append(atom)
+                atom_res.append(res_ix)
+
+    # Return the coordinates, the residues and the atoms
+    return \
+        np.array([a.coord for a in atoms],
+                 dtype = np.float64).reshape(-1, 3), \
+        np.array(atom_res, dtype = np.int64), \
+        atoms
+
+
+def get_interface_mask(coords,
+                       atom_res,
+                       res_chains,
+                       cutoff,
+                       block_size = INTERFACE_BLOCK_SIZE):
+    """Get which residues have at least one heavy atom within
+    'cutoff' Å from a heavy atom of another chain. The distances
+    are computed in blocks of at most 'block_size' distances, and
+    only between atoms inside the bounding box (enlarged by the
+    cutoff) of the other chains.
+    """
+
+    # Create a mask storing which residues are at the interface
+    mask = np.zeros(len(res_chains), dtype = bool)
+
+    # Get the chain of each atom
+    atom_chains = res_chains[atom_res]
+
+    # For each chain
+    for chain in np.unique(atom_chains):
+
+        # Get the atoms of the chain and of the other chains
+        in_chain = atom_chains == chain
+        own, other = coords[in_chain], coords[~in_chain]
+        own_res = atom_res[in_chain]
+
+        # If there are no other chains, there is no interface
+        if not len(other):
+            continue
+
+        # Keep only the atoms of the chain inside the bounding
+        # box of the other chains, enlarged by the cutoff
+        in_box = \
+            np.all((own >= other.min(axis = 0) - cutoff) \
+                   & (own <= other.max(axis = 0) + cutoff),
+                   axis = 1)
+        own, own_res = own[in_box], own_res[in_box]
+
+        # If no atoms are left, there is no interface
+        if not len(own):
+            continue
+
+        # Keep only the atoms of the other chains inside the
+        # bounding box of the remaining atoms of the chain
+        other = \
+            other[np.all((other >= own.min(axis = 0) - cutoff) \
+                         & (other <= own.max(axis = 0) + cutoff),
+                         axis = 1)]
+
+        # Get how many atoms of the chain fit in a block
+        n_atoms = max(1, block_size // max(1, len(other)))
+
+        # For each block of atoms of the chain
+        for start in range(0, len(own), n_atoms):
+
+            # Get the squared distances between the atoms in the
+            # block and the atoms of the other chains
+            block = own[start:start + n_atoms]
+            dists = \
+                ((block[:, None, :] - other[None, :, :])**2).sum(-1)
+
+            # Mark the residues of the atoms within the cutoff
+            close = (dists <= cutoff**2).any(axis = 1)
+            mask[own_res[start:start + n_atoms][close]] = True
+
+    # Return the mask
+    return mask
+
+
+def get_rsa(model,
+            atoms,
+            atom_res,
+            resnames):
+    """Get the relative solvent accessibility of the residues of
+    a model (the solvent accessible surface area of their heavy
+    atoms, computed with the Shrake-Rupley algorithm without the
+    hydrogens, divided by the maximum accessibility of the residue
+    type). Residues of unknown types have no relative
+    accessibility (NaN). The hydrogens are removed from the model.
+    """
+
+    # Remove the hydrogens, if any (the maximum accessibilities
+    # refer to heavy atoms only)
+    for res in model.get_residues():
+        for atom in [a for a in res if a.element == "H"]:
+            res.detach_child(atom.id)
+
+    # Compute the accessibility of each atom
+    ShrakeRupley().compute(model, level = "A")
+
+    # Sum the accessibility of the atoms of each residue
+    sasa = \
+        np.bincount(atom_res,
+                    weights = np.array([a.sasa for a in atoms]),
+                    minlength = len(resnames))
+
+    # Get the maximum accessibility of each residue type
+    scale = residue_sasa_scales[RSA_SCALE]
+    max_sasa = \
+        np.array([scale.get(r, np.nan) for r in resnames.tolist()])
+
+    # Return the relative accessibility
+    return sasa / max_sasa
+
+
+def get_positions(pdb_file,
+                  chains = None,
+                  ranges = None,
+                  interface_cutoff = None,
+                  rsa_min = None,
+                  rsa_max = None):
+    """Get the positions (chain, wild-type residue, residue
+    number) of the amino acid residues of a structure passing
+    all the filters given: being in one of the 'chains' or in
+    one of the 'ranges' ((chain, start, end) tuples), being
+    within 'interface_cutoff' Å from another chain and having a
+    relative solvent accessibility between 'rsa_min' and
+    'rsa_max'.
+    """
+
+    # Get the index of the residues of the structure
+    index = residueindex.get_residue_index(pdb_file)
+    res_chains, resnums = index["chain"], index["resnum"]
+
+    # Get the one-letter codes of the residues, if any
+    one_letter = residueindex.get_one_letter_codes(index)
+
+    # Consider only amino acid residues without insertion codes
+    # (which cannot be written in the list file)
+    mask = \
+        (index["hetflag"] == " ") & (index["icode"] == " ") \
+        & (one_letter != "X")
+
+    # If chains or ranges were selected
+    if chains or ranges:
+
+        # Keep the residues in the chains selected
+        selected = np.isin(res_chains, list(chains or []))
+
+        # Add the residues in the ranges selected
+        for chain, start, end in (ranges or []):
+            selected |= \
+                (res_chains == chain) \
+                & (resnums >= start) & (resnums <= end)
+
+        # Update the mask
+        mask &= selected
+
+    # If structural filters were requested
+    if interface_cutoff is not None \
+    or rsa_min is not None or rsa_max is not None:
+
+        # Parse the structure (atoms are not stored in the
+        # residue index)
+        model = \
+            PDB.PDBParser(QUIET = True).get_structure(\
+                "structure", pdb_file)[0]
+
+        # Get the heavy atoms
+        coords, atom_res, atoms = _get_atoms(model)
+
+        # If only residues at the interface should be kept
+        if interface_cutoff is not None:
+            mask &= get_interface_mask(coords = coords,
+                                       atom_res = atom_res,
+                                       res_chains = res_chains,
+                                       cutoff = interface_cutoff)
+
+        # If residues should be filtered by accessibility
+        if rsa_min is not None or rsa_max is not None:
+
+            # Get the relative accessibility of the residues
+            rsa = get_rsa(model = model,
+                          atoms = atoms,
+                          atom_res = atom_res,
+                          resnames = index["resname"])
+
+            # Keep the residues within the thresholds (residues
+            # without a relative accessibility are discarded)
+            if rsa_min is not None:
+                mask &= rsa >= rsa_min
+            if rsa_max is not None:
+                mask &= rsa <= rsa_max
+
+    # Return the positions
+    return list(zip(res_chains[mask].tolist(),
+                    one_letter[mask].tolist(),
+                    resnums[mask].astype(str).tolist()))
+
+
+def write_position_list(positions,
+                        out_file,
+                        chain_column = True):
+    """Write positions (chain, wild-type residue, residue number)
+    to a list file in the format used for the mutations' list
+    file (e.g. 'A.M.25'), optionally followed by the chain ID
+    (used, e.g., as the chain to be moved away from the interface
+    by flexddg protocols).
+    """
+
+    with open(out_file, "w") as out:
+
+        # For each position
+        for chain, wtr, numr in positions:
+
+            # Chains without ID are written as '_'
+            chain = chain.strip() or "_"
+
+            # Write the position
+            line = COMP_SEP.join((chain, wtr, numr))
+            out.write(f"{line} {chain}\n" if chain_column \
+                      else f"{line}\n")
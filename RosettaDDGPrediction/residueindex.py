@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    residueindex.py
+#
+#    Utility functions to build, store and load a compact index
+#    of the residues of a PDB file, so that the file is parsed
+#    only once.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import functools
+import itertools
+import os
+import os.path
+import tempfile
+# Third-party packages
+import Bio.PDB as PDB
+from Bio.PDB.Polypeptide import index_to_one, three_to_index
+import numpy as np
+# RosettaDDGPrediction
+from .caching import get_file_hash
+from .defaults import (
+    CHAIN,
+    MUT,
+    MUT_DIR_NAME,
+    NUMR,
+    RESIDUE_INDEX_SUFFIX,
+    VALIDATION_CHUNK_SIZE,
+    WTR
+)
+
+
+
+def build_residue_index(pdb_file):
+    """Parse a PDB file and build the index of its residues:
+    a dictionary of NumPy arrays storing, for each residue of
+    the first model (the one Rosetta uses), the chain ID, the
+    residue number, the insertion code, the residue name, the
+    hetero flag and the index of the residue in the Rosetta
+    pose (starting at 1), plus the IDs of the chains and the
+    number of models in the file.
+    """
+    
+    # Create the PDB parser
+    parser = PDB.PDBParser()
+    
+    # Try to get the structure
+    try:
+        structure = parser.get_structure("structure", pdb_file)
+    
+    # In case the PDB file was not found
+    except FileNotFoundError:
+        
+        # Raise an error
+        errstr = f"PDB file {pdb_file} not found."
+        raise FileNotFoundError(errstr)
+    
+    # In case something went wrong in accessing/opening the file
+    except IOError:
+        
+        # Raise an error
+        errstr = f"Could not open PDB file {pdb_file}."
+        raise IOError(errstr)
+
+    # Get the first model
+    model = structure[0]
+
+    # Get the full IDs of the residues ((structure, model, chain,
+    # (hetero flag, residue number, insertion code)))
+    res_ids = [res.get_full_id() for res in model.get_residues()]
+
+    # Return the index
+    return \
+        {"n_models" : np.array(len(structure)),
+         "chain_ids" : np.array([chain.id for chain in model],
+                                dtype = str),
+         "chain" : np.array([i[2] for i in res_ids], dtype = str),
+         "resnum" : np.array([i[3][1] for i in res_ids],
+                             dtype = np.int64),
+         "icode" : np.array([i[3][2] for i in res_ids], dtype = str),
+         "resname" : \
+            np.array([res.get_resname() for res \
+                      in model.get_residues()],
+                     dtype = str),
+         "hetflag" : np.array([i[3][0] for i in res_ids], dtype = str),
+         # The residues are numbered consecutively in the pose,
+         # across all chains
+         "pose" : np.arange(1, len(res_ids) + 1, dtype = np.int64)}
+
+
+def get_index_path(pdb_file):
+    """Get the path to the file storing the index of the
+    residues of a PDB file (next to the PDB file).
+    """
+
+    return f"{pdb_file}{RESIDUE_INDEX_SUFFIX}"
+
+
+def _write_residue_index(index,
+                         file_hash,
+                         index_file):
+    """Write the index of the residues of a PDB file, together
+    with the hash of the PDB file it was built from.
+    """
+
+    # Write the index to a temporary file in the same directory
+    # first, so that an incomplete index is never read
+    fd, tmp_file = \
+        tempfile.mkstemp(dir = os.path.dirname(index_file),
+                         suffix = ".tmp")
+
+    # Try to write the index
+    try:
+
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, hash = np.array(file_hash), **index)
+
+        # Move the temporary file in place (atomic on POSIX file
+        # systems)
+        os.replace(tmp_file, index_file)
+
+    # Whatever happens, do not leave the temporary file behind
+    finally:
+
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _read_residue_index(index_file,
+                        file_hash):
+    """Read the index of the residues of a PDB file. Return None
+    if there is no index or it was built from a PDB file with a
+    different hash.
+    """
+
+    # Try to load the index (no pickled objects are needed)
+    try:
+
+        with np.load(index_file, allow_pickle = False) as data:
+            index = {key : data[key] for key in data.files}
+
+    # If the index does not exist or is unreadable, there is no
+    # index
+    except (OSError, ValueError):
+        return None
+
+    # If the index was built from another version of the file,
+    # it is stale
+    if str(index.pop("hash", "")) != file_hash:
+        return None
+
+    # Return the index
+    return index
+
+
+@functools.lru_cache(maxsize = 16)
+def _get_residue_index(pdb_file,
+                       file_hash):
+    """Get the index of the residues of a PDB file with a given
+    hash, reading it from the index file or building (and
+    storing) it if needed. The indexes are also cached in
+    memory, since the same PDB file is usually looked up
+    several times by a process.
+    """
+
+    # Get the path to the index file
+    index_file = get_index_path(pdb_file)
+
+    # Try to read the index
+    index = _read_residue_index(index_file = index_file,
+                                file_hash = file_hash)
+
+    # If there is no up-to-date index
+    if index is None:
+
+        # Build it
+        index = build_residue_index(pdb_file)
+
+        # Try to store it next to the PDB file
+        try:
+            _write_residue_index(index = index,
+                                 file_hash = file_hash,
+                                 index_file = index_file)
+
+        # If the directory is not writable, the index will be
+        # kept only in memory
+        except OSError:
+            pass
+
+    # Return the index
+    return index
+
+
+def get_residue_index(pdb_file):
+    """Get the index of the residues of a PDB file (see
+    'build_residue_index'). The index is stored next to the PDB
+    file and rebuilt only when the hash of the PDB file changes.
+    """
+
+    # Get the absolute path to the PDB file
+    pdb_file = os.path.abspath(pdb_file)
+
+    # If the PDB file does not exist, raise an error
+    if not os.path.isfile(pdb_file):
+        errstr = f"PDB file {pdb_file} not found."
+        raise FileNotFoundError(errstr)
+
+    # Get the index of the current version of the file
+    return _get_residue_index(pdb_file = pdb_file,
+                              file_hash = get_file_hash(pdb_file))
+
+
+def get_pose_numbering_map(pdb_file):
+    """Get the mapping between the PDB numbering (chain ID and
+    residue number, as strings) and the Rosetta pose numbering
+    (as strings) of the residues of a structure.
+    """
+
+    # Get the index of the residues
+    index = get_residue_index(pdb_file)
+
+    # Return the mapping (if more residues have the same number,
+    # i.e. they differ only by insertion code, the last one is
+    # kept)
+    return dict(zip(zip(index["chain"].tolist(),
+                        index["resnum"].astype(str).tolist()),
+                    index["pose"].astype(str).tolist()))
+
+
+def get_one_letter_codes(index):
+    """Get the one-letter codes of the residues of an index
+    ('X' for residues that are not canonical amino acids).
+    """
+
+    # Get the residue names found
+    resnames, inverse = \
+        np.unique(index["resname"], return_inverse = True)
+
+    # Create an empty list to store their one-letter codes
+    one_letter = []
+
+    # For each residue name
+    for resname in resnames.tolist():
+
+        # Try to get its one-letter code
+        try:
+            one_letter.append(index_to_one(three_to_index(resname)))
+
+        # If it is not a canonical amino acid, it has none
+        except (KeyError, ValueError):
+            one_letter.append("X")
+
+    # Return the one-letter code of each residue
+    return np.array(one_letter, dtype = str)[inverse]
+
+
+def _get_residue_table(index):
+    """Get the table used to look up the residues of an index
+    by chain and residue number: the sorted keys ('chain.number')
+    of the residues, the names of the residues in the same order
+    and their one-letter codes ('X' if there is none).
+    """
+
+    # Get the keys of the residues
+    keys = \
+        np.char.add(np.char.add(index["chain"], "."),
+                    index["resnum"].astype(str))
+
+    # Get the order of the keys (stable, so that residues
+    # differing only by insertion code are looked up as the
+    # first one)
+    order = np.argsort(keys, kind = "stable")
+
+    # Return the table
+    return \
+        {"keys" : keys[order],
+         "resnames" : index["resname"][order],
+         "one_letter" : get_one_letter_codes(index)[order]}
+
+
+def _check_chunk(table,
+                 chain_refs,
+                 names,
+                 chains,
+                 numrs,
+                 wtrs):
+    """Check a chunk of single mutations (given as lists of the
+    names of the mutations they belong to, chains, residue
+    numbers and wild-type residues) and the chains referred to
+    by the mutations (as (mutation name, chain) tuples) against
+    the residues of a structure. Return the problems found as
+    (mutation name, problem) tuples.
+    """
+
+    # Get the keys of the residues mutated (a chain without ID
+    # is written as '_' in the mutations)
+    chains = np.array(chains, dtype = str)
+    chains = np.where(chains == "_", " ", chains)
+    keys = np.char.add(np.char.add(chains, "."),
+                       np.array(numrs, dtype = str))
+
+    # Look up the residues in the table
+    pos = np.searchsorted(table["keys"], keys)
+    pos = np.minimum(pos, len(table["keys"]) - 1)
+    found = table["keys"][pos] == keys
+
+    # Get the wild-type residues (noncanonical residues are
+    # written as 'X[NAME]')
+    wtrs = np.array(wtrs, dtype = str)
+    is_ncaa = np.char.str_len(wtrs) > 1
+    wtrs = np.where(is_ncaa, np.char.strip(wtrs, "X[]"), wtrs)
+
+    # Get whether the wild-type residues match the structure
+    matches = \
+        np.where(is_ncaa,
+                 table["resnames"][pos] == wtrs,
+                 table["one_letter"][pos] == wtrs)
+
+    # Create an empty list to store the problems found
+    problems = []
+
+    # For each single mutation whose residue was not found
+    for ix in np.flatnonzero(~found).tolist():
+        
+        # Report the problem
+        problems.append(\
+            (names[ix],
+             f"residue {numrs[ix]} not found in chain " \
+             f"'{chains[ix].strip()}'"))
+
+    # For each single mutation whose wild-type residue does
+    # not match
+    for ix in np.flatnonzero(found & ~matches).tolist():
+
+        # Report the problem
+        problems.append(\
+            (names[ix],
+             f"wild-type residue of {chains[ix].strip()}." \
+             f"{numrs[ix]} is '{wtrs[ix]}' in the mutation but " \
+             f"'{table['resnames'][pos[ix]]}' in the structure"))
+
+    # Get whether the chains referred to exist
+    chains_found = \
+        np.isin(np.array([c for _, c in chain_refs], dtype = str),
+                table["chains"])
+
+    # For each chain referred to that was not found
+    for ix in np.flatnonzero(~chains_found).tolist():
+
+        # Report the problem
+        name, chain = chain_refs[ix]
+        problems.append(\
+            (name, f"chain '{chain}' not found in the structure"))
+
+    # Return the problems
+    return problems
+
+
+def validate_mutations(mutations,
+                       pdb_file,
+                       chain_keys = (),
+                       chunk_size = VALIDATION_CHUNK_SIZE):
+    """Check that the residues mutated exist in a structure and
+    that their wild-type residues match those of the structure,
+    and that the chains named by the extra data of the mutations
+    whose keys are in 'chain_keys' (e.g. the chain to be moved
+    away from the interface) exist. 'mutations' is an iterable
+    of mutations in the PDB numbering, checked in chunks of
+    'chunk_size' mutations. Return the number of mutations
+    checked and a dictionary mapping the names of the invalid
+    mutations to the problems found.
+    """
+
+    # Get the index of the residues of the structure and build
+    # the table used to look them up
+    index = get_residue_index(pdb_file)
+    table = _get_residue_table(index)
+    table["chains"] = index["chain_ids"]
+
+    # Keep track of the number of mutations checked
+    n_mutations = 0
+
+    # Create an empty dictionary to store the problems found
+    invalid = {}
+
+    # Consider only one copy of each mutation (the copies of a
+    # mutation for different structures are generated one after
+    # the other)
+    mutations = \
+        (next(group) for _, group \
+         in itertools.groupby(mutations,
+                              key = lambda m: m[MUT_DIR_NAME]))
+
+    # Get an iterator over the mutations
+    mutations = iter(mutations)
+
+    # For each chunk of mutations
+    for chunk in iter(lambda: list(itertools.islice(mutations,
+                                                    chunk_size)),
+                      []):
+
+        # Update the number of mutations checked
+        n_mutations += len(chunk)
+
+        # Get the single mutations in the chunk
+        single_muts = \
+            [(mut[MUT_DIR_NAME], single_mut) \
+             for mut in chunk for single_mut in mut[MUT]]
+
+        # Get the chains referred to by the extra data, splitting
+        # multiple chains (e.g. 'A,B')
+        chain_refs = \
+            [(mut[MUT_DIR_NAME], chain) \
+             for mut in chunk for key in chain_keys \
+             for chain in str(mut.get(key, "")).split(",") \
+             if chain]
+
+        # Check the chunk
+        problems = \
+            _check_chunk(\
+                table = table,
+                chain_refs = chain_refs,
+                names = [name for name, _ in single_muts],
+                chains = [m[CHAIN] for _, m in single_muts],
+                numrs = [m[NUMR] for _, m in single_muts],
+                wtrs = [m[WTR] for _, m in single_muts]) \
+            if single_muts else []
+
+        # Add the problems found
+        for name, problem in problems:
+            invalid.setdefault(name, []).append(problem)
+
+    # Return the number of mutations checked and the problems
+    return n_mutations, invalid
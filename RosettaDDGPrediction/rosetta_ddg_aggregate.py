@@ -35,19 +35,28 @@ import collections
 import logging as log
 import os
 import os.path
+import shutil
 import sys
 # Third-party packages
 import dask
-from distributed import Client, LocalCluster
 import pandas as pd
 # RosettaDDGProtocols
 from . import aggregation 
+from . import aggregationindex
+from . import backends
+from . import columnar
+from . import telemetry
 from .defaults import (
+    AGGREGATION_INDEX_FILE,
+    CARTDDG_PARSE_BATCH_SIZE,
     COMP_SEP,
     CONFIG_AGGR_DIR,
     CONFIG_AGGR_FILE,
     CONFIG_RUN_DIR,
     CONFIG_SETTINGS_DIR,
+    MUTINFO_COLS,
+    OUTPUT_FORMATS,
+    TELEMETRY_FILE
 )
 from . import util
 
@@ -121,6 +130,28 @@ def main():
                               type = str,
                               help = mf_help)
 
+    of_default = "csv"
+    of_help = \
+        f"Format of the output files. With 'parquet' or 'arrow' " \
+        f"(Arrow IPC), the aggregated and per-structure data are " \
+        f"written as two columnar datasets (directories with one " \
+        f"file per mutation) instead of CSV files. " \
+        f"Default is '{of_default}'."
+    general_args.add_argument("-of", "--output-format",
+                              type = str,
+                              choices = list(OUTPUT_FORMATS),
+                              default = of_default,
+                              help = of_help)
+
+    noincremental_help = \
+        f"Parse all outputs again, instead of only those that " \
+        f"are new or were modified since the last aggregation " \
+        f"in the same output directory (tracked in " \
+        f"{AGGREGATION_INDEX_FILE})."
+    general_args.add_argument("--no-incremental",
+                              action = "store_true",
+                              help = noincremental_help)
+
     n_help = \
         "Number of processes to be started in parallel. " \
         "Default is one process (no parallelization)."
@@ -174,6 +205,12 @@ def main():
     run_dir = args.running_dir
     out_dir = args.output_dir
     
+    # Format of the output files
+    out_format = args.output_format
+
+    # Whether to parse only new or modified outputs
+    incremental = not args.no_incremental
+
     # Others
     mutinfo_file = util.get_abspath(args.mutinfofile)
     n_proc = args.nproc
@@ -200,12 +237,18 @@ def main():
         log.error(errstr)
         sys.exit(errstr)
 
-    # Create the local cluster
-    cluster = LocalCluster(n_workers = n_proc,
-                           **settings["localcluster"])
-    
-    # Open the client from the cluster
-    client = Client(cluster)
+    # Try to create the cluster and open the client
+    try:
+        
+        client, cluster = backends.get_client(settings = settings,
+                                              n_proc = n_proc)
+
+    # If something went wrong, report it and exit
+    except Exception as e:
+        
+        errstr = f"Could not set up the Dask cluster: {e}"
+        log.error(errstr)
+        sys.exit(errstr)
 
 
 
@@ -326,6 +369,10 @@ def main():
             options[util.get_option_key(options = options,
                                         option = "scf_name")]
 
+        # Get whether the wild-type reference was computed only
+        # once for all mutations at the same position(s)
+        share_wt = config_run["steps"]["cartesian"]["sharewt"]
+
 
     # If the protocol is a flexddg protocol
     elif family == "flexddg":
@@ -370,6 +417,12 @@ def main():
         
         # Format the structure names as strings
         struct_nums = [str(num) for num in range(1, n_struct + 1)]
+
+        # Get whether the number of structures was chosen
+        # adaptively (in which case fewer structures may have
+        # been generated for some mutations)
+        adaptive_sampling = \
+            config_run["steps"]["flexddg"]["adaptive"]["enabled"]
         
         # Compute the trajectory stride
         traj_stride = int(backrub_n_trials) // int(backrub_traj_stride)
@@ -395,6 +448,10 @@ def main():
         step_run_dir_path = os.path.join(run_dir, step_run_dir)
  
 
+    # Set the path to the file where the events of the tasks
+    # are recorded (the same used when running the protocol)
+    events_file = os.path.join(run_dir, TELEMETRY_FILE)
+
     # Get info about the mutations
     try:
         
@@ -410,147 +467,292 @@ def main():
         sys.exit(errstr)
 
 
-    # For each mutation
-    for i, (mut_name, dir_name, mut_label, pos_label) \
-        in mutinfo.iterrows():
+    # If the data should be written in a columnar format
+    if out_format != "csv":
+
+        # Check that 'pyarrow' is available before parsing anything
+        try:
+            columnar.import_pyarrow()
+
+        # If it is not, report it and exit
+        except ImportError as e:
+            log.error(e)
+            sys.exit(str(e))
+
+        # Get the paths to the datasets that will store the data
+        # for all mutations
+        out_datasets = \
+            [columnar.get_dataset_path(\
+                out_file = os.path.join(out_dir, out_file_name),
+                out_format = out_format) \
+             for out_file_name in (mut_aggr, mut_struct)]
+
+    # Get the path to the aggregation index
+    index_file = os.path.join(out_dir, AGGREGATION_INDEX_FILE)
+
+    # Get the key identifying the settings the aggregated data
+    # depend on
+    settings_key = \
+        aggregationindex.get_settings_key(\
+            family = family,
+            out_name = out_name,
+            scf_name = scf_name,
+            list_contributions = list_contributions,
+            conv_fact = conv_fact,
+            rescale = rescale,
+            dfs_options = dfs_options,
+            out_names = dfs_out_names,
+            out_format = out_format,
+            traj_stride = traj_stride if family == "flexddg" else None)
+
+    # Load the entries of the index (if the whole aggregation
+    # should be redone, start from an empty index)
+    index = \
+        aggregationindex.load_index(index_file = index_file,
+                                    settings_key = settings_key) \
+        if incremental else {}
+
+    # If the data should be written in a columnar format
+    if out_format != "csv":
+
+        # For each dataset
+        for out_dataset in out_datasets:
+
+            # If previous results are reused, remove only the
+            # files of the mutations that are no longer aggregated
+            if index:
+                columnar.remove_stale_fragments(\
+                    dataset_path = out_dataset,
+                    names = mutinfo[MUTINFO_COLS["mut_label"]],
+                    out_format = out_format)
+
+            # Otherwise, remove datasets written by previous
+            # aggregations, so that they do not mix with the new
+            # data
+            else:
+                shutil.rmtree(out_dataset, ignore_errors = True)
+
+    # Create lists to store the futures of the aggregation of
+    # each mutation and the records of the output files parsed
+    # for each mutation (or the futures computing them), in the
+    # order of the mutations
+    mut_futures = [None] * len(mutinfo)
+    mut_records = [None] * len(mutinfo)
+
+    # Create an empty list to store the mutations whose cartddg
+    # outputs will be parsed in batches
+    cartddg_pending = []
+
+    # For each mutation, submit the parsing of its output(s) and
+    # its aggregation, which runs as soon as the parsing is over,
+    # without waiting for the results (the mutations are
+    # aggregated in parallel)
+    for i, (_, mutation) in enumerate(mutinfo.iterrows()):
+
+        # Get the mutation's name, directory name and labels
+        mut_name, dir_name, mut_label, pos_label = mutation
         
         # Get the mutation directory path
         mut_path = os.path.join(step_run_dir_path, dir_name)
 
+        # Set the data to be recorded with the events of the
+        # mutation's tasks
+        event_data = {"step" : "aggregation", "wd" : mut_path}
+
+        # Get the files where the mutation's data will be written
+        out_files = \
+            (os.path.join(out_dir, mut_label + oa_suffix),
+             os.path.join(out_dir, mut_label + os_suffix)) \
+            if out_format == "csv" else out_datasets
+
         # If the protocol is a cartddg protocol
         if family in ("cartddg", "cartddg2020"):
             
             # Get the path to the output file
             ddg_out = os.path.join(mut_path, out_name)
+
+            # Get the path to the output file containing the
+            # shared wild-type reference, if any
+            wt_ddg_out = \
+                os.path.join(\
+                    step_run_dir_path,
+                    util.get_wt_reference_dir_path_from_name(mut_name),
+                    out_name) \
+                if share_wt else None
+
+            # Get the output files to be parsed
+            in_files = [f for f in (ddg_out, wt_ddg_out) if f is not None]
             
-            # Try to parse the output file
-            try:
-                
-                df = client.submit(\
-                        aggregation.parse_output_cartddg,
-                        ddg_out = ddg_out,
-                        list_contributions = list_contributions,
-                        scf_name = scf_name)
-            
-            # If something went wrong, report it and continue
-            except Exception as e:
-                
-                log.warning(f"Could not parse {ddg_out}: {e}")
-                continue
-            
-            # Try to get the aggregated dataframes          
-            try:
-                
-                dfs = \
-                    client.submit(\
-                        aggregation.aggregate_data_cartddg,
-                        df = df,
-                        list_contributions = list_contributions).result()
-            
-            # If something went wrong, report it and exit
-            except Exception as e:
-                
-                errstr = f"Could not aggregate data for " \
-                         f"{os.path.basename(mut_path)}: {e}"
-                log.error(errstr)
-                sys.exit(errstr)
-        
-        
         # If the protocol is a flexddg protocol
         elif family == "flexddg":
-            
-            # Initialize an empty list to store
-            # dataframes for all structures
-            struct_dfs = []
-            
-            # For each structure
-            for struct_num in struct_nums:
-                
-                # Structure path 
-                struct_path = os.path.join(mut_path, struct_num)
-                
-                # Path to the .db3 output file containing the
-                # scores
-                db3_out = os.path.join(struct_path, out_name)
-                
-                # Try to create a dataframe from the .db3 output file
-                try:
-                    
-                    df = client.submit(\
-                            aggregation.parse_output_flexddg,
-                            db3_out = db3_out,
-                            traj_stride = traj_stride,
-                            struct_num = struct_num,
-                            scf_name = scf_name)
-                
-                # If something went wrong, report it and continue
-                except Exception as e:
-                    
-                    log.warning(f"Could not parse {db3_out}: {e}")
-                    continue
-                
-                # Append the dataframe to the list
-                struct_dfs.append(df.result())
 
-            # Try to generate the aggregated dataframes            
-            try:
-                
-                dfs = \
-                    client.submit(\
-                        aggregation.aggregate_data_flexddg,
-                        df = pd.concat(struct_dfs),
-                        list_contributions = list_contributions).result()
-            
-            # If something went wrong, report it and exit
-            except Exception as e:
-                
-                errstr = f"Could not aggregate data for " \
-                         f"{os.path.basename(mut_path)}: {e}"
-                log.error(errstr)
-                sys.exit(errstr)
+            # Get the .db3 output files containing the scores
+            # for each structure
+            db3_outs = \
+                {struct_num : os.path.join(mut_path, struct_num, out_name) \
+                 for struct_num in struct_nums}
+
+            # If the number of structures was chosen adaptively,
+            # skip the structures that were not generated because
+            # the sampling had already converged
+            if adaptive_sampling:
+                db3_outs = \
+                    {struct_num : db3_out for struct_num, db3_out \
+                     in db3_outs.items() if os.path.exists(db3_out)}
+
+            # Get the output files to be parsed
+            in_files = list(db3_outs.values())
+
+        # Check whether the mutation was already aggregated from
+        # the same output files (and the aggregated data are
+        # still there)
+        records = \
+            aggregationindex.check_entry(entry = index.get(dir_name),
+                                         mutation = mutation,
+                                         files = in_files) \
+            if all(os.path.exists(f) for f in out_files) else None
+
+        # If it was
+        if records is not None:
+
+            # Load the data aggregated previously
+            mut_futures[i] = \
+                client.submit(aggregation.load_mutation,
+                              out_files = out_files,
+                              mut_label = mut_label,
+                              out_format = out_format)
+
+            # Keep the records of the output files
+            mut_records[i] = records
+
+            # Go to the next mutation
+            continue
+
+        # Record the output files parsed (and their contents)
+        mut_records[i] = \
+            client.submit(aggregationindex.get_file_records,
+                          files = in_files)
+
+        # Set the arguments to aggregate the data, generate the
+        # aggregated and all-structures data frames and save them
+        aggr_kwargs = \
+            {"task_func" : aggregation.aggregate_mutation,
+             "events_file" : events_file,
+             "event_data" : event_data,
+             "family" : family,
+             "mutation" : mut_name,
+             "mut_label" : mut_label,
+             "pos_label" : pos_label,
+             "rescale" : rescale,
+             "list_contributions" : list_contributions,
+             "conv_fact" : conv_fact,
+             "out_files" : out_files,
+             "dfs_options" : dfs_options,
+             "out_format" : out_format}
 
-        
-        # Separate the dataframes with the wild-type ΔG, the
-        # mutant ΔG and the ΔΔG
-        dg_wt, dg_mut, ddg = dfs
+        # If the protocol is a cartddg protocol
+        if family in ("cartddg", "cartddg2020"):
 
-        # Try to generate the aggregated and all-structures dataframes
+            # Leave the mutation to be parsed later, in a batch
+            # with other mutations (the output files are small,
+            # so they are parsed in batches to keep the number
+            # of tasks low)
+            cartddg_pending.append((i, ddg_out, wt_ddg_out, aggr_kwargs))
+        
+        # If the protocol is a flexddg protocol
+        elif family == "flexddg":
+            
+            # Create a data frame from each .db3 output file
+            # (structures whose output cannot be parsed are
+            # skipped with a warning)
+            df = \
+                [client.submit(\
+                    telemetry.timed_call,
+                    task_func = aggregation.try_parse_output_flexddg,
+                    events_file = events_file,
+                    event_data = event_data,
+                    db3_out = db3_out,
+                    traj_stride = traj_stride,
+                    struct_num = struct_num,
+                    scf_name = scf_name,
+                    list_contributions = list_contributions) \
+                 for struct_num, db3_out in db3_outs.items()]
+
+            # Aggregate the data
+            mut_futures[i] = \
+                client.submit(telemetry.timed_call,
+                              df = df,
+                              **aggr_kwargs)
+
+    # For each batch of mutations whose cartddg outputs should
+    # be parsed
+    for batch in util.get_run_chunks(runs = cartddg_pending,
+                                     chunk_size = CARTDDG_PARSE_BATCH_SIZE):
+
+        # Parse the output files of the mutations in the batch
+        # at once
+        df = client.submit(\
+                telemetry.timed_call,
+                task_func = aggregation.parse_outputs_cartddg,
+                events_file = events_file,
+                event_data = {"step" : "aggregation",
+                              "wd" : step_run_dir_path},
+                ddg_outs = [ddg_out for _, ddg_out, _, _ in batch],
+                list_contributions = list_contributions,
+                scf_name = scf_name,
+                wt_ddg_outs = [wt_out for _, _, wt_out, _ in batch])
+
+        # For each mutation in the batch, aggregate the data
+        # parsed from its output file
+        for i, ddg_out, _, aggr_kwargs in batch:
+            mut_futures[i] = \
+                client.submit(telemetry.timed_call,
+                              df = df,
+                              df_key = ddg_out,
+                              **aggr_kwargs)
+
+    # Inform the user about how many mutations were reused
+    n_reused = sum(isinstance(r, dict) for r in mut_records)
+    if n_reused:
+        infostr = \
+            f"{n_reused} of {len(mut_records)} mutations were " \
+            f"already aggregated from the same outputs, which " \
+            f"will not be parsed again."
+        log.info(infostr)
+
+    # Map each future to the position of its mutation
+    mut_positions = {f.key : i for i, f in enumerate(mut_futures)}
+
+    # Create a list to store the data frames of each mutation
+    # (in the order of the mutations, whatever the order in
+    # which they are completed)
+    mut_dfs = [None] * len(mut_futures)
+
+    # For each mutation, as soon as its aggregation is complete
+    for future in backends.as_completed(mut_futures):
+
+        # Get the position of the mutation
+        i = mut_positions[future.key]
+
+        # Try to get the aggregated and all-structures data frames
         try:
             
-            aggr_df, struct_df = \
-                client.submit(\
-                    aggregation.generate_output_dataframes,
-                    dg_wt = dg_wt,
-                    dg_mut = dg_mut,
-                    ddg = ddg,
-                    mutation = mut_name,
-                    mut_label = mut_label,
-                    pos_label = pos_label,
-                    rescale = rescale,
-                    list_contributions = list_contributions,
-                    conv_fact = conv_fact,
-                    family = family).result()
+            mut_dfs[i] = future.result()
         
         # If something went wrong, report it and exit
         except Exception as e:
             
-            errstr = f"Could not generate output dataframes: {e}"
+            errstr = \
+                f"Could not aggregate data for " \
+                f"{mutinfo.iloc[i][MUTINFO_COLS['dir_name']]}: {e}"
             log.error(errstr)
             sys.exit(errstr)
 
+    # For each mutation (in order)
+    for (mut_name, dir_name, mut_label, pos_label), \
+        (aggr_df, struct_df) \
+        in zip(mutinfo.itertuples(index = False), mut_dfs):
 
-        # Save the aggregated dataframe
-        aggr_df_path = os.path.join(out_dir, mut_label + oa_suffix)
-        futures.append(client.submit(aggr_df.to_csv,
-                                     aggr_df_path,
-                                     **dfs_options))
-
-        # Save the all-structures dataframe
-        struct_df_path = os.path.join(out_dir, mut_label + os_suffix)
-        futures.append(client.submit(struct_df.to_csv,
-                                     struct_df_path,
-                                     **dfs_options))
-        
         # Add the dataframes to the lists of all-mutations data frames
         mut_aggr_dfs.append(aggr_df)
         mut_struct_dfs.append(struct_df)
@@ -583,24 +785,25 @@ def main():
                 {mutr : struct_df})
 
 
-    # Aggregate the dataframes containing single mutations
-    mut_aggr_df = client.submit(pd.concat,
-                                mut_aggr_dfs,
-                                sort = False).result()
-    mut_struct_df = client.submit(pd.concat,
-                                  mut_struct_dfs,
-                                  sort = False).result()
+    # If the data were written as CSV files (columnar datasets
+    # already contain the data for all mutations, one file per
+    # mutation)
+    if out_format == "csv":
+
+        # Aggregate the dataframes containing single mutations
+        mut_aggr_df = pd.concat(mut_aggr_dfs, sort = False)
+        mut_struct_df = pd.concat(mut_struct_dfs, sort = False)
     
-    # Save the dataframes with data for all the mutations
-    mut_aggr_df_path = os.path.join(out_dir, mut_aggr)
-    futures.append(client.submit(mut_aggr_df.to_csv,
-                                 mut_aggr_df_path,
-                                 **dfs_options))
+        # Save the dataframes with data for all the mutations
+        mut_aggr_df_path = os.path.join(out_dir, mut_aggr)
+        futures.append(client.submit(mut_aggr_df.to_csv,
+                                     mut_aggr_df_path,
+                                     **dfs_options))
 
-    mut_struct_df_path = os.path.join(out_dir, mut_struct)
-    futures.append(client.submit(mut_struct_df.to_csv, \
-                                 mut_struct_df_path, \
-                                 **dfs_options))
+        mut_struct_df_path = os.path.join(out_dir, mut_struct)
+        futures.append(client.submit(mut_struct_df.to_csv, \
+                                     mut_struct_df_path, \
+                                     **dfs_options))
 
     # If the conversion to MutateX-compatible outputs has been
     # requested
@@ -626,6 +829,21 @@ def main():
     # Gather pending futures
     client.gather(futures)
 
+    # Create the entries of the aggregation index (the records
+    # of the outputs just parsed are computed by the futures)
+    entries = \
+        {dir_name : {"mutation" : [mut_name, dir_name,
+                                   mut_label, pos_label],
+                     "files" : records if isinstance(records, dict) \
+                               else records.result()} \
+         for (mut_name, dir_name, mut_label, pos_label), records \
+         in zip(mutinfo.itertuples(index = False), mut_records)}
+
+    # Write the aggregation index
+    aggregationindex.write_index(index_file = index_file,
+                                 settings_key = settings_key,
+                                 entries = entries)
+
 
 if __name__ == "__main__":
     main()
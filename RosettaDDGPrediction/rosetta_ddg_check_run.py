@@ -166,6 +166,19 @@ def main():
             # the mutations
             dirs_paths = dirs_mutations
 
+            # If the wild-type reference was computed only once
+            # for all mutations at the same position(s)
+            if config_run["steps"]["cartesian"]["sharewt"]:
+
+                # Add the directories where the wild-type references
+                # have been computed
+                dirs_paths = \
+                    dirs_paths + \
+                    list(dict.fromkeys(\
+                        [os.path.join(run_dir,
+                            util.get_wt_reference_dir_path_from_name(m)) \
+                         for m in mutinfo[MUTINFO_COLS["mut_name"]]]))
+
         # If it is a flexddg protocol
         elif family == "flexddg":
 
@@ -58,7 +58,8 @@ def main():
     parser = argparse.ArgumentParser()
 
     # Add arguments
-    i_help = "Input CSV file (aggregated data)."
+    i_help = "Input CSV file or Parquet/Arrow dataset " \
+             "(aggregated data)."
     parser.add_argument("-i", "--infile",
                         type = str,
                         required = True,
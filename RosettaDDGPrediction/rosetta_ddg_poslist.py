@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    rosetta_ddg_poslist.py
+#
+#    Write the list of positions of a structure to be scanned
+#    (e.g. by saturation mutagenesis), optionally filtered by
+#    chain, residue range, proximity to other chains and
+#    solvent accessibility.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import argparse
+import logging as log
+import os
+import sys
+# RosettaDDGPrediction
+from . import positions
+from . import util
+
+
+
+def main():
+
+
+
+    ######################### ARGUMENT PARSER #########################
+
+
+
+    description = \
+        "\nWrite the list of positions of a structure to be " \
+        "scanned, in the format of the mutations' list file " \
+        "used for saturation mutagenesis. All amino acid " \
+        "residues are listed, unless filters are given (a " \
+        "residue must pass all filters to be listed).\n"
+
+    # Create the argument parser
+    parser = argparse.ArgumentParser(description = description)
+
+    # Add arguments
+    p_help = "PDB file of the structure."
+    parser.add_argument("-p", "--pdbfile",
+                        type = str,
+                        required = True,
+                        help = p_help)
+
+    o_help = \
+        "Output list file. Default is poslist.txt in the " \
+        "current working directory."
+    parser.add_argument("-o", "--outfile",
+                        type = str,
+                        default = os.path.join(os.getcwd(),
+                                               "poslist.txt"),
+                        help = o_help)
+
+    c_help = \
+        "Chain(s) whose residues will be listed. If residue " \
+        "ranges are also given, the residues in the chains or " \
+        "in the ranges are listed."
+    parser.add_argument("-c", "--chains",
+                        type = str,
+                        nargs = "+",
+                        default = None,
+                        help = c_help)
+
+    r_help = \
+        "Residue range(s) whose residues will be listed, in the " \
+        "form 'chain:start-end' (e.g. A:10-50) or 'chain:number'."
+    parser.add_argument("-r", "--ranges",
+                        type = str,
+                        nargs = "+",
+                        default = None,
+                        help = r_help)
+
+    i_help = \
+        "List only the residues with at least one heavy atom " \
+        "within this distance (in Å) from a heavy atom of " \
+        "another chain."
+    parser.add_argument("-i", "--interface-cutoff",
+                        type = float,
+                        default = None,
+                        help = i_help)
+
+    rsamin_help = \
+        "List only the residues whose relative solvent " \
+        "accessibility (between 0 and 1) is at least this value."
+    parser.add_argument("--rsa-min",
+                        type = float,
+                        default = None,
+                        help = rsamin_help)
+
+    rsamax_help = \
+        "List only the residues whose relative solvent " \
+        "accessibility (between 0 and 1) is at most this value."
+    parser.add_argument("--rsa-max",
+                        type = float,
+                        default = None,
+                        help = rsamax_help)
+
+    nochain_help = \
+        "Do not write the chain ID after each position (it is " \
+        "used as the chain to be moved away from the interface " \
+        "by flexddg protocols)."
+    parser.add_argument("--no-chain-column",
+                        action = "store_true",
+                        help = nochain_help)
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    # Files
+    pdb_file = util.get_abspath(args.pdbfile)
+    out_file = util.get_abspath(args.outfile)
+
+    # Filters
+    chains = args.chains
+    ranges = args.ranges
+    interface_cutoff = args.interface_cutoff
+    rsa_min = args.rsa_min
+    rsa_max = args.rsa_max
+
+    # Others
+    chain_column = not args.no_chain_column
+
+
+
+    ############################## LOGGING ############################
+
+
+
+    # Basic logging configuration
+    log.basicConfig(level = log.INFO)
+
+
+
+    ############################ POSITIONS ############################
+
+
+
+    # Try to get the positions passing the filters
+    try:
+
+        pos_list = \
+            positions.get_positions(\
+                pdb_file = pdb_file,
+                chains = chains,
+                ranges = positions.parse_ranges(ranges or []),
+                interface_cutoff = interface_cutoff,
+                rsa_min = rsa_min,
+                rsa_max = rsa_max)
+
+    # If something went wrong, report it and exit
+    except Exception as e:
+
+        errstr = f"Could not select the positions: {e}"
+        log.error(errstr)
+        sys.exit(errstr)
+
+    # Try to write the list of positions
+    try:
+
+        positions.write_position_list(positions = pos_list,
+                                      out_file = out_file,
+                                      chain_column = chain_column)
+
+    # If something went wrong, report it and exit
+    except Exception as e:
+
+        errstr = f"Could not write the list of positions: {e}"
+        log.error(errstr)
+        sys.exit(errstr)
+
+    # Inform the user
+    logstr = f"{len(pos_list)} position(s) written to {out_file}."
+    log.info(logstr)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,28 +32,42 @@
 
 # Standard library
 import argparse
+import functools
+import itertools
+import json
 import logging as log
 import os
 import os.path
+import random
 import sys
+import time
 # Third-party packages
 import dask
-from distributed import (
-    Client,
-    fire_and_forget,
-    LocalCluster
-)
+from distributed import fire_and_forget
 import yaml
 # RosettaDDGProtocols
+from . import adaptive
+from . import backends
 from . import cleaning
+from . import failures
 from .defaults import (
+    CHAIN_EXTRA_KEYS,
     CONFIG_RUN_DIR,
     CONFIG_SETTINGS_DIR,
+    FAILURE_REPORT_FILE,
+    MAX_LOGGED_MUTATIONS,
     MUT_DIR_NAME,
-    MUT_DIR_PATH,
-    ROSETTA_PROTOCOLS
+    ROSETTA_PROTOCOLS,
+    RUN_MANIFEST_FILE,
+    SATURATION_SAMPLING_METHODS,
+    TELEMETRY_FILE
 )
+from . import planning
 from . import pythonsteps
+from . import residueindex
+from . import scheduling
+from . import speculation
+from . import telemetry
 from . import util
 
 
@@ -77,6 +91,8 @@ def main():
         parser.add_argument_group("General arguments")
     sat_args = \
         parser.add_argument_group("Saturation-related arguments")
+    exec_args = \
+        parser.add_argument_group("Execution-related arguments")
 
 
     #---------------------------- General ----------------------------#
@@ -128,6 +144,15 @@ def main():
                               default = None,
                               help = l_help)
 
+    skip_invalid_help = \
+        "Skip the mutations that do not match the structure (the " \
+        "residue or a chain they refer to does not exist or the " \
+        "wild-type residue differs) instead of refusing to start " \
+        "the run."
+    general_args.add_argument("--skip-invalid",
+                              action = "store_true",
+                              help = skip_invalid_help)
+
     n_help = \
         "Number of processes to be started in parallel. " \
         "Default is one process (no parallelization)."
@@ -155,6 +180,93 @@ def main():
                           default = None,
                           help = reslistfile_help)
 
+    maxcombinations_help = \
+        "Maximum number of mutations generated by each line of " \
+        "the list of positions (multiple positions on the same " \
+        "line generate all combinations of the residue types). " \
+        "If a line generates more combinations, they are sampled " \
+        "with the method given by --sampling or, if no method is " \
+        "given, the run is stopped. Default is no maximum. It " \
+        "is used only if --saturation is provided."
+    sat_args.add_argument("--maxcombinations",
+                          type = int,
+                          default = None,
+                          help = maxcombinations_help)
+
+    sampling_help = \
+        "How to sample the combinations of mutations of a line " \
+        "generating more than --maxcombinations combinations: " \
+        "'random' (uniformly at random) or 'stratified' (so " \
+        "that each residue type appears at each position nearly " \
+        "the same number of times)."
+    sat_args.add_argument("--sampling",
+                          type = str,
+                          choices = SATURATION_SAMPLING_METHODS,
+                          default = None,
+                          help = sampling_help)
+
+    seed_help = \
+        "Seed used to sample the combinations of mutations. If " \
+        "not provided, a random seed is used and logged, so " \
+        "that the sample can be reproduced (e.g. when resuming " \
+        "the run with --resume)."
+    sat_args.add_argument("--seed",
+                          type = int,
+                          default = None,
+                          help = seed_help)
+
+
+    #--------------------------- Execution ---------------------------#
+
+
+    pipeline_help = \
+        "Submit the whole protocol as a single task graph, where " \
+        "each mutation's chain of steps is an independent branch " \
+        "and every task starts as soon as its own inputs are " \
+        "ready, instead of waiting for all tasks of the previous " \
+        "step to complete."
+    exec_args.add_argument("--pipeline",
+                           action = "store_true",
+                           help = pipeline_help)
+
+    resume_help = \
+        f"Resume a previous run in the same directory, skipping " \
+        f"the steps and mutations whose output is already " \
+        f"complete and resubmitting only missing or broken work. " \
+        f"Completed runs are recorded in {RUN_MANIFEST_FILE} " \
+        f"inside the running directory."
+    exec_args.add_argument("--resume",
+                           action = "store_true",
+                           help = resume_help)
+
+    past_timings_help = \
+        f"Running directories of previous runs whose timings " \
+        f"(recorded in {RUN_MANIFEST_FILE}) will be used to " \
+        f"estimate how long each run will take, when starting " \
+        f"the longest runs first."
+    exec_args.add_argument("--past-timings",
+                           type = str,
+                           nargs = "+",
+                           default = [],
+                           help = past_timings_help)
+
+    plan_help = \
+        "Do not run the protocol, but process the arguments, the " \
+        "configuration files, the PDB file and the mutations and " \
+        "write the plan of the run as JSON (the tasks that would " \
+        "be run, the Rosetta processes per step, the estimated " \
+        "core-hours, disk footprint and peak memory, and the " \
+        "critical path) to the given file or, if no file is " \
+        "given, to the standard output. Times, disk space and " \
+        "memory are estimated from the runs passed with " \
+        "--past-timings."
+    exec_args.add_argument("--plan",
+                           type = str,
+                           nargs = "?",
+                           const = "-",
+                           default = None,
+                           help = plan_help)
+
     # Collect the arguments
     args = parser.parse_args()
     
@@ -171,7 +283,15 @@ def main():
     
     # Others
     n_proc = args.nproc
+    skip_invalid = args.skip_invalid
     saturation = args.saturation
+    max_combs = args.maxcombinations
+    sampling = args.sampling
+    seed = args.seed
+    pipeline = args.pipeline
+    resume = args.resume
+    past_timings_dirs = [util.get_abspath(d) for d in args.past_timings]
+    plan_file = args.plan
 
 
 
@@ -199,6 +319,29 @@ def main():
         log.error(errstr)
         sys.exit(errstr)
 
+    # Ensure that the maximum number of combinations is positive
+    if max_combs is not None and max_combs < 1:
+
+        errstr = \
+            f"The maximum number of combinations must be a " \
+            f"positive integer, but {max_combs} was passed."
+        log.error(errstr)
+        sys.exit(errstr)
+
+    # If the combinations may be sampled but no seed was given
+    if sampling is not None and seed is None:
+
+        # Draw a seed, so that the same combinations are sampled
+        # every time the mutations are generated
+        seed = random.randrange(2**32)
+
+        # Inform the user about the seed
+        logstr = \
+            f"The combinations of mutations will be sampled with " \
+            f"seed {seed} (pass --seed {seed} to reproduce the " \
+            f"sample)."
+        log.info(logstr)
+
 
 
     ############################## CLIENT #############################
@@ -220,12 +363,27 @@ def main():
         sys.exit(errstr)
 
 
-    # Create the local cluster
-    cluster = LocalCluster(n_workers = n_proc,
-                           **settings["localcluster"])
-    
-    # Open the client from the cluster
-    client = Client(cluster)
+    # If only planning the run, no cluster is needed
+    if plan_file is not None:
+
+        client, cluster = None, None
+
+    # Otherwise, try to create the cluster and open the client
+    else:
+
+        try:
+            
+            client, cluster = \
+                backends.get_client(settings = settings,
+                                    n_proc = n_proc,
+                                    use_resources = True)
+
+        # If something went wrong, report it and exit
+        except Exception as e:
+            
+            errstr = f"Could not set up the Dask cluster: {e}"
+            log.error(errstr)
+            sys.exit(errstr)
 
 
 
@@ -302,17 +460,42 @@ def main():
             log.error(errstr)
             sys.exit(errstr)
         
-        # Try to generate the list of mutations
+        # Get a function generating the mutations lazily (the
+        # mutations are streamed rather than kept in memory, so
+        # they are generated anew each time they are needed, and
+        # duplicates and sampled combinations are reported only
+        # the first time)
+        mutations = \
+            functools.partial(\
+                util.iter_mutations,
+                list_file = list_file,
+                res_list_file = res_list_file,
+                pdb_file = curr_pdb_file,
+                res_numbering = mut_options["resnumbering"],
+                extra = mut_options["extra"],
+                n_struct = mut_options["nstruct"],
+                max_combs = max_combs,
+                sampling = sampling,
+                seed = seed,
+                verbose = False)
+
+        # Try to go through the mutations once, to find errors in
+        # the list and mutations not matching the structure before
+        # any step is run, and count them (only the mutations in
+        # the PDB numbering are checked, so they are not converted
+        # to the pose numbering, which would fail for residues
+        # missing from the structure)
         try:
             
-            mutations, mutations_original = \
-                util.get_mutations(\
-                    list_file = list_file,
-                    res_list_file = res_list_file,
+            n_mutations, invalid = \
+                residueindex.validate_mutations(\
+                    mutations = \
+                        (m for _, m in mutations(res_numbering = "pdb",
+                                                 verbose = True)),
                     pdb_file = curr_pdb_file,
-                    res_numbering = mut_options["resnumbering"],
-                    extra = mut_options["extra"],
-                    n_struct = mut_options["nstruct"])
+                    chain_keys = \
+                        [k for k in (mut_options["extra"] or []) \
+                         if k in CHAIN_EXTRA_KEYS])
         
         # If something went wrong, report it and exit
         except Exception as e:
@@ -320,6 +503,40 @@ def main():
             errstr = f"Could not generate the list of mutations: {e}"
             log.error(errstr)
             sys.exit(errstr)
+
+        # If some mutations do not match the structure
+        if invalid:
+
+            # Get all the problems found
+            problems = \
+                "\n".join(f"{name}: {'; '.join(probs)}" \
+                          for name, probs in invalid.items())
+
+            # If the invalid mutations should not be performed
+            if skip_invalid:
+
+                # Warn the user
+                warnstr = \
+                    f"{len(invalid)} mutation(s) do not match the " \
+                    f"structure in {pdb_file} and will not be " \
+                    f"performed:\n{problems}"
+                log.warning(warnstr)
+
+                # Exclude them from the mutations generated
+                mutations = \
+                    functools.partial(mutations,
+                                      exclude = frozenset(invalid))
+                n_mutations -= len(invalid)
+
+            # Otherwise, report them and exit
+            else:
+
+                errstr = \
+                    f"{len(invalid)} mutation(s) do not match the " \
+                    f"structure in {pdb_file} (use --skip-invalid " \
+                    f"to skip them):\n{problems}"
+                log.error(errstr)
+                sys.exit(errstr)
     
     # If no list of mutations was passed
     else:
@@ -331,7 +548,81 @@ def main():
         log.info(logstr)
         
         # No mutations will be performed
-        mutations, mutations_original = [], [] 
+        mutations = functools.partial(iter, ())
+        n_mutations = 0
+
+
+
+    ############################### RESUME ############################
+
+
+
+    # Set the path to the manifest keeping track of the completed
+    # runs
+    manifest_file = os.path.join(run_dir, RUN_MANIFEST_FILE)
+
+    # If the run is being resumed, load the runs already completed
+    manifest = util.read_run_manifest(manifest_file) if resume else {}
+
+
+
+
+    ############################### PLAN ##############################
+
+
+
+    # If only the plan of the run was requested
+    if plan_file is not None:
+
+        # Get the plan
+        plan = \
+            planning.get_plan(\
+                steps = steps,
+                family = family,
+                settings = settings,
+                run_dir = run_dir,
+                pdb_file = curr_pdb_file,
+                mutations = mutations,
+                mutinfo_file = \
+                    options["mutations"]["mutinfofile"] \
+                    if "mutations" in options else None,
+                n_proc = n_proc,
+                pipeline = pipeline,
+                resume = resume,
+                manifest = manifest,
+                past_timings_dirs = past_timings_dirs)
+
+        # If no file was given, write it to the standard output
+        if plan_file == "-":
+            json.dump(plan, sys.stdout, indent = 2)
+            sys.stdout.write("\n")
+
+        # Otherwise, write it to the file
+        else:
+            with open(plan_file, "w") as out:
+                json.dump(plan, out, indent = 2)
+
+            # Inform the user
+            log.info(f"The plan of the run was written to {plan_file}.")
+
+        # Do not run the protocol
+        return
+
+
+
+    ############################# TELEMETRY ###########################
+
+
+
+    # Make sure that the running directory exists. If not, create it.
+    os.makedirs(run_dir, exist_ok = True)
+
+    # Set the path to the file where the events of the tasks
+    # (submission, start, end, resource usage) are recorded
+    events_file = os.path.join(run_dir, TELEMETRY_FILE)
+
+    # Get the time the run started at
+    run_start = time.time()
 
 
 
@@ -342,17 +633,34 @@ def main():
     # Create an empty list to keep track of the running futures
     futures = []
 
+    # Create an empty list to keep track of the ΔΔG runs that
+    # can be duplicated if they take far longer than expected
+    spec_runs = []
+
+    # Create an empty list to keep track of the ΔΔG runs already
+    # completed when the runs are submitted in chunks
+    spec_done = []
+
+    # Create an empty list to keep track of the futures the
+    # next step depends on (used only when pipelining)
+    prev_futures = []
+
     # For each step of the protocol that has to be run
     for step_name, step in steps.items():
 
         # If there are still pending futures from the previous step
-        if futures:
+        # and the steps are not pipelined
+        if futures and not pipeline:
             
             # Gather them
             client.gather(futures)
             
             # Clear the list of pending futures
-            futures = []            
+            futures = []
+
+        # Create an empty list to store the futures of the
+        # current step
+        step_futures = []
         
         # Try to Get the step options
         step_opts = step["options"]
@@ -371,26 +679,38 @@ def main():
             role = step_features["role"]
 
             # Get the step working directory
-            step_wd = step["wd"]
-
-            # If the specified directory was "."
-            if step_wd == ".":
-                
-                # Run in the current directory without generating
-                # a sub-directory for the current step
-                step_wd = run_dir
-            
-            else:
-                
-                # Set a new directory
-                step_wd = os.path.join(run_dir, step_wd)
+            step_wd = util.get_step_wd(step = step,
+                                       run_dir = run_dir)
 
 
             # If it is a processing step
             if role == "processing":
 
+                # If it is a relax step already completed in the
+                # run being resumed
+                if step_name in ("relax", "relax2020") and resume \
+                and util.check_relax_output(step_wd = step_wd,
+                                            step_opts = step_opts,
+                                            pdb_file = curr_pdb_file):
+
+                    # Inform the user that the step will be skipped
+                    logstr = \
+                        f"The '{step_name}' step was already " \
+                        f"completed in {step_wd} and will not be " \
+                        f"run again."
+                    log.info(logstr)
+
                 # If it is a relax step
-                if step_name in ("relax", "relax2020"):
+                elif step_name in ("relax", "relax2020"):
+
+                    # Get the resources reserved by the step (all the
+                    # MPI ranks, if run with MPI)
+                    relax_resources = \
+                        backends.get_task_resources(\
+                            settings = settings,
+                            n_cores = \
+                                n_proc if settings["mpi"]["usempi"] \
+                                else 1)
                 
                     # Run the step
                     process = \
@@ -403,11 +723,20 @@ def main():
                                       step_opts = step_opts,
                                       curr_pdb_file = curr_pdb_file,
                                       settings = settings,
-                                      n_proc = n_proc)
+                                      n_proc = n_proc,
+                                      events_file = events_file,
+                                      resources = relax_resources)
+
+                    # Record the submission of the step
+                    telemetry.write_event(events_file, "submitted",
+                                          task = process.key,
+                                          step = step_name,
+                                          wd = step_wd)
 
                     # Append the process to the list of futures so that
                     # it gets gathered before the next step
                     futures.append(process)
+                    step_futures.append(process)
 
                     # Submit also the post-run cleaning (we can fire and
                     # forget about this one since no other task depends
@@ -427,73 +756,407 @@ def main():
                 # Write out the file mapping the directory
                 # names to the mutations
                 util.write_mutinfo_file(\
-                    mutations_original = mutations_original,
+                    mutations_original = \
+                        (mut_orig for _, mut_orig in mutations()),
                     out_dir = step_wd,
                     mutinfo_file = mut_options["mutinfofile"])
 
-                # Log the order in which the mutations will be
-                # performed
-                _mut_list = \
-                    [m[MUT_DIR_NAME] for m in mutations_original]
+                # Log the first mutations that will be performed
+                # (listing all of them would flood the log for very
+                # large scans)
                 mut_list = \
-                    [m for m in list(dict.fromkeys(_mut_list))]
-                logstr = f"The following mutations will be " \
-                         f"performed:\n{', '.join(mut_list)}."
+                    [name for name, _ in itertools.islice(\
+                        itertools.groupby(\
+                            m[MUT_DIR_NAME] for _, m in mutations()),
+                        MAX_LOGGED_MUTATIONS)]
+                logstr = \
+                    f"The following {n_mutations} mutation(s) will " \
+                    f"be performed:\n" \
+                    f"{', '.join(mut_list)}" \
+                    f"{', ...' if n_mutations > len(mut_list) else ''}."
                 log.info(logstr)
 
-                # For each mutation
-                for mut, mut_orig in zip(mutations, mutations_original):
-
-                    # Set the path to the mutation directory
-                    mut_wd = \
-                        os.path.join(step_wd, mut_orig[MUT_DIR_PATH])              
+                # Get the runs to be performed (mutation, working
+                # directory, options to be used, whether the run
+                # can be batched with others and mutation in the
+                # PDB numbering), generated lazily
+                runs = \
+                    util.get_ddg_runs(\
+                        step_name = step_name,
+                        step = step,
+                        step_wd = step_wd,
+                        step_opts = step_opts,
+                        mutations = mutations())
+
+                # Get the options for the adaptive sampling of the
+                # number of structures (flexddg steps only)
+                adaptive_opts = step.get("adaptive")
+                use_adaptive = \
+                    adaptive_opts is not None \
+                    and adaptive_opts["enabled"]
+
+                # If the sampling is adaptive, all runs of each
+                # mutation are needed to plan the waves, so the runs
+                # are kept in memory
+                if use_adaptive:
+                    runs = list(runs)
+
+                # Keep track of the runs already completed
+                counts = {"completed" : 0}
+
+                # Get the runs that still have to be performed,
+                # generated lazily
+                pending_runs = \
+                    util.iter_pending_runs(\
+                        runs = runs,
+                        step_name = step_name,
+                        manifest = manifest,
+                        resume = resume,
+                        counts = counts)
+
+                # If the sampling is adaptive
+                if use_adaptive:
+
+                    # Group all runs and the runs still to be
+                    # performed by mutation
+                    mut_runs = adaptive.group_runs(runs)
+                    mut_pending = adaptive.group_runs(pending_runs)
+
+                    # Create a dictionary to store the futures of
+                    # the current wave of runs of each mutation
+                    # (all waves are initially empty, and
+                    # therefore complete)
+                    wave_futures = {name : [] for name in mut_runs}
+
+                    # The runs will be performed in waves
+                    pending_runs = []
+
+                    # There are no chunks of runs to be submitted
+                    run_chunks = iter(())
+
+                # Otherwise
+                else:
+
+                    # Split the pending runs into chunks, so that only
+                    # a chunk of runs at a time is generated and kept
+                    # in memory
+                    run_chunks = \
+                        util.get_run_chunks(\
+                            runs = pending_runs,
+                            chunk_size = \
+                                settings["scheduling"]["chunksize"])
+
+                    # Get the first chunk of runs
+                    pending_runs = next(run_chunks, [])
+
+                # Get the resources reserved by each run (a single
+                # core, since each run is a serial Rosetta process)
+                ddg_resources = \
+                    backends.get_task_resources(settings = settings,
+                                                n_cores = 1)
+
+                # The information about the structure used to
+                # estimate the costs of the runs is retrieved
+                # only when needed
+                struct_info = None
+
+                # While there are runs to be performed or (if the
+                # sampling is adaptive) waves to be evaluated
+                while pending_runs or (use_adaptive and wave_futures):
+
+                    # If the sampling is adaptive
+                    if use_adaptive:
+
+                        # Get the mutations whose current wave of
+                        # runs is complete
+                        done = \
+                            [name for name, fs in wave_futures.items() \
+                             if all(f.done() for f in fs)]
+
+                        # If no wave is complete
+                        if not done:
+
+                            # Wait for any run to complete
+                            backends.wait(\
+                                [f for fs in wave_futures.values() \
+                                 for f in fs],
+                                return_when = "FIRST_COMPLETED")
+                            continue
+
+                        # For each mutation whose wave is complete
+                        for name in done:
+
+                            # Get the next wave of runs, if any
+                            wave = \
+                                adaptive.get_next_wave(\
+                                    mut_name = name,
+                                    mut_runs = mut_runs[name],
+                                    mut_pending = \
+                                        mut_pending.get(name, []),
+                                    adaptive_opts = adaptive_opts,
+                                    step_name = step_name,
+                                    step_opts = step_opts)
+
+                            # If sampling must go on, start a new
+                            # wave, otherwise stop tracking the
+                            # mutation
+                            if wave:
+                                pending_runs.extend(wave)
+                                wave_futures[name] = []
+                            else:
+                                del wave_futures[name]
+
+                    # Group the pending runs into batches that will be
+                    # run by a single Rosetta process each
+                    batches = \
+                        util.get_run_batches(\
+                            runs = pending_runs,
+                            batch_size = step.get("batchsize", 1))
+
+                    # Create an empty dictionary to store the estimated
+                    # costs of the runs
+                    costs = {}
+
+                    # Each batch has the same priority by default
+                    priorities = [0] * len(batches)
+
+                    # If the runs estimated to take longest should be
+                    # started first
+                    if settings["scheduling"]["longestfirst"] \
+                    and pending_runs:
+
+                        # If they have not been retrieved yet
+                        if struct_info is None:
+
+                            # Get the information about the structure
+                            # needed to estimate the costs of the runs
+                            struct_info = \
+                                scheduling.get_structure_info(pdb_file)
+
+                            # Get the timings of the past runs
+                            timings, scale = \
+                                scheduling.read_past_timings(\
+                                    [run_dir] + past_timings_dirs)
+
+                            # Inform the user about the ordering
+                            logstr = \
+                                f"The runs of the '{step_name}' step " \
+                                f"will be started from the one " \
+                                f"estimated to take longest " \
+                                f"({len(timings)} past timing(s) " \
+                                f"available)."
+                            log.info(logstr)
+
+                        # Estimate the cost of each run
+                        for mut, mut_wd, run_opts, _, mut_orig \
+                        in pending_runs:
+                            costs[mut_wd] = \
+                                scheduling.estimate_run_cost(\
+                                    struct_info = struct_info,
+                                    mut_orig = mut_orig,
+                                    step_name = step_name,
+                                    step_opts = run_opts)
+
+                        # Estimate the time taken by each batch
+                        estimates = \
+                            [sum(scheduling.get_run_estimate(\
+                                    cost = costs[run[1]],
+                                    step_name = step_name,
+                                    wd = run[1],
+                                    run_dir = run_dir,
+                                    timings = timings,
+                                    scale = scale) \
+                                 for run in batch) \
+                             for batch in batches]
+
+                        # Get the priorities of the batches
+                        priorities = scheduling.get_priorities(estimates)
+
+                    # For each batch and associated priority (submitted
+                    # from the highest priority)
+                    for batch, priority in \
+                        sorted(zip(batches, priorities),
+                               key = lambda item: item[1],
+                               reverse = True):
+
+                        # Get the mutations, their working directories
+                        # and the options to be used
+                        muts, muts_wd, batch_opts, _, muts_orig = \
+                            [list(item) for item in zip(*batch)]
+                        run_opts = batch_opts[0]
+
+                        # Get the estimated cost of the whole batch
+                        batch_cost = \
+                            sum(costs.get(mut_wd, 0) for mut_wd in muts_wd)
+
+                        # If multiple mutations are run together
+                        if len(batch) > 1:
+
+                            # Set the path to the directory where the
+                            # batch will be run
+                            batch_wd = \
+                                os.path.join(step_wd,
+                                             util.get_batch_dir_path(muts_wd))
+
+                            # Run the step
+                            process = \
+                                client.submit(\
+                                    util.run_cartesian_batch,
+                                    priority = priority,
+                                    resources = ddg_resources,
+                                    step_features = step_features,
+                                    exec_path = exec_path,
+                                    exec_suffix = exec_suffix,
+                                    muts = muts,
+                                    muts_wd = muts_wd,
+                                    batch_wd = batch_wd,
+                                    step = step,
+                                    step_opts = run_opts,
+                                    curr_pdb_file = curr_pdb_file,
+                                    settings = settings,
+                                    events_file = events_file)
+
+                            # Submit also the post-run cleaning of the
+                            # directory where the batch was run
+                            fire_and_forget(\
+                                client.submit(cleaning.clean_folders,
+                                              priority = priority,
+                                              step_name = step_name,
+                                              wd = batch_wd,
+                                              options = run_opts,
+                                              level = clean_level,
+                                              wait_on = [process]))
                             
-                    # If the step is cartesian ΔΔG calculation
-                    if step_name in ("cartesian", "cartesian2020"):
-                        
-                        # Run the step
-                        process = \
-                            client.submit(\
-                                util.run_cartesian,
-                                step_features = step_features,
-                                exec_path = exec_path,
-                                exec_suffix = exec_suffix,
-                                mut = mut,
-                                mut_wd = mut_wd,
-                                step = step,
-                                step_opts = step_opts,
-                                curr_pdb_file = curr_pdb_file,
-                                settings = settings)
-
-                    # If the step is Flex ddG ΔΔG calculation
-                    elif step_name == "flexddg":
-
-                        # Run the step
-                        process = \
-                            client.submit(\
-                                util.run_flexddg,
-                                step_features = step_features,
-                                exec_path = exec_path,
-                                exec_suffix = exec_suffix,
-                                mut = mut,
-                                mut_wd = mut_wd,
-                                step = step,
-                                step_opts = step_opts,
-                                curr_pdb_file = curr_pdb_file,
-                                settings = settings)                   
-
-                    # Append the process to the list of futures so that
-                    # it gets gathered before the next step
-                    futures.append(process)
-
-                    # Submit also the post-run cleaning
-                    fire_and_forget(\
-                        client.submit(cleaning.clean_folders,
-                                      step_name = step_name,
-                                      wd = mut_wd,
-                                      options = step_opts,
-                                      level = clean_level,
-                                      wait_on = [process]))
+                        # If a single mutation is run
+                        else:
+
+                            # Get the function performing the run
+                            run_func = \
+                                util.run_cartesian \
+                                if step_name in ("cartesian",
+                                                 "cartesian2020") \
+                                else util.run_flexddg
+
+                            # Set the arguments of the run
+                            run_kwargs = \
+                                {"step_features" : step_features,
+                                 "exec_path" : exec_path,
+                                 "exec_suffix" : exec_suffix,
+                                 "mut" : muts[0],
+                                 "mut_wd" : muts_wd[0],
+                                 "step" : step,
+                                 "step_opts" : run_opts,
+                                 "curr_pdb_file" : curr_pdb_file,
+                                 "settings" : settings,
+                                 "events_file" : events_file}
+
+                            # Run the step
+                            process = \
+                                client.submit(run_func,
+                                              priority = priority,
+                                              resources = ddg_resources,
+                                              **run_kwargs)
+
+                            # If runs taking far longer than expected
+                            # should be duplicated
+                            if settings["speculative"]["enabled"]:
+
+                                # Keep track of the run, so that it can
+                                # be duplicated if needed
+                                spec_runs.append(\
+                                    {"future" : process,
+                                     "func" : run_func,
+                                     "kwargs" : run_kwargs,
+                                     "wd" : muts_wd[0],
+                                     "step_wd" : step_wd,
+                                     "step" : step_name,
+                                     "cost" : costs.get(muts_wd[0], 1.0)})
+
+                        # Append the process to the list of futures so that
+                        # it gets gathered before the next step
+                        futures.append(process)
+                        step_futures.append(process)
+
+                        # Record the submission of the run(s)
+                        telemetry.write_event(events_file, "submitted",
+                                              task = process.key,
+                                              step = step_name,
+                                              wd = muts_wd)
+
+                        # If the sampling is adaptive, add the process
+                        # to the current wave of its mutation
+                        if use_adaptive:
+                            wave_futures[\
+                                muts_orig[0][MUT_DIR_NAME]].append(process)
+
+                        # For each mutation's working directory
+                        for mut_wd in muts_wd:
+
+                            # Record the run in the manifest once completed
+                            process.add_done_callback(\
+                                functools.partial(\
+                                    util.record_completed_run,
+                                    manifest_file = manifest_file,
+                                    step_name = step_name,
+                                    step_opts = run_opts,
+                                    wd = mut_wd,
+                                    cost = costs.get(mut_wd),
+                                    share = \
+                                        costs[mut_wd] / batch_cost \
+                                        if batch_cost else \
+                                        1 / len(muts_wd)))
+
+                            # Submit also the post-run cleaning (with
+                            # the same priority as the run, so that it
+                            # is not delayed until all runs are done)
+                            fire_and_forget(\
+                                client.submit(cleaning.clean_folders,
+                                              priority = priority,
+                                              step_name = step_name,
+                                              wd = mut_wd,
+                                              options = run_opts,
+                                              level = clean_level,
+                                              wait_on = [process]))
+
+                    # If runs are submitted in chunks, wait until no
+                    # more runs than the chunk size are in flight
+                    # before submitting the next chunk
+                    if settings["scheduling"]["chunksize"] \
+                    and not use_adaptive:
+                        futures = \
+                            backends.wait_in_flight(\
+                                futures = futures,
+                                max_in_flight = \
+                                    settings["scheduling"]["chunksize"])
+
+                        # Only the pending futures of the step are
+                        # needed by the following steps
+                        step_futures = \
+                            [f for f in step_futures if not f.done()]
+
+                        # Only the step, working directory and cost
+                        # of the completed runs are needed to spot
+                        # the slow ones among those still pending
+                        spec_done.extend(\
+                            [{k : run[k] for k in ("wd", "step", "cost")}
+                             for run in spec_runs if run["future"].done()])
+                        spec_runs = \
+                            [run for run in spec_runs \
+                             if not run["future"].done()]
+
+                    # All pending runs have been submitted, so get the
+                    # next chunk of runs, if any
+                    pending_runs = next(run_chunks, [])
+
+                # If the run is being resumed
+                if resume:
+
+                    # Inform the user about the runs skipped
+                    logstr = \
+                        f"{counts['completed']} run(s) of the " \
+                        f"'{step_name}' step were already completed " \
+                        f"and will not be run again."
+                    log.info(logstr)
 
 
         # If the step is run by Python
@@ -502,14 +1165,37 @@ def main():
             # If the step is structure selection
             if step_name == "structure_selection":
 
-                # Run the step and return the path to the PDB
-                # file to be used in the next step
-                curr_pdb_file = \
-                    util.run_structure_selection(step_opts = step_opts,
-                                                 curr_pdb_file = curr_pdb_file,
-                                                 prev_opts = prev_opts,
-                                                 prev_wd = prev_wd,
-                                                 run_dir = run_dir)
+                # If the steps are pipelined
+                if pipeline:
+
+                    # Submit the step so that it runs as soon as the
+                    # previous step is over. The future returned will
+                    # be resolved to the path to the PDB file by the
+                    # tasks of the next step depending on it.
+                    curr_pdb_file = \
+                        client.submit(util.run_structure_selection,
+                                      step_opts = step_opts,
+                                      curr_pdb_file = curr_pdb_file,
+                                      prev_opts = prev_opts,
+                                      prev_wd = prev_wd,
+                                      run_dir = run_dir,
+                                      wait_on = prev_futures)
+
+                    # The next step depends on the selection
+                    step_futures.append(curr_pdb_file)
+
+                # Otherwise
+                else:
+
+                    # Run the step and return the path to the PDB
+                    # file to be used in the next step
+                    curr_pdb_file = \
+                        util.run_structure_selection(\
+                            step_opts = step_opts,
+                            curr_pdb_file = curr_pdb_file,
+                            prev_opts = prev_opts,
+                            prev_wd = prev_wd,
+                            run_dir = run_dir)
 
 
         # Store the previous step options
@@ -518,10 +1204,53 @@ def main():
         # Store the previous step working directory
         prev_wd = step_wd
 
+        # Store the futures the next step depends on
+        prev_futures = step_futures
+
+
+    # If the runs taking far longer than expected should be
+    # duplicated
+    if settings["speculative"]["enabled"]:
+
+        # Watch the ΔΔG runs until they are complete
+        speculation.watch_runs(\
+            client = client,
+            runs = spec_runs,
+            done_runs = spec_done,
+            events_file = events_file,
+            since = run_start,
+            spec_opts = settings["speculative"],
+            resources = \
+                backends.get_task_resources(settings = settings,
+                                            n_cores = 1))
 
     # Gather the futures pending after running all steps
     client.gather(futures)
 
+    # Inform the user about the timings and resource usage of
+    # the tasks run
+    logstr = \
+        f"Summary of the run (events recorded in " \
+        f"{events_file}):\n" \
+        f"{telemetry.summarize_events(events_file, run_start)}"
+    log.info(logstr)
+
+    # Get the path to the report of the failed runs
+    report_file = os.path.join(run_dir, FAILURE_REPORT_FILE)
+
+    # Write the report
+    n_failed = \
+        failures.write_failure_report(events_file = events_file,
+                                      since = run_start,
+                                      report_file = report_file)
+
+    # If some runs failed, warn the user
+    if n_failed:
+        warnstr = \
+            f"{n_failed} Rosetta run(s) failed permanently. " \
+            f"See {report_file} for details."
+        log.warning(warnstr)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    scheduling.py
+#
+#    Utility functions to estimate the cost of the runs of the
+#    ΔΔG steps, so that the longest ones can be started first.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import os.path
+import statistics
+# Third-party packages
+import Bio.PDB as PDB
+# RosettaDDGPrediction
+from .defaults import (
+    CHAIN,
+    COST_NEIGHBORHOOD_CUTOFF,
+    MUT,
+    MUTR,
+    NUMR,
+    RELAX_ROUNDS,
+    RUN_MANIFEST_FILE,
+    SIDE_CHAIN_HEAVY_ATOMS
+)
+from . import util
+
+
+
+def get_structure_info(pdb_file):
+    """Get the information about a structure needed to estimate
+    the cost of the runs (number of residues, residues by chain
+    and number, and a neighbor search over all atoms).
+    """
+
+    # Get the structure from the PDB file
+    structure = \
+        PDB.PDBParser(QUIET = True).get_structure("structure",
+                                                  pdb_file)
+
+    # Get the first model (the one Rosetta uses)
+    model = structure[0]
+
+    # Map the chain and residue number (as a string, as in the
+    # mutations) to the residues
+    residues = \
+        {(res.get_parent().id, str(res.id[1])) : res \
+         for res in model.get_residues()}
+
+    # Return the information
+    return {"n_res" : len(residues),
+            "residues" : residues,
+            "search" : PDB.NeighborSearch(list(model.get_atoms()))}
+
+
+def _get_neighborhood_size(struct_info,
+                           chain,
+                           numr):
+    """Get the number of residues within the cost neighborhood
+    cutoff from a residue.
+    """
+
+    # Get the residue
+    res = struct_info["residues"].get((chain, numr))
+
+    # If the residue is not in the structure, assume it has
+    # no neighbors
+    if res is None:
+        return 0
+
+    # Create an empty set to store the neighboring residues
+    neighbors = set()
+
+    # For each atom of the residue
+    for atom in res:
+
+        # Add the residues the neighboring atoms belong to
+        neighbors.update(\
+            a.get_parent() for a in \
+                struct_info["search"].search(atom.coord,
+                                             COST_NEIGHBORHOOD_CUTOFF))
+
+    # Return the number of neighbors (excluding the residue itself)
+    return len(neighbors - {res})
+
+
+def estimate_run_cost(struct_info,
+                      mut_orig,
+                      step_name,
+                      step_opts):
+    """Estimate the (relative) cost of the run of a ΔΔG step
+    for a mutation (in PDB numbering) from the size of the
+    structure, the size of the neighborhood of the mutated
+    residues, the mutant residue types and the amount of
+    sampling performed.
+    """
+
+    # The repacking/minimization work grows with the size
+    # of the neighborhood and the bulk of the mutant residue
+    work = \
+        sum((1 + _get_neighborhood_size(struct_info,
+                                        smut[CHAIN],
+                                        smut[NUMR])) \
+            * (1 + SIDE_CHAIN_HEAVY_ATOMS.get(smut[MUTR], 0) / 10) \
+            for smut in mut_orig[MUT])
+
+    # If the step is cartesian ΔΔG calculation
+    if step_name in ("cartesian", "cartesian2020"):
+
+        # Get the number of iterations (Rosetta's default is 3)
+        iter_key = util.get_option_key(step_opts, "iterations")
+        n_iter = int(step_opts[iter_key]) if iter_key else 3
+
+        # Get whether both the wild-type and the mutant are
+        # modelled
+        n_states = \
+            1 if util.is_option_true(step_opts, "wt_only") \
+            or util.is_option_true(step_opts, "mut_only") else 2
+
+        # Set the amount of sampling
+        sampling = n_iter * n_states
+
+    # If the step is Flex ddG ΔΔG calculation
+    elif step_name == "flexddg":
+
+        # Get the RosettaScript options
+        r_script_options = \
+            step_opts[util.get_option_key(step_opts, "script_vars")]
+
+        # Get the number of backrub trials (the RosettaScript's
+        # default is 35000)
+        trials_key = \
+            util.get_option_key(r_script_options, "backrub_n_trials")
+        n_trials = \
+            int(r_script_options[trials_key]) if trials_key \
+            else 35000
+
+        # Set the amount of sampling
+        sampling = n_trials / 1000
+
+    # Otherwise, assume a unitary amount of sampling
+    else:
+        sampling = 1
+
+    # The start-up cost (loading and scoring the structure)
+    # grows with the size of the structure
+    return struct_info["n_res"] / 100 + sampling * work
+
+
+def estimate_relax_cost(struct_info,
+                        step_opts):
+    """Estimate the (relative, in the same units as the costs
+    of the ΔΔG runs) cost of a relax step from the size of the
+    structure and the number of structures generated.
+    """
+
+    # Get the number of structures generated (Rosetta's default
+    # is 1)
+    nstruct_key = util.get_option_key(step_opts, "nstruct")
+    n_struct = int(step_opts[nstruct_key]) if nstruct_key else 1
+
+    # All residues are repacked and minimized in each round, on
+    # top of the start-up cost
+    return struct_info["n_res"] / 100 \
+           + n_struct * RELAX_ROUNDS * struct_info["n_res"]
+
+
+def read_past_timings(run_dirs):
+    """Read the timings of the runs recorded in the manifests
+    of the given running directories. Return a dictionary
+    mapping each step and directory (relative to the running
+    directory) to the time taken by the run, and the scale
+    factor converting the estimated costs into seconds (None
+    if no timing is available).
+    """
+
+    # Create an empty dictionary to store the timings
+    timings = {}
+
+    # Create an empty list to store the ratios between the times
+    # taken by the runs and their estimated costs
+    ratios = []
+
+    # For each running directory
+    for run_dir in run_dirs:
+
+        # Get the manifest
+        manifest = \
+            util.read_run_manifest(\
+                os.path.join(run_dir, RUN_MANIFEST_FILE))
+
+        # For each entry
+        for entry in manifest.values():
+
+            # Get the time taken by the run and its estimated cost
+            # (not available for runs restored from the cache and
+            # runs recorded by older versions)
+            elapsed = entry.get("elapsed")
+            cost = entry.get("cost")
+
+            # If the timing is not available, skip the entry
+            if not elapsed or not cost:
+                continue
+
+            # Store the timing
+            timings[(entry["step"], entry["dir"])] = elapsed
+            ratios.append(elapsed / cost)
+
+    # Get the scale factor (the median is robust to runs slowed
+    # down by overloaded nodes)
+    scale = statistics.median(ratios) if ratios else None
+
+    # Return the timings and the scale factor
+    return timings, scale
+
+
+def get_run_estimate(cost,
+                     step_name,
+                     wd,
+                     run_dir,
+                     timings,
+                     scale):
+    """Get the estimated time taken by a run, using the time
+    taken by the same run in the past, if available, and
+    its estimated cost otherwise.
+    """
+
+    # Try to get the time taken by the same run in the past
+    elapsed = \
+        timings.get((step_name, os.path.relpath(wd, run_dir)))
+
+    # If it is available, use it
+    if elapsed is not None:
+        return elapsed
+
+    # Otherwise, use the estimated cost (converted into seconds,
+    # if possible, so that it is comparable to past timings)
+    return cost * scale if scale is not None else cost
+
+
+def get_priorities(estimates):
+    """Given the estimated times taken by a list of units of
+    work, get the Dask priorities to submit them longest-first
+    (higher priorities are run first).
+    """
+
+    # Sort the units by decreasing estimated time (ties keep
+    # the original order)
+    order = \
+        sorted(range(len(estimates)),
+               key = lambda i: estimates[i],
+               reverse = True)
+
+    # Create a list to store the priorities
+    priorities = [0] * len(estimates)
+
+    # Assign decreasing priorities to the units
+    for rank, i in enumerate(order):
+        priorities[i] = len(estimates) - rank
+
+    # Return the priorities
+    return priorities
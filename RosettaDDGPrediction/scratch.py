@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    scratch.py
+#
+#    Utility functions to run Rosetta in a node-local scratch
+#    directory and copy the outputs back to the shared file
+#    system once complete.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import fnmatch
+import os
+import os.path
+import shutil
+import tempfile
+
+
+
+def get_scratch_options(settings,
+                        step_name):
+    """Get the options to run the Rosetta processes of a step
+    in a scratch directory, or None if they should be run in
+    their working directory.
+    """
+
+    # Get the scratch options
+    scratch_opts = settings["scratch"]
+
+    # If running in a scratch directory was not requested,
+    # return None
+    if not scratch_opts["enabled"]:
+        return None
+
+    # Return the scratch directory and the outputs to be copied
+    # back for the step (all of them by default)
+    return {"scratchdir" : scratch_opts["scratchdir"],
+            "outputs" : scratch_opts["outputs"].get(step_name, ["*"])}
+
+
+def _get_state(path):
+    """Get the modification time and size of the files in a
+    directory (not recursively).
+    """
+
+    return {entry.name : (entry.stat().st_mtime_ns,
+                          entry.stat().st_size) \
+            for entry in os.scandir(path) if entry.is_file()}
+
+
+def stage_in(wd,
+             scratch_dir):
+    """Create a scratch directory (in 'scratch_dir' or, if it is
+    None, in the system's temporary directory, i.e. $TMPDIR) with
+    a copy of the files in a working directory (i.e. the flags
+    file and the other inputs). Return the path to the scratch
+    directory and the state of its files.
+    """
+
+    # Get the directory where to create the scratch directory
+    # (environment variables are expanded on the node where the
+    # process runs, i.e. $TMPDIR or $SLURM_TMPDIR)
+    scratch_dir = \
+        os.path.expandvars(scratch_dir) if scratch_dir is not None \
+        else tempfile.gettempdir()
+
+    # Make sure that the directory exists. If not, create it.
+    os.makedirs(scratch_dir, exist_ok = True)
+
+    # Create the scratch directory
+    run_wd = \
+        tempfile.mkdtemp(\
+            prefix = f"rosettaddg-{os.path.basename(wd)}-",
+            dir = scratch_dir)
+
+    # Copy the contents of the working directory into it
+    shutil.copytree(wd, run_wd, dirs_exist_ok = True)
+
+    # Return the scratch directory and the state of its files
+    return run_wd, _get_state(run_wd)
+
+
+def stage_out(run_wd,
+              wd,
+              outputs,
+              in_state,
+              always = ()):
+    """Move the outputs of a process run in a scratch directory
+    back into its working directory. Only the files (or
+    directories) matching the patterns in 'outputs', or listed
+    in 'always', that were created or modified by the process
+    are moved. They are first copied into a staging directory
+    inside the working directory, and then renamed into place,
+    so that no partially copied file is ever visible there.
+    """
+
+    # Get the state of the files in the scratch directory
+    out_state = _get_state(run_wd)
+
+    # Get the names of the outputs to move back
+    names = \
+        sorted(entry.name for entry in os.scandir(run_wd) \
+               if (any(fnmatch.fnmatch(entry.name, pattern) \
+                       for pattern in outputs) \
+                   or entry.name in always) \
+               and (entry.is_dir() \
+                    or in_state.get(entry.name) != \
+                       out_state.get(entry.name)))
+
+    # Create the staging directory
+    staging = tempfile.mkdtemp(prefix = ".staging-", dir = wd)
+
+    try:
+
+        # Copy the outputs into the staging directory (this is
+        # the slow part, which happens out of sight)
+        for name in names:
+            src = os.path.join(run_wd, name)
+            dst = os.path.join(staging, name)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst)
+            else:
+                shutil.copy2(src, dst)
+
+        # Rename them into place (atomic, since the staging
+        # directory is in the same file system)
+        for name in names:
+            dst = os.path.join(wd, name)
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+            os.replace(os.path.join(staging, name), dst)
+
+    finally:
+
+        # Remove the staging directory
+        shutil.rmtree(staging, ignore_errors = True)
+
+
+def remove_scratch(run_wd):
+    """Remove a scratch directory.
+    """
+
+    shutil.rmtree(run_wd, ignore_errors = True)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    speculation.py
+#
+#    Utility functions to keep track of the Rosetta processes
+#    running on the workers, stop them and run again the ΔΔG runs
+#    taking far longer than expected (speculative re-execution).
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import logging as log
+import os
+import os.path
+import shutil
+import signal
+import threading
+import time
+# RosettaDDGPrediction
+from . import backends
+from .defaults import SPECULATIVE_DIR_NAME
+from . import telemetry
+
+
+
+#------------------------ Worker-side registry -----------------------#
+
+
+
+# Lock protecting the registry of the running processes
+_LOCK = threading.Lock()
+
+# Running Rosetta processes (working directory -> PID, which is
+# also the ID of the process group since each process is run in a
+# session of its own)
+_PROCESSES = {}
+
+# Processes that were stopped on request (working directory ->
+# (action, directory holding the results replacing theirs))
+_STOPPED = {}
+
+
+def kill_process_group(pid):
+    """Kill a process and all the processes in its group (i.e.
+    the MPI ranks it spawned).
+    """
+
+    # Try to kill the process group
+    try:
+        os.killpg(pid, signal.SIGKILL)
+
+    # Ignore process groups already gone
+    except ProcessLookupError:
+        pass
+
+
+def register_process(wd,
+                     pid):
+    """Register a Rosetta process running in a directory.
+    """
+
+    with _LOCK:
+        _PROCESSES[wd] = pid
+
+
+def release_process(wd):
+    """Remove a Rosetta process that has exited from the registry.
+    Return how it was stopped on request, if it was, as a tuple
+    (action, directory holding the results replacing its own),
+    otherwise None.
+    """
+
+    with _LOCK:
+        _PROCESSES.pop(wd, None)
+        return _STOPPED.pop(wd, None)
+
+
+def stop_process(wd,
+                 action,
+                 spec_wd = None):
+    """Stop the Rosetta process running in a directory on the
+    current worker (this function is meant to be run on all
+    workers with 'Client.run'). 'action' is either 'supersede'
+    (the results of the process will be replaced by those found
+    in 'spec_wd') or 'cancel' (the results will be discarded).
+    Return whether a process was stopped.
+    """
+
+    with _LOCK:
+
+        # If no process is running in the directory on the
+        # current worker, there is nothing to stop
+        if wd not in _PROCESSES:
+            return False
+
+        # Record why the process is being stopped
+        _STOPPED[wd] = (action, spec_wd)
+
+        # Kill the process (while holding the lock, so that the
+        # PID cannot be reused in the meantime)
+        kill_process_group(_PROCESSES[wd])
+
+    # A process was stopped
+    return True
+
+
+def replace_dir(wd,
+                spec_wd):
+    """Replace the contents of a directory with those of the
+    directory where a duplicate of the same run was performed.
+    """
+
+    # Remove the partial results
+    shutil.rmtree(wd, ignore_errors = True)
+
+    # Move the complete ones in place (the two directories are
+    # in the same file system, so this is atomic)
+    os.rename(spec_wd, wd)
+
+
+
+#------------------------ Client-side monitor ------------------------#
+
+
+
+def get_spec_dir_path(wd,
+                      step_wd):
+    """Get the path to the directory where the duplicate of a
+    run is performed.
+    """
+
+    # Flatten the path of the run directory relative to the step
+    # directory into a single directory name
+    name = os.path.relpath(wd, step_wd).replace(os.sep, "__")
+
+    # Return the path to the directory
+    return os.path.join(step_wd, SPECULATIVE_DIR_NAME, name)
+
+
+def _get_run_timings(events_file,
+                     since):
+    """Get when the Rosetta processes currently running (by
+    working directory) started, and how long the completed
+    ones took.
+    """
+
+    # Read the events
+    df = telemetry.read_events(events_file = events_file,
+                               since = since)
+
+    # If there are no events about processes, there are no timings
+    if df.empty or "wd" not in df.columns:
+        return {}, {}
+
+    # Keep only the events about the start and end of processes,
+    # ignoring those of the duplicates
+    df = df[df["event"].isin(("started", "finished")) \
+            & ~df["wd"].str.contains(\
+                f"{os.sep}{SPECULATIVE_DIR_NAME}{os.sep}",
+                regex = False)]
+
+    # Get the last event for each directory
+    last = df.sort_values("time").groupby("wd").last()
+
+    # Get the start time of the processes still running
+    started = \
+        last.loc[last["event"] == "started", "time"].to_dict()
+
+    # Get the wall time of the processes completed successfully
+    finished = last[(last["event"] == "finished") \
+                    & (last["returncode"] == 0)]
+    walls = finished["wall"].to_dict()
+
+    # Return the timings
+    return started, walls
+
+
+def _get_stragglers(runs,
+                    started,
+                    walls,
+                    spec_opts,
+                    now,
+                    done_runs = ()):
+    """Get the runs taking far longer than expected given the
+    time taken by the completed runs of the same step (scaled
+    by the runs' estimated costs). 'done_runs' are runs already
+    completed and no longer tracked in 'runs' (only their
+    working directory, step and cost are needed).
+    """
+
+    # Get the time per unit of cost taken by the completed runs
+    # of each step
+    rates = {}
+    for run in list(runs) + list(done_runs):
+        if run["wd"] in walls:
+            rates.setdefault(run["step"], []).append(\
+                walls[run["wd"]] / run["cost"])
+
+    # Create an empty list to store the stragglers
+    stragglers = []
+
+    # For each run
+    for run in runs:
+
+        # Get the time taken by the completed runs of the same step
+        step_rates = sorted(rates.get(run["step"], []))
+
+        # Skip runs not running, or whose expected time cannot be
+        # estimated yet
+        if run["wd"] not in started \
+        or len(step_rates) < spec_opts["minsamples"]:
+            continue
+
+        # Get the expected time for the run (from the median time
+        # per unit of cost)
+        expected = step_rates[len(step_rates) // 2] * run["cost"]
+
+        # Get how long the run has been running for
+        elapsed = now - started[run["wd"]]
+
+        # The run is a straggler if it is taking far longer than
+        # expected (and longer than the minimum time)
+        if elapsed > max(spec_opts["factor"] * expected,
+                         spec_opts["mintime"]):
+            stragglers.append((run, elapsed, expected))
+
+    # Return the stragglers
+    return stragglers
+
+
+def watch_runs(client,
+               runs,
+               events_file,
+               since,
+               spec_opts,
+               resources = None,
+               done_runs = ()):
+    """Watch the ΔΔG runs until they complete, launching a
+    duplicate of those taking far longer than expected and
+    keeping the results of whichever copy completes first.
+    Each run is a dictionary with the future of the task, the
+    function and keyword arguments it was submitted with (the
+    working directory being passed as 'mut_wd'), its working
+    directory ('wd'), the directory of its step ('step_wd'),
+    the name of its step and its estimated cost. 'done_runs'
+    are the runs that already completed and were dropped from
+    'runs', whose timings are still used to estimate the
+    expected time of the others.
+    """
+
+    # Create a dictionary to store the duplicates launched
+    # (working directory of the original run -> duplicate)
+    dups = {}
+
+    # Create a set to store the runs already duplicated
+    duplicated = set()
+
+    # Until all runs and duplicates are done
+    while True:
+
+        # Get the runs still pending
+        pending = [run for run in runs if not run["future"].done()]
+
+        # If no run nor duplicate is pending, stop
+        if not pending and not dups:
+            break
+
+        # Wait for a run or a duplicate to complete (or for the
+        # polling interval to elapse)
+        try:
+            backends.wait([run["future"] for run in pending] \
+                          + [dup["future"] for dup in dups.values()],
+                          timeout = spec_opts["poll"],
+                          return_when = "FIRST_COMPLETED")
+        except TimeoutError:
+            pass
+
+        # For each duplicate
+        for wd, dup in list(dups.items()):
+
+            # Get the future of the original run
+            orig_future = dup["run"]["future"]
+
+            # If the duplicate has completed
+            if dup["future"].done():
+
+                # If the duplicate completed successfully while the
+                # original run is still going
+                if not orig_future.done() \
+                and dup["future"].status == "finished" \
+                and dup["future"].result()["returncode"] == 0:
+
+                    # Try to stop the original run, whose results
+                    # will be replaced by those of the duplicate
+                    stopped = \
+                        client.run(stop_process,
+                                   wd = wd,
+                                   action = "supersede",
+                                   spec_wd = dup["spec_wd"])
+
+                    # If it was stopped, the duplicate is done with
+                    if any(stopped.values()):
+                        log.info(f"The duplicate of the run in {wd} " \
+                                 f"completed first and its results " \
+                                 f"will be used.")
+                        dups.pop(wd)
+
+                    # Otherwise, the original run is between two
+                    # processes, so try again later
+                    continue
+
+                # If the original run completed, or the duplicate
+                # failed, discard the duplicate's results
+                if orig_future.done() \
+                or dup["future"].status != "finished" \
+                or dup["future"].result()["returncode"] != 0:
+                    shutil.rmtree(dup["spec_wd"], ignore_errors = True)
+                    dups.pop(wd)
+
+            # If the original run completed while the duplicate is
+            # still going, stop the duplicate
+            elif orig_future.done() and not dup["cancelled"]:
+                client.cancel(dup["future"])
+                client.run(stop_process,
+                           wd = dup["spec_wd"],
+                           action = "cancel")
+                dup["cancelled"] = True
+
+        # Get the runs that have not been duplicated yet
+        candidates = \
+            [run for run in pending if run["wd"] not in duplicated]
+
+        # If there are no candidates, go on waiting
+        if not candidates:
+            continue
+
+        # Get the start time of the running processes and the time
+        # taken by the completed ones
+        started, walls = _get_run_timings(events_file = events_file,
+                                          since = since)
+
+        # For each run taking far longer than expected
+        for run, elapsed, expected in \
+            _get_stragglers(runs = runs,
+                            started = started,
+                            walls = walls,
+                            spec_opts = spec_opts,
+                            now = time.time(),
+                            done_runs = done_runs):
+
+            # Skip runs already duplicated or completed
+            if run["wd"] in duplicated or run["future"].done():
+                continue
+
+            # Get the directory where the duplicate will be run
+            spec_wd = get_spec_dir_path(wd = run["wd"],
+                                        step_wd = run["step_wd"])
+
+            # Remove leftovers of previous duplicates, if any
+            shutil.rmtree(spec_wd, ignore_errors = True)
+
+            # Launch the duplicate (with top priority, since the
+            # whole job is waiting for it)
+            dup_future = \
+                client.submit(run["func"],
+                              **{**run["kwargs"],
+                                 "mut_wd" : spec_wd},
+                              pure = False,
+                              priority = float("inf"),
+                              resources = resources)
+
+            # Store the duplicate
+            dups[run["wd"]] = {"future" : dup_future,
+                               "run" : run,
+                               "spec_wd" : spec_wd,
+                               "cancelled" : False}
+            duplicated.add(run["wd"])
+
+            # Record the duplicate
+            telemetry.write_event(events_file, "duplicated",
+                                  task = dup_future.key,
+                                  wd = run["wd"],
+                                  spec_wd = spec_wd,
+                                  step = run["step"],
+                                  elapsed = elapsed,
+                                  expected = expected)
+
+            # Inform the user
+            logstr = \
+                f"The run in {run['wd']} has been running for " \
+                f"{elapsed:.0f} s (expected: {expected:.0f} s). " \
+                f"A duplicate was launched in {spec_wd}."
+            log.info(logstr)
+
+    # Remove the directories that hosted the duplicates, if empty
+    for step_wd in {run["step_wd"] for run in runs}:
+        try:
+            os.rmdir(os.path.join(step_wd, SPECULATIVE_DIR_NAME))
+        except OSError:
+            pass
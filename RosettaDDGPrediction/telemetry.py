@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding:utf-8 -*-
+
+#    telemetry.py
+#
+#    Utility functions to record structured events about the
+#    tasks run (timings and resource usage) and summarize them.
+#
+#    Copyright (C) 2022 Valentina Sora
+#                       <sora.valentina1@gmail.com>
+#                       Matteo Tiberti
+#                       <matteo.tiberti@gmail.com>
+#                       Elena Papaleo
+#                       <elenap@cancer.dk>
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public
+#    License along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Standard library
+import json
+import os
+import os.path
+import resource
+import socket
+import time
+# Third-party packages
+from distributed import get_worker
+import pandas as pd
+# RosettaDDGPrediction
+from . import asyncengine
+
+
+
+def get_current_task():
+    """Get the key of the Dask task (or of the task run by the
+    asyncio engine) currently running, or None if not running
+    inside a task.
+    """
+
+    # If the task is run by the asyncio engine, get its key
+    if asyncengine.get_current_engine() is not None:
+        return asyncengine.get_current_key()
+
+    # Try to get the key of the task from the worker
+    try:
+        return str(get_worker().get_current_task())
+
+    # If not running on a worker, there is no task
+    except ValueError:
+        return None
+
+
+def write_event(events_file,
+                event,
+                **data):
+    """Append an event (and associated data) to the JSONL file
+    of the events of a run. Nothing is written if no file is
+    given.
+    """
+
+    # If no file was given, do not record the event
+    if events_file is None:
+        return
+
+    # Create the event
+    entry = {"time" : time.time(),
+             "event" : event,
+             "host" : socket.gethostname(),
+             "pid" : os.getpid(),
+             "task" : get_current_task(),
+             **data}
+
+    # Append it to the file with a single write, so that events
+    # written concurrently by different workers do not interleave
+    fd = os.open(events_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    try:
+        os.write(fd, (json.dumps(entry, default = str) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def get_dir_size(wd):
+    """Get the total size (in bytes) of the files in a
+    directory and its sub-directories.
+    """
+
+    # Set the total size to zero
+    size = 0
+
+    # For each directory and files it contains
+    for path, dirs, files in os.walk(wd):
+
+        # Add the size of each file (ignore files removed
+        # in the meantime)
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(path, f))
+            except OSError:
+                continue
+
+    # Return the total size
+    return size
+
+
+def timed_call(task_func,
+               events_file,
+               event_data = None,
+               **kwargs):
+    """Call a function, recording when it started and finished,
+    together with the wall time and CPU time it took and the
+    peak resident memory of the process running it.
+    """
+
+    # Get the data to be recorded with each event
+    event_data = event_data if event_data is not None else {}
+
+    # Record the start
+    write_event(events_file, "started",
+                function = task_func.__name__, **event_data)
+
+    # Get the wall time and CPU time (of the current thread,
+    # since workers may run several tasks in parallel)
+    wall_start = time.monotonic()
+    cpu_start = time.thread_time()
+
+    # Call the function
+    result = task_func(**kwargs)
+
+    # Record the end
+    write_event(events_file, "finished",
+                function = task_func.__name__,
+                returncode = 0,
+                wall = time.monotonic() - wall_start,
+                cpu = time.thread_time() - cpu_start,
+                maxrss = _get_self_maxrss(),
+                **event_data)
+
+    # Return the result
+    return result
+
+
+def _get_self_maxrss():
+    """Get the peak resident memory (in bytes) of the current
+    process.
+    """
+
+    # Linux reports the peak resident memory in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def read_events(events_file,
+                since = None):
+    """Read the events of a run (possibly only those recorded
+    since a given time) into a data frame.
+    """
+
+    # Create an empty list to store the events
+    events = []
+
+    # If the file exists
+    if os.path.isfile(events_file):
+
+        with open(events_file, "r") as f:
+
+            # For each line
+            for line in f:
+
+                # Try to load the event
+                try:
+                    events.append(json.loads(line))
+
+                # Ignore truncated lines
+                except json.JSONDecodeError:
+                    continue
+
+    # Create the data frame
+    df = pd.DataFrame(events)
+
+    # Keep only the events recorded since the given time, if any
+    if since is not None and not df.empty:
+        df = df[df["time"] >= since]
+
+    # Return the data frame
+    return df
+
+
+def summarize_events(events_file,
+                     since,
+                     n_slowest = 5):
+    """Summarize the events recorded in a run since a given
+    time: timings and resource usage by step, throughput (in
+    mutations per hour) and slowest tasks. Return the summary
+    as a string.
+    """
+
+    # Read the events
+    df = read_events(events_file = events_file,
+                     since = since)
+
+    # If no task finished, there is nothing to summarize
+    if df.empty or "finished" not in set(df["event"]):
+        return "No task finished."
+
+    # Get the finished tasks
+    finished = df[df["event"] == "finished"].copy()
+
+    # Return codes are integers (missing for other events)
+    finished["returncode"] = finished["returncode"].astype(int)
+
+    # Make sure all optional columns are present
+    for col in ("step", "wd", "n_muts", "cpu", "maxrss", "outbytes"):
+        if col not in finished.columns:
+            finished[col] = None
+
+    # Summarize the tasks by step
+    by_step = \
+        finished.groupby("step", dropna = False).agg(\
+            tasks = ("wall", "size"),
+            failed = ("returncode", lambda x: int((x != 0).sum())),
+            wall_mean_s = ("wall", "mean"),
+            wall_max_s = ("wall", "max"),
+            cpu_total_h = ("cpu", lambda x: x.sum() / 3600),
+            peak_rss_mb = ("maxrss", lambda x: x.max() / 2**20),
+            output_mb = ("outbytes", lambda x: x.sum() / 2**20))
+
+    # Get the elapsed time since the start of the run (in hours)
+    elapsed_h = (df["time"].max() - since) / 3600
+
+    # Get the number of mutations successfully computed
+    n_muts = \
+        finished.loc[finished["returncode"] == 0,
+                     "n_muts"].fillna(0).sum()
+
+    # Get the throughput
+    throughput = n_muts / elapsed_h if elapsed_h > 0 else float("nan")
+
+    # Get the slowest tasks
+    slowest = \
+        finished.sort_values("wall", ascending = False).head(n_slowest)
+    slowest = slowest[["step", "wd", "wall", "returncode"]]
+
+    # Assemble the summary
+    return \
+        f"Tasks by step:\n" \
+        f"{by_step.round(3).to_string()}\n\n" \
+        f"Mutations computed: {int(n_muts)} in {elapsed_h:.3f} h " \
+        f"({throughput:.1f} mutations/hour)\n\n" \
+        f"Slowest tasks:\n" \
+        f"{slowest.to_string(index = False)}"
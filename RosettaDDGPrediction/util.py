@@ -30,21 +30,39 @@
 
 # Standard library
 import copy
+import functools
+import hashlib
 import itertools
+import json
 import logging as log
+import math
 import operator
 import os
 import os.path
+import random
 import re
+import shutil
+import signal
 import subprocess
+import threading
+import time
 # Third-party packages
-import Bio.PDB as PDB
 import matplotlib.font_manager as fm
+from Bio.PDB.Polypeptide import index_to_one, three_to_index
 import pandas as pd
 import yaml
 # RosettaDDGProtocols
+from . import aggregation
+from . import asyncengine
+from . import caching
+from . import failures
+from . import residueindex
+from . import scratch
+from . import speculation
+from . import telemetry
 from .dask_patches import reset_worker_logger
 from .defaults import (
+    BATCH_DIR_NAME,
     CHAIN,
     CHAIN_SEP,
     COMP_SEP,
@@ -53,6 +71,7 @@ from .defaults import (
     CONFIG_RUN_DIR,
     CONFIG_SETTINGS_DIR,
     DIR_MUT_SEP,
+    FLEXDDG_SCRIPT_VARS_DEFAULTS,
     FLEXDDG_STATES,
     MULTI_MUT_SEP,
     MUT,
@@ -67,8 +86,12 @@ from .defaults import (
     ROSETTA_OPTIONS,
     ROSETTA_PROTOCOLS,
     ROSETTA_SCRIPTS_DIR,
+    ROSETTA_DF_COLS,
+    SATURATION_SAMPLING_METHODS,
+    SATURATION_WARNING_COMBINATIONS,
     STRUCT,
     STRUCT_EXTRACTED_PATTERN,
+    WT_REF_DIR_NAME,
     WTR
 )
 from . import pythonsteps
@@ -77,6 +100,11 @@ from . import pythonsteps
 # Get the module logger
 logger = log.getLogger(__name__)
 
+# Lock serializing the writes to the run manifest (entries
+# are appended from the callbacks of the Dask futures, which
+# may run concurrently)
+_MANIFEST_LOCK = threading.Lock()
+
 
 
 ########################### ROSETTA-RELATED ###########################
@@ -125,6 +153,152 @@ def get_rosetta_executable(exec_name,
     return os.path.join(exec_path, execs[0])
 
 
+def _run_rosetta_process(args,
+                         output,
+                         wd,
+                         events_file,
+                         event_data,
+                         timeout = None,
+                         n_cores = 1,
+                         run_wd = None):
+    """Run a single Rosetta process (using 'n_cores' cores) in
+    'run_wd' (by default, its working directory 'wd') and wait
+    for it to complete (or to run past 'timeout' seconds, after
+    which it is killed), recording when it started and finished.
+    """
+
+    # By default, run the process in its working directory
+    run_wd = run_wd or wd
+
+    # Record the start of the process
+    telemetry.write_event(events_file, "started",
+                          args = args, **event_data)
+
+    # Get the time the process is launched at
+    start = time.monotonic()
+
+    # Get how many processes were killed by the kernel for
+    # running out of memory so far
+    oom_kills = failures.get_oom_kills()
+
+    # Get the asyncio engine running the task, if any
+    engine = asyncengine.get_current_engine()
+
+    # If the task is run by the asyncio engine
+    if engine is not None:
+
+        # Let the engine run the process (registering it once
+        # launched, so that it can be stopped on request)
+        pid, returncode, is_timed_out, rusage = \
+            engine.run_process(\
+                args = args,
+                output = output,
+                wd = run_wd,
+                n_cores = n_cores,
+                timeout = timeout,
+                on_start = \
+                    functools.partial(speculation.register_process,
+                                      wd))
+
+    # Otherwise
+    else:
+
+        # Launch the process in a session (and, therefore, a
+        # process group) of its own, so that it can be killed
+        # together with all the processes it spawns (i.e. the MPI
+        # ranks)
+        with open(output, "w") as out:
+            popen = subprocess.Popen(args,
+                                     stdout = out,
+                                     stderr = subprocess.STDOUT,
+                                     cwd = run_wd,
+                                     start_new_session = True)
+        pid = popen.pid
+
+        # Register the process, so that it can be stopped on
+        # request
+        speculation.register_process(wd = wd,
+                                     pid = pid)
+
+        # Create an event signalling that the process timed out
+        timed_out = threading.Event()
+
+        # Set a timer killing the process when it runs out of time
+        # (if a time limit was set)
+        timer = None
+        if timeout is not None:
+            def kill_timed_out():
+                timed_out.set()
+                speculation.kill_process_group(pid)
+            timer = threading.Timer(timeout, kill_timed_out)
+            timer.start()
+
+        # Wait for the process to complete (getting the resources
+        # it used, including those of the processes it waited for,
+        # i.e. the MPI ranks)
+        _, status, rusage = os.wait4(pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+
+        # Let the Popen object know that the process has been
+        # reaped, so that it never waits for the same PID again
+        # (which may belong to another process by then) nor warns
+        # that the process is still running when collected
+        popen.returncode = returncode
+
+        # Stop the timer, if any
+        if timer is not None:
+            timer.cancel()
+
+        # Get whether the process timed out
+        is_timed_out = timed_out.is_set()
+
+    # Remove the process from the registry (getting whether it
+    # was stopped on request)
+    stopped = speculation.release_process(wd = wd)
+
+    # Get why the process was killed, if it was killed while
+    # running (the kernel kills processes running out of memory
+    # with SIGKILL, which is also what the time limit and the
+    # requests to stop use)
+    killed = \
+        "timeout" if is_timed_out \
+        else stopped[0] if stopped \
+        else "oom" if returncode == -signal.SIGKILL \
+                      and oom_kills is not None \
+                      and failures.get_oom_kills() > oom_kills \
+        else None
+
+    # Get the wall time taken by the process
+    elapsed = time.monotonic() - start
+
+    # Record the end of the process
+    telemetry.write_event(\
+        events_file, "finished",
+        returncode = returncode,
+        wall = elapsed,
+        cpu = rusage.ru_utime + rusage.ru_stime,
+        maxrss = rusage.ru_maxrss * 1024,
+        outbytes = \
+            telemetry.get_dir_size(run_wd) if events_file else None,
+        timedout = is_timed_out,
+        stopped = stopped[0] if stopped else None,
+        **event_data)
+    
+    # Return the attributes of interest of the process (cannot
+    # return Popen itself since it is not serializable and
+    # we are launching the process with Dask)
+    return {"args" : args,
+            "stdin" : None,
+            "stdout" : None,
+            "stderr" : None,
+            "pid" : pid,
+            "returncode" : returncode,
+            "elapsed" : elapsed,
+            "timedout" : is_timed_out,
+            "stopped" : stopped,
+            "killed" : killed}
+
+
 def run_rosetta(executable,
                 flagsfile,
                 output,
@@ -132,10 +306,31 @@ def run_rosetta(executable,
                 use_mpi,
                 mpi_exec,
                 mpi_args,
-                mpi_n_proc):
-    """Run Rosetta.
+                mpi_n_proc,
+                events_file = None,
+                event_data = None,
+                retry_opts = None,
+                timeout = None,
+                max_memory = None,
+                scratch_opts = None,
+                out_files = None):
+    """Run Rosetta. If 'events_file' is given, record when the
+    process started and finished (with the data in 'event_data')
+    together with its timings and resource usage. The process is
+    killed if it runs for more than 'timeout' seconds, and each
+    of its processes can allocate at most 'max_memory' MB. If
+    'scratch_opts' are given, the process runs in a node-local
+    scratch directory and only its outputs are moved back to
+    'wd'. If the run fails, classify the failure and, if it is
+    transient according to 'retry_opts', run it again after a
+    backoff, once the files in 'out_files' (paths relative to
+    'wd' to which the failed run may have written) have been
+    moved away.
     """
 
+    # Reset the worker's logger so that log messsages reach
+    # the output
+    logger = reset_worker_logger()
 
     # Make sure that the working directory exists. If not, create it.
     os.makedirs(wd, exist_ok = True)
@@ -151,25 +346,232 @@ def run_rosetta(executable,
     
     # Set the arguments for the command line
     args = mpi_prefix + [executable, "@", flagsfile]
+
+    # If a memory limit was set
+    if max_memory is not None:
+
+        # Limit the address space of the process through the
+        # shell before launching it, so that the limit is in place
+        # from the start and is inherited by all the processes it
+        # spawns (the limit is given to 'ulimit' in kB)
+        args = ["/bin/sh", "-c",
+                f"ulimit -v {int(max_memory * 1024)} && exec \"$@\"",
+                "sh"] + args
     
-    # Launch the process
-    popen = subprocess.Popen(args,
-                             stdout = open(output, "w"),
-                             stderr = subprocess.STDOUT,
-                             cwd = wd)
-    
-    # Wait for the process to complete
-    popen.wait()
-    
-    # Return the Popen attributes of interest (cannot
-    # return Popen itself since it is not serializable and
-    # we are launching the process with Dask)
-    return {"args" : popen.args,
-            "stdin" : popen.stdin,
-            "stdout" : popen.stdout,
-            "stderr" : popen.stderr,
-            "pid" : popen.pid,
-            "returncode" : popen.returncode}
+    # Get the data to be recorded with each event
+    event_data = {"wd" : wd, **(event_data or {})}
+
+    # Get the options for retrying failed runs (no retries
+    # by default)
+    retry_opts = retry_opts or {"maxretries" : 0}
+
+    # For each attempt
+    for attempt in itertools.count(1):
+
+        # If the process should be run in a scratch directory
+        if scratch_opts is not None:
+
+            # Create the scratch directory with a copy of the
+            # inputs
+            run_wd, in_state = \
+                scratch.stage_in(\
+                    wd = wd,
+                    scratch_dir = scratch_opts["scratchdir"])
+
+            # Write the output there, too
+            run_output = \
+                os.path.join(run_wd, os.path.relpath(output, wd))
+
+        # Otherwise, run it in the working directory
+        else:
+            run_wd, run_output = wd, output
+
+        try:
+
+            # Run the process
+            process = \
+                _run_rosetta_process(args = args,
+                                     output = run_output,
+                                     wd = wd,
+                                     events_file = events_file,
+                                     event_data = event_data,
+                                     timeout = timeout,
+                                     n_cores = \
+                                        mpi_n_proc if use_mpi else 1,
+                                     run_wd = run_wd)
+
+            # If the process was run in a scratch directory and
+            # was not stopped on request
+            if scratch_opts is not None \
+            and process["stopped"] is None:
+
+                # Move the outputs back to the working directory
+                # (the output and the crash log are always moved,
+                # since they are needed to diagnose failures)
+                scratch.stage_out(\
+                    run_wd = run_wd,
+                    wd = wd,
+                    outputs = scratch_opts["outputs"],
+                    in_state = in_state,
+                    always = (os.path.relpath(output, wd),
+                              ROSETTA_CRASH_LOG))
+
+        finally:
+
+            # Remove the scratch directory, if any
+            if scratch_opts is not None:
+                scratch.remove_scratch(run_wd = run_wd)
+
+        # Store the number of attempts
+        process["attempts"] = attempt
+
+        # Get whether the process was stopped on request
+        stopped = process.pop("stopped")
+
+        # If the process was superseded by a duplicate of the same
+        # run that completed first
+        if stopped is not None and stopped[0] == "supersede":
+
+            # Use the results of the duplicate
+            speculation.replace_dir(wd = wd,
+                                    spec_wd = stopped[1])
+
+            # The run completed successfully
+            process.update({"returncode" : 0,
+                            "failure" : None,
+                            "superseded" : True})
+            break
+
+        # If the process was cancelled because the original run it
+        # duplicated completed first, stop
+        if stopped is not None:
+            process["failure"] = "cancelled"
+            break
+
+        # Classify the failure, if any
+        failure = \
+            failures.classify_failure(\
+                returncode = process["returncode"],
+                wd = wd,
+                output = output,
+                killed = process["killed"])
+
+        # Store the failure
+        process["failure"] = failure
+
+        # If the run did not fail, stop
+        if failure is None:
+            break
+
+        # Get a message describing the failure
+        message = failures.get_failure_message(wd = wd,
+                                                output = output)
+
+        # If the failure is permanent or the maximum number of
+        # retries has been reached
+        if failure not in retry_opts.get("retryon", ()) \
+        or attempt > retry_opts["maxretries"]:
+
+            # Record the failure
+            telemetry.write_event(events_file, "failed",
+                                  failure = failure,
+                                  returncode = process["returncode"],
+                                  attempts = attempt,
+                                  message = message,
+                                  **event_data)
+
+            # Warn the user
+            warnstr = \
+                f"Rosetta run in {wd} failed ({failure}, exit " \
+                f"code {process['returncode']}) after {attempt} " \
+                f"attempt(s): {message}"
+            logger.warning(warnstr)
+
+            # Stop
+            break
+
+        # Get the time to wait before retrying (it grows with
+        # the number of attempts)
+        backoff = \
+            retry_opts["backoff"] \
+            * retry_opts["backofffactor"] ** (attempt - 1)
+
+        # Record the retry
+        telemetry.write_event(events_file, "retry",
+                              failure = failure,
+                              returncode = process["returncode"],
+                              attempts = attempt,
+                              backoff = backoff,
+                              message = message,
+                              **event_data)
+
+        # Inform the user
+        logstr = \
+            f"Rosetta run in {wd} failed ({failure}, exit code " \
+            f"{process['returncode']}). It will be run again in " \
+            f"{backoff:.0f} s (attempt {attempt + 1})."
+        logger.info(logstr)
+
+        # Move the crash log away, so that it is not mistaken for
+        # a crash of the next attempt
+        archive_crash_log(wd = wd)
+
+        # Move the outputs of the failed attempt away, so that the
+        # next attempt does not append to them
+        for out_file in (out_files or []):
+            archive_file(path = os.path.join(wd, out_file))
+
+        # Wait before retrying
+        time.sleep(backoff)
+
+    # Return the process
+    return process
+
+
+def get_cached_process():
+    """Get the attributes of a Rosetta process whose results
+    were restored from the cache instead of being computed
+    (no process was actually launched).
+    """
+
+    # Same attributes returned by 'run_rosetta', with a
+    # successful return code
+    return {"args" : None,
+            "stdin" : None,
+            "stdout" : None,
+            "stderr" : None,
+            "pid" : None,
+            "returncode" : 0,
+            "elapsed" : None,
+            "timedout" : False,
+            "killed" : None,
+            "failure" : None,
+            "attempts" : 0}
+
+
+def get_completed_runs(processes,
+                       step_name,
+                       step_opts,
+                       wds):
+    """Check which of the runs performed in the given working
+    directories are complete. A run is complete if all the
+    processes it required exited cleanly and its output is
+    complete. It is meant to be called on the worker where the
+    runs were performed, and returns a dictionary mapping each
+    working directory to whether the run is complete.
+    """
+
+    # Check whether all processes exited cleanly
+    clean_exit = \
+        all(p["returncode"] == 0 and p["failure"] is None \
+            for p in processes)
+
+    # Check the output of each run only if they did
+    return {wd : clean_exit \
+                 and check_run_completed(wd = wd,
+                                         step_name = step_name,
+                                         step_opts = step_opts) \
+            for wd in wds}
 
 
 def check_rosetta_run(dirs_paths):
@@ -194,6 +596,437 @@ def check_rosetta_run(dirs_paths):
     return crashed_runs_paths
 
 
+def get_ddg_output_file(step_name,
+                        step_opts):
+    """Get the name of the file where a ΔΔG step writes
+    its predictions.
+    """
+
+    # If the step is cartesian ΔΔG calculation
+    if step_name in ("cartesian", "cartesian2020"):
+
+        # The output is the file defined by the -ddg:out option
+        return step_opts[get_option_key(options = step_opts,
+                                        option = "ddg_out")]
+
+    # If the step is Flex ddG ΔΔG calculation
+    elif step_name == "flexddg":
+
+        # Get the RosettaScript options
+        r_script_options = \
+            step_opts[get_option_key(options = step_opts,
+                                     option = "script_vars")]
+
+        # The output is the database file storing the ΔΔG scores
+        return r_script_options[\
+            get_option_key(options = r_script_options,
+                           option = "ddg_db_file")]
+
+    # Raise an error if the step does not predict ΔΔGs
+    else:
+        errstr = f"Step '{step_name}' is not a ΔΔG prediction step."
+        raise ValueError(errstr)
+
+
+def get_flexddg_n_steps(step_opts):
+    """Get the number of backrub steps at which a Flex ddG run
+    scores the structures (one every 'backrubtrajstride' trials,
+    up to 'backrubntrials'), given the options of the step.
+    """
+
+    # Get the RosettaScript options
+    r_script_options = \
+        step_opts.get(get_option_key(options = step_opts,
+                                     option = "script_vars"), {})
+
+    # Get the number of backrub trials and the trajectory stride
+    # (or their defaults, if they are not set)
+    n_trials, traj_stride = \
+        [int(r_script_options.get(\
+            get_option_key(options = r_script_options,
+                           option = option),
+            FLEXDDG_SCRIPT_VARS_DEFAULTS[option])) \
+         for option in ("backrub_n_trials", "backrub_traj_stride")]
+
+    # Return the number of steps
+    return n_trials // traj_stride
+
+
+def check_ddg_output(step_name,
+                     out_file,
+                     step_opts):
+    """Check that the output file of a ΔΔG step is complete
+    and can be parsed.
+    """
+
+    # The output file must exist (sqlite3 would otherwise create
+    # an empty database when trying to open it)
+    if not os.path.isfile(out_file):
+        return False
+
+    # Get the column names
+    state_col = ROSETTA_DF_COLS["state"]
+    b_steps_col = ROSETTA_DF_COLS["b_steps"]
+
+    # Try to parse the output file
+    try:
+
+        # If the step is cartesian ΔΔG calculation
+        if step_name in ("cartesian", "cartesian2020"):
+
+            # A run killed while writing a round leaves a partial
+            # last line, which may still be parsed as a round
+            with open(out_file, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    return False
+
+            # Get the rounds run for the wild-type and the mutant
+            wt_dgs, mut_dgs = \
+                aggregation.read_output_cartddg(\
+                    ddg_out = out_file,
+                    list_contributions = [])
+
+            # Get the number of rounds requested, if defined
+            iterations_opt = get_option_key(step_opts, "iterations")
+            iterations = \
+                int(step_opts[iterations_opt]) if iterations_opt \
+                else None
+
+            # If only the wild-type was run (shared wild-type
+            # reference), only its rounds are expected
+            if is_option_true(step_opts, "wt_only"):
+                n_rounds = [len(wt_dgs)]
+
+            # If only the mutant was run, only its rounds
+            # are expected
+            elif is_option_true(step_opts, "mut_only"):
+                n_rounds = [len(mut_dgs)]
+
+            # Otherwise, as many rounds must have been run for
+            # the wild-type as for the mutant
+            else:
+                n_rounds = [len(wt_dgs), len(mut_dgs)]
+
+            # The run is complete if all rounds requested were
+            # run (or at least one, if no number was specified)
+            return all([n == iterations if iterations else n > 0 \
+                        for n in n_rounds]) \
+                   and len(set(n_rounds)) == 1
+
+        # If the step is Flex ddG ΔΔG calculation
+        elif step_name == "flexddg":
+
+            # Parse the output file (with a unit stride, so that
+            # the backrub steps are numbered 1, 2, ...)
+            df = aggregation.parse_output_flexddg(\
+                    db3_out = out_file,
+                    traj_stride = 1,
+                    struct_num = None,
+                    scf_name = None,
+                    list_contributions = [])
+
+            # Get the last backrub step scored in the file
+            last_step = df[b_steps_col].max()
+
+            # Get the states scored at that step
+            final_states = \
+                set(df.loc[df[b_steps_col] == last_step, state_col])
+
+            # The run is complete if the backrub trajectory reached
+            # its end (all four states are scored at every stride,
+            # so a run killed partway through would otherwise look
+            # complete) and all states were scored there
+            return last_step >= get_flexddg_n_steps(step_opts) \
+                   and {"bound_wt", "unbound_wt",
+                        "bound_mut", "unbound_mut"} <= final_states
+
+    # If something went wrong, the output is broken
+    except Exception:
+        return False
+
+    # Unrecognized steps cannot be checked
+    return False
+
+
+def check_relax_output(step_wd,
+                       step_opts,
+                       pdb_file):
+    """Check that the 'relax' step was completed, meaning that
+    the scorefile lists all the structures requested and all the
+    structures are present.
+    """
+
+    # If Rosetta wrote a crash log, the run is not complete
+    if not os.path.isdir(step_wd) \
+    or ROSETTA_CRASH_LOG in os.listdir(step_wd):
+        return False
+
+    # Get the number of structures requested (Rosetta's default
+    # is one structure)
+    nstruct_opt = get_option_key(step_opts, "nstruct")
+    nstruct = int(step_opts[nstruct_opt]) if nstruct_opt else 1
+
+    # Get the path to the scorefile
+    scorefile_opt = get_option_key(step_opts, "scorefile")
+    if not scorefile_opt:
+        return False
+    scorefile = os.path.join(step_wd, step_opts[scorefile_opt])
+
+    # Try to parse the scorefile
+    try:
+        scores = parse_scorefile_text(scorefile = scorefile)
+    
+    # If something went wrong, the output is broken
+    except Exception:
+        return False
+
+    # All structures must have been scored
+    if len(scores) < nstruct:
+        return False
+
+    # All structures must have been written
+    return all(\
+        [os.path.isfile(\
+            os.path.join(step_wd,
+                         get_out_pdb_name(\
+                            options = step_opts,
+                            pdb_file = os.path.basename(pdb_file),
+                            struct = struct))) \
+         for struct, score in scores])
+
+
+def _get_manifest_stat(out_file):
+    """Get the size and modification time of an output file
+    recorded in the run manifest.
+    """
+
+    # Get the file status
+    stat = os.stat(out_file)
+
+    # Return the size and the modification time
+    return {"size" : stat.st_size, "mtime" : stat.st_mtime}
+
+
+def read_run_manifest(manifest_file):
+    """Read the manifest of the completed runs and return a
+    dictionary mapping the absolute paths of the directories
+    where the runs were performed to the manifest entries.
+    """
+
+    # Create an empty dictionary to store the entries
+    manifest = {}
+
+    # If no manifest has been written yet, return it empty
+    if not os.path.isfile(manifest_file):
+        return manifest
+
+    # Paths in the manifest are relative to the directory
+    # containing it
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    with open(manifest_file, "r") as f:
+
+        # For each line in the file
+        for line in f:
+
+            # Try to load the entry
+            try:
+                entry = json.loads(line)
+
+            # A truncated line (for instance, if the run was killed
+            # while writing) is simply ignored
+            except json.JSONDecodeError:
+                continue
+
+            # Later entries override earlier ones
+            manifest[os.path.join(manifest_dir, entry["dir"])] = entry
+
+    # Return the manifest
+    return manifest
+
+
+def append_to_run_manifest(manifest_file,
+                           step_name,
+                           wd,
+                           out_file,
+                           elapsed = None,
+                           cost = None):
+    """Append an entry for a completed run to the manifest
+    of the completed runs, possibly together with the time
+    it took and its estimated cost.
+    """
+
+    # Paths in the manifest are relative to the directory
+    # containing it
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    # Create the entry
+    entry = {"step" : step_name,
+             "dir" : os.path.relpath(wd, manifest_dir),
+             "output" : os.path.basename(out_file),
+             **_get_manifest_stat(out_file),
+             "elapsed" : elapsed,
+             "cost" : cost}
+
+    # Append it to the manifest (one entry per line, so that
+    # an interrupted write only affects the last entry)
+    with _MANIFEST_LOCK, open(manifest_file, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def record_completed_run(future,
+                         manifest_file,
+                         step_name,
+                         step_opts,
+                         wd,
+                         cost = None,
+                         share = 1.0):
+    """Record a run in the manifest of the completed runs if
+    its process exited cleanly and the worker that performed
+    it found it complete (see 'get_completed_runs'). It is
+    meant to be used as a callback for the future of the run.
+    'share' is the fraction of the time taken by the process
+    attributed to the run (if the process performed several
+    runs).
+    """
+
+    # Only tasks that did not raise can have completed runs
+    if future.status != "finished":
+        return
+
+    # Get the process that performed the run
+    process = future.result()
+
+    # Only runs whose process exited cleanly can be complete
+    if process is None \
+    or process["returncode"] != 0 \
+    or process["failure"] is not None:
+        return
+
+    # If the run was found to be complete by the worker that
+    # performed it (so that the output files, which may not be
+    # reachable from the client, are not parsed here)
+    if process.get("completed", {}).get(wd):
+
+        # Get the time taken by the process (None if the results
+        # were restored from the cache)
+        elapsed = process["elapsed"]
+
+        # Add it to the manifest
+        append_to_run_manifest(\
+            manifest_file = manifest_file,
+            step_name = step_name,
+            wd = wd,
+            out_file = os.path.join(wd, get_ddg_output_file(\
+                step_name, step_opts)),
+            elapsed = elapsed * share if elapsed is not None \
+                      else None,
+            cost = cost)
+
+
+def archive_file(path):
+    """Rename a file left by a previous Rosetta run (adding
+    the first free numeric suffix to its name), so that the
+    next run in the same directory does not mistake it for its
+    own or append to it.
+    """
+
+    # If there is no file, there is nothing to do
+    if not os.path.isfile(path):
+        return
+
+    # Find the first free name for the archived file
+    for n in itertools.count(1):
+        archived = f"{path}.{n}"
+        if not os.path.exists(archived):
+            break
+
+    # Rename the file
+    os.rename(path, archived)
+
+
+def archive_crash_log(wd):
+    """Rename the crash log left by a previous Rosetta run in
+    a directory, so that it does not get mistaken for a crash
+    of the next run in the same directory.
+    """
+
+    archive_file(path = os.path.join(wd, ROSETTA_CRASH_LOG))
+
+
+def get_run_output_files(step_name,
+                         step_opts):
+    """Get the names of the files a ΔΔG step writes its results
+    to. Rosetta appends to these files if they already exist,
+    so they must be moved away before the step is run again in
+    the same directory.
+    """
+
+    # The ΔΔG output file
+    out_files = [get_ddg_output_file(step_name = step_name,
+                                     step_opts = step_opts)]
+
+    # If the step is Flex ddG ΔΔG calculation
+    if step_name == "flexddg":
+
+        # Get the RosettaScript options
+        r_script_options = \
+            step_opts[get_option_key(options = step_opts,
+                                     option = "script_vars")]
+
+        # Add the database file storing the structures
+        out_files.append(\
+            r_script_options[get_option_key(\
+                options = r_script_options,
+                option = "struct_db_file")])
+
+    # Return the names of the output files
+    return out_files
+
+
+def check_run_completed(wd,
+                        step_name,
+                        step_opts,
+                        manifest = None):
+    """Check whether a ΔΔG step has already been completed
+    in a directory, either because the manifest of the completed
+    runs says so and the output has not changed since, or because
+    the output is present and can be parsed.
+    """
+
+    # If the directory does not exist, the run is not complete
+    if not os.path.isdir(wd):
+        return False
+
+    # If Rosetta wrote a crash log, the run is not complete
+    if ROSETTA_CRASH_LOG in os.listdir(wd):
+        return False
+
+    # Get the path to the output file
+    out_file = os.path.join(wd, get_ddg_output_file(step_name,
+                                                    step_opts))
+
+    # If the output file does not exist, the run is not complete
+    if not os.path.isfile(out_file):
+        return False
+
+    # Get the entry for the run in the manifest, if any
+    entry = (manifest or {}).get(wd)
+
+    # If the output file has not changed since it was recorded
+    # in the manifest, trust the manifest
+    if entry is not None \
+    and {k : entry.get(k) for k in ("size", "mtime")} == \
+        _get_manifest_stat(out_file):
+        return True
+
+    # Otherwise, check the output file
+    return check_ddg_output(step_name = step_name,
+                            out_file = out_file,
+                            step_opts = step_opts)
+
+
 def parse_scorefile_text(scorefile):
     """Parse a Rosetta scorefile in text format to get the 
     structure numbers associated with the corresponding scores.
@@ -278,7 +1111,9 @@ def write_flagsfile(options,
 def write_mutfile(mut,
                   mutfile):
     """Write a mutfile containing the mutation performed
-    in the current run (if any).
+    in the current run (if any). A list of mutations can
+    also be passed, in which case all of them are written
+    to the same mutfile (one block for each mutation).
     """
 
     # Make sure that the specified path exists.
@@ -286,26 +1121,36 @@ def write_mutfile(mut,
     file_path, file_name = os.path.split(mutfile)
     os.makedirs(file_path, exist_ok = True)
 
+    # A single mutation or a list of mutations can be passed
+    muts = mut if isinstance(mut, list) else [mut]
+
     with open(mutfile, "w") as out:
         
-        # Get the mutation
-        mut = mut[MUT]
+        # Get the single mutations making up each mutation
+        muts = [m[MUT] for m in muts]
         
         # Get the keys of the attributes of the mutation
         keys = (CHAIN, WTR, NUMR, MUTR)
         
-        # Set the header line
-        out.write(f"total {len(mut)}\n{len(mut)}")
+        # Set the header line (total number of single mutations)
+        out.write(f"total {sum(len(m) for m in muts)}")
         
-        # Write the mutations
-        for smut in mut:
-            
-            # Get the values corresponding to the mutation
-            # attributes
-            chain, wtr, numr, mutr = operator.itemgetter(*keys)(smut)
-            
-            # Write the mutation
-            out.write(f"\n{wtr} {numr} {mutr}")
+        # For each mutation
+        for mut in muts:
+
+            # Write the number of single mutations it contains
+            out.write(f"\n{len(mut)}")
+        
+            # Write the mutations
+            for smut in mut:
+                
+                # Get the values corresponding to the mutation
+                # attributes
+                chain, wtr, numr, mutr = \
+                    operator.itemgetter(*keys)(smut)
+                
+                # Write the mutation
+                out.write(f"\n{wtr} {numr} {mutr}")
         
         # Return the path to the mutfile
         return os.path.abspath(mutfile)
@@ -490,6 +1335,38 @@ def get_option_key(options,
         return None
 
 
+def is_option_true(options,
+                   option):
+    """Given a dictionary of Rosetta options and the name of
+    a particular boolean option as defined in ROSETTA_OPTIONS,
+    get whether the option is set and true.
+    """
+
+    # Get the key used to define the option, if any
+    key = get_option_key(options, option)
+
+    # The option is true only if it is set to true
+    return key is not None and str(options[key]).lower() == "true"
+
+
+def get_shared_wt_options(options):
+    """Given a dictionary of Rosetta options for a cartesian
+    ΔΔG step, get the options for computing only the wild-type
+    reference and those for computing only the mutant.
+    """
+
+    # Get the option keys used to run only the wild-type or only
+    # the mutant (the longest ones available by default)
+    wt_only_opt, mut_only_opt = \
+        [sorted(ROSETTA_OPTIONS[opt], key = len, reverse = True)[0] \
+         for opt in ("wt_only", "mut_only")]
+
+    # Return the options for the wild-type-only runs and for the
+    # mutant-only runs
+    return ({**options, wt_only_opt : "true"},
+            {**options, mut_only_opt : "true"})
+
+
 def update_options(options,
                    pdb_file,
                    mut = None):
@@ -725,6 +1602,66 @@ def _check_config_run(config):
                     f"files will be kept)." 
                 log.warning(warnstr)
 
+            # If it is a cartesian ΔΔG step and it was not set
+            # whether to share the wild-type reference among all
+            # mutations at the same position(s)
+            if step_name in ("cartesian", "cartesian2020") \
+            and not "sharewt" in step.keys():
+
+                # Compute the wild-type reference for each mutation
+                # (Rosetta's default)
+                config["steps"][step_name]["sharewt"] = False
+
+            # If it is a cartesian ΔΔG step and the number of
+            # mutations to be run by each Rosetta process was
+            # not set
+            if step_name in ("cartesian", "cartesian2020") \
+            and not "batchsize" in step.keys():
+
+                # Run each mutation with its own process
+                config["steps"][step_name]["batchsize"] = 1
+
+            # If it is a Flex ddG step
+            if step_name == "flexddg":
+
+                # Get the options for the adaptive sampling of the
+                # number of structures, if any
+                adaptive_opts = step.get("adaptive") or {}
+
+                # Set the missing options to their defaults (no
+                # adaptive sampling)
+                for key, val in (("enabled", False),
+                                 ("minnstruct", 10),
+                                 ("wavesize", 5),
+                                 ("maxsterr", None),
+                                 ("maxciwidth", None),
+                                 ("confidence", 0.95)):
+                    adaptive_opts.setdefault(key, val)
+
+                # If adaptive sampling was requested
+                if adaptive_opts["enabled"]:
+
+                    # The maximum number of structures is the number
+                    # of structures requested for each mutation
+                    if not config.get("mutations", {}).get("nstruct"):
+                        errstr = \
+                            "Adaptive sampling requires 'nstruct' to " \
+                            "be set in the 'mutations' section, since " \
+                            "it is the maximum number of structures " \
+                            "generated for each mutation."
+                        raise ValueError(errstr)
+
+                    # At least one convergence criterion must be set
+                    if adaptive_opts["maxsterr"] is None \
+                    and adaptive_opts["maxciwidth"] is None:
+                        errstr = \
+                            "Adaptive sampling requires either " \
+                            "'maxsterr' or 'maxciwidth' to be set."
+                        raise ValueError(errstr)
+
+                # Update the step options
+                config["steps"][step_name]["adaptive"] = adaptive_opts
+
             # If no name has been set for the flags file
             if not "flagsfile" in step.keys():
 
@@ -808,6 +1745,158 @@ def _check_config_settings(config):
                 "These options will be ignored."
             log.warning(warnstr)
 
+    # Check if the 'backend' section is present
+    if not "backend" in config.keys():
+
+        # Create it empty
+        config["backend"] = {}
+
+    # Set the missing backend options to their defaults (a local
+    # cluster, as in previous versions)
+    for key, val in (("type", "local"),
+                     ("address", None),
+                     ("jobqueuecluster", None),
+                     ("jobqueueoptions", {})):
+        config["backend"].setdefault(key, val)
+
+    # If an existing scheduler should be used but its address
+    # was not given
+    if config["backend"]["type"] == "scheduler" \
+    and config["backend"]["address"] is None:
+
+        errstr = \
+            "The 'scheduler' backend requires the address of the " \
+            "Dask scheduler ('address') to be set in the " \
+            "'backend' section of the configuration file."
+        raise KeyError(errstr)
+
+    # If the workers should be spawned through a job queue but
+    # the cluster class was not given
+    if config["backend"]["type"] == "jobqueue" \
+    and config["backend"]["jobqueuecluster"] is None:
+
+        errstr = \
+            "The 'jobqueue' backend requires the dask-jobqueue " \
+            "cluster class ('jobqueuecluster', i.e. SLURMCluster) " \
+            "to be set in the 'backend' section of the " \
+            "configuration file."
+        raise KeyError(errstr)
+
+    # Check if the 'resources' section is present
+    if not "resources" in config.keys():
+
+        # Create it empty
+        config["resources"] = {}
+
+    # Set the missing resources options to their defaults (tasks
+    # reserve the cores they use, no memory reservation)
+    for key, val in (("useresources", True),
+                     ("memoryperprocess", None)):
+        config["resources"].setdefault(key, val)
+
+    # Check if the 'retry' section is present
+    if not "retry" in config.keys():
+
+        # Create it empty
+        config["retry"] = {}
+
+    # Set the missing retry options to their defaults (failed
+    # runs are not run again unless requested)
+    for key, val in (("maxretries", 0),
+                     ("retryon", ["oom", "signal", "unknown"]),
+                     ("backoff", 30),
+                     ("backofffactor", 2)):
+        config["retry"].setdefault(key, val)
+
+    # Check if the 'limits' section is present
+    if not "limits" in config.keys():
+
+        # Create it empty
+        config["limits"] = {}
+
+    # By default, do not limit the time taken by the processes
+    # of any step nor the memory they use
+    config["limits"].setdefault("timeout", {})
+    config["limits"]["timeout"] = \
+        {**{step : None for step in \
+            ("relax", "cartesian", "flexddg", "flexddg_extract")},
+         **(config["limits"]["timeout"] or {})}
+    config["limits"].setdefault("maxmemory", None)
+
+    # Check if the 'speculative' section is present
+    if not "speculative" in config.keys():
+
+        # Create it empty
+        config["speculative"] = {}
+
+    # Set the missing options for the speculative re-execution
+    # of the runs taking far longer than expected to their
+    # defaults (disabled by default)
+    for key, val in (("enabled", False),
+                     ("factor", 3),
+                     ("mintime", 600),
+                     ("minsamples", 5),
+                     ("poll", 30)):
+        config["speculative"].setdefault(key, val)
+
+    # Check if the 'scratch' section is present
+    if not "scratch" in config.keys():
+
+        # Create it empty
+        config["scratch"] = {}
+
+    # Set the missing scratch options to their defaults (run in
+    # the working directories by default)
+    for key, val in (("enabled", False),
+                     ("scratchdir", None),
+                     ("outputs", {})):
+        config["scratch"].setdefault(key, val)
+
+    # No outputs configured for a step means all outputs
+    config["scratch"]["outputs"] = config["scratch"]["outputs"] or {}
+
+    # Check if the 'cache' section is present
+    if not "cache" in config.keys():
+
+        # Create it empty
+        config["cache"] = {}
+
+    # If the 'cachedir' option is not present
+    if not "cachedir" in config["cache"].keys():
+
+        # Create it and set it to None (no caching)
+        config["cache"]["cachedir"] = None
+
+    # If the 'link' option is not present
+    if not "link" in config["cache"].keys():
+
+        # Create it and set it to False (cached files are copied)
+        config["cache"]["link"] = False
+
+    # Get the absolute path to the cache directory, if any
+    config["cache"]["cachedir"] = \
+        get_abspath(config["cache"]["cachedir"])
+
+    # Check if the 'scheduling' section is present
+    if not "scheduling" in config.keys():
+
+        # Create it empty
+        config["scheduling"] = {}
+
+    # If the 'longestfirst' option is not present
+    if not "longestfirst" in config["scheduling"].keys():
+
+        # Create it and set it to True (the runs estimated to
+        # take longest are started first)
+        config["scheduling"]["longestfirst"] = True
+
+    # If the 'chunksize' option is not present
+    if not "chunksize" in config["scheduling"].keys():
+
+        # Create it and set it to None (all runs are submitted
+        # at once)
+        config["scheduling"]["chunksize"] = None
+
     # Check if the 'rosetta' section is present
     if not "rosetta" in config.keys():
 
@@ -990,9 +2079,10 @@ def get_res_list(res_list_file):
                 if not re.match(r"^\s*$", l)]
 
 
-def _get_mut_list(list_file):
+def _iter_mut_list(list_file,
+                   warn_duplicates = True):
     """Parse the file containing the list of 
-    positions/mutations.
+    positions/mutations, yielding them one at a time.
     """
 
     # Reset the worker's logger so that log messsages reach
@@ -1001,8 +2091,10 @@ def _get_mut_list(list_file):
 
     with open(list_file, "r") as f:
         
-        # Initialize an empty list to store the mutations
-        mut_list = []
+        # Initialize an empty set to store the mutations already
+        # found (a set, so that checking for duplicates takes
+        # constant time)
+        mut_seen = set()
         
         # For each line in the file
         for line in f:
@@ -1033,7 +2125,11 @@ def _get_mut_list(list_file):
             mut_data = tuple([(mut), *extra_data])
             
             # If the mutation has been already found in the file
-            if mut_data in mut_list:
+            if mut_data in mut_seen:
+
+                # Skip it silently, if requested
+                if not warn_duplicates:
+                    continue
 
                 _mut = line.rstrip('\n').split(' ')
                 
@@ -1046,16 +2142,124 @@ def _get_mut_list(list_file):
                 
                 logger.warning(warnstr)
 
-            # Otherwise, append the mutation data to the list
+            # Otherwise, yield the mutation data
             else:
-                mut_list.append(mut_data)
+                mut_seen.add(mut_data)
+                yield mut_data
+
+
+def _get_combination(choices,
+                     index):
+    """Get the combination at a given index of the Cartesian
+    product of the choices (in the same order as
+    'itertools.product'), without enumerating the product.
+    """
+
+    # Create an empty list to store the combination
+    comb = []
+
+    # For each group of choices, starting from the one varying
+    # fastest in the product
+    for group in reversed(choices):
+
+        # Get the index of the choice in the group
+        index, choice_ix = divmod(index, len(group))
+
+        # Add the choice to the combination
+        comb.append(group[choice_ix])
+
+    # Return the combination (in the order of the groups)
+    return tuple(reversed(comb))
+
+
+def _sample_combinations(choices,
+                         n_combs,
+                         sampling,
+                         rng):
+    """Sample the indexes of 'n_combs' distinct combinations from
+    the Cartesian product of the choices, either uniformly at
+    random ('random') or so that each choice of each group
+    appears (nearly) the same number of times ('stratified').
+    The indexes are returned sorted, so that the combinations
+    are generated in the same order as in the full product.
+    """
+
+    # Get the total number of combinations
+    n_total = math.prod(len(group) for group in choices)
+
+    # If the sampling is uniform at random
+    if sampling == "random":
+
+        # Sample the indexes without replacement (sampling from
+        # a range does not build the range)
+        return sorted(rng.sample(range(n_total), n_combs))
+
+    # If the sampling is stratified
+    elif sampling == "stratified":
+
+        # Create an empty list to store, for each group, the
+        # sequence of indexes of the choices to be used
+        columns = []
+
+        # For each group of choices
+        for group in choices:
+
+            # Create an empty list to store the sequence
+            column = []
+
+            # Until the sequence is long enough
+            while len(column) < n_combs:
+
+                # Add all choices once, in a random order
+                # (so that each choice appears the same number
+                # of times, give or take one)
+                block = list(range(len(group)))
+                rng.shuffle(block)
+                column.extend(block)
+
+            # Add the sequence to the list
+            columns.append(column[:n_combs])
+
+        # Create an empty set to store the indexes
+        indexes = set()
+
+        # For each combination of choices
+        for comb in zip(*columns):
 
-        # Return the list of mutations
-        return mut_list
+            # Get the index of the combination in the product
+            index = 0
+            for group, choice_ix in zip(choices, comb):
+                index = index * len(group) + choice_ix
 
+            # Add the index
+            indexes.add(index)
 
-def _get_saturation_mut_list(pos_list, res_list):
-    """Generate a mutation list for saturation mutagenesis.
+        # Replace the combinations drawn more than once with
+        # combinations drawn at random
+        while len(indexes) < n_combs:
+            indexes.add(rng.randrange(n_total))
+
+        # Return the indexes
+        return sorted(indexes)
+
+    # Otherwise, raise an error
+    else:
+        errstr = \
+            f"Unrecognized sampling method '{sampling}'. " \
+            f"Supported methods are: " \
+            f"{', '.join(SATURATION_SAMPLING_METHODS)}."
+        raise ValueError(errstr)
+
+
+def _iter_saturation_mut_list(pos_list,
+                              res_list,
+                              max_combs = None,
+                              sampling = None,
+                              seed = None,
+                              verbose = True):
+    """Generate the mutations for saturation mutagenesis, one at
+    a time (the combinations of multiple positions are enumerated
+    lazily, without building the whole Cartesian product).
     
     Every position specified as (chain, wild_type_residue,
     position) will be treated as a position to perform
@@ -1067,6 +2271,12 @@ def _get_saturation_mut_list(pos_list, res_list):
     mutated (i.e., on the same line of the mutations' list file),
     all possible combinations of mutations of those positions
     will be performed (Cartesian product).
+
+    If 'max_combs' is given, no more than 'max_combs' mutations
+    are generated for each line. If a line has more combinations
+    and a 'sampling' method is given ('random' or 'stratified'),
+    the combinations are sampled using 'seed'. Otherwise, an
+    error is raised. If 'verbose' is False, nothing is logged.
     
     Example
     -------
@@ -1087,111 +2297,84 @@ def _get_saturation_mut_list(pos_list, res_list):
     A.R.10.C and A.R.11.C and F.52.A
     """
 
-    # Create an empty list to store the list of mutations
-    # when saturation mutagenesis is involved
-    sat_mut_list = []
-    
+    # Reset the worker's logger so that log messsages reach
+    # the output
+    logger = reset_worker_logger()
+
+    # Create the random number generator used to sample the
+    # combinations (seeded, so that the same combinations are
+    # generated every time the mutations are generated)
+    rng = random.Random(seed)
+
     # For each combination of mutations/positions
     for pos_data, *extra_data in pos_list:
 
-        # If there is only one mutation/postion
-        if len(pos_data) == 1:
+        # For each position, generate all possible mutations.
+        # For each mutation, simply add it.
+        single_muts = \
+            [[(*i, r) for r in res_list] if len(i) == 3 \
+             else [tuple(i)] for i in pos_data]
 
-            # If it is a mutation (chain, wild-type residue,
-            # position, and mutated residue specified)
-            if len(pos_data[0]) == 4:
+        # Get the number of combinations
+        n_combs = math.prod(len(muts) for muts in single_muts)
 
-                # Just add the mutation to the list (it will
-                # not be part of the saturation mutagenesis)
-                sat_mut_list.append((pos_data, *extra_data))
-            
-            # If it is a position (chain, wild-type residue,
-            # position, and mutated residue specified)
-            elif len(pos_data[0]) == 3:
-                
-                # Get the chain, wild-type residue, and position
-                chain, wtr, numr = pos_data[0]
+        # Get the name of the line (for logging purposes)
+        line = MUT_SEP.join(COMP_SEP.join(i) for i in pos_data)
 
-                # Add all possible mutations for the current
-                # position to the list
-                sat_mut_list.extend(\
-                    [(((chain, wtr, numr, res),), *extra_data) \
-                     for res in res_list])
-
-        # If there are multiple mutations/positions
-        else:
+        # If there are no more combinations than allowed, yield
+        # the Cartesian product between the different
+        # possibilities to obtain the final mutations
+        if max_combs is None or n_combs <= max_combs:
 
-            # For each position, generate all possible mutations.
-            # For each mutation, simply add it.
-            single_muts = \
-                [[(*i, r) if len(i) == 3 else tuple(i) \
-                 for r in res_list] for i in pos_data]
+            # Warn the user if the combinations are many
+            if verbose and n_combs > SATURATION_WARNING_COMBINATIONS:
+                warnstr = \
+                    f"Line '{line}' generates {n_combs} " \
+                    f"combinations of mutations. Consider " \
+                    f"limiting them with a maximum number of " \
+                    f"combinations and a sampling method."
+                logger.warning(warnstr)
 
-            # Compute the Cartesian product between the different
-            # possibilities to obtain the final list of mutations
-            sat_mut_list.extend(\
-                ([(i, *extra_data) for i in \
-                  list(itertools.product(*single_muts))]))
+            for i in itertools.product(*single_muts):
+                yield (i, *extra_data)
 
-    # Return the list of mutations
-    return sat_mut_list
+            continue
 
+        # If the combinations exceed the maximum allowed and no
+        # sampling method was given, raise an error
+        if sampling is None:
+            errstr = \
+                f"Line '{line}' generates {n_combs} combinations " \
+                f"of mutations, more than the maximum allowed " \
+                f"({max_combs}). Please choose a sampling method " \
+                f"or increase the maximum."
+            raise ValueError(errstr)
 
-def _convert_to_pose_numbering(mut_list, pdb_file):
-    """Retun a copy of the mutation list with residue numbers
-    changed to the Rosetta pose numbering.
+        # Inform the user that the combinations will be sampled
+        if verbose:
+            logstr = \
+                f"{max_combs} of the {n_combs} combinations of " \
+                f"mutations generated by line '{line}' will be " \
+                f"sampled ({sampling} sampling)."
+            logger.info(logstr)
+
+        # Yield the sampled combinations
+        for index in _sample_combinations(choices = single_muts,
+                                          n_combs = max_combs,
+                                          sampling = sampling,
+                                          rng = rng):
+            yield (_get_combination(single_muts, index), *extra_data)
+
+
+def _convert_to_pose_numbering(mut, pdbnum2posenum):
+    """Return a copy of a mutation with residue numbers changed
+    to the Rosetta pose numbering.
     """
 
-    # Create the PDB parser
-    parser = PDB.PDBParser()
-    
-    # Get the structure fron the PDB file
-    structure = parser.get_structure("structure", pdb_file) 
-    
-    # Create an empty dictionary to store the mapping
-    # between the PDB numbering and the pose numbering
-    pdbnum2posenum = {}
-    
-    # Set a chain offset to start at the correct index when
-    # changing chain
-    chain_offset = 0
-    
-    # For each chain
-    for chain in structure[0]:
-        
-        # For each residue in the chain
-        for ix, res in enumerate(chain, start = 1):
-            
-            # Unpack the residue full ID
-            struc, mod, chainid, (het, resn, icode) = res.get_full_id()
-            
-            # Map the PDB chain and residue number to the numbering
-            # that the residue will have in the mutfile (starts
-            # at 1); convert the PDB residue number to a string
-            pdbnum2posenum[(chainid, str(resn))] = \
-                str(ix + chain_offset)
-        
-        # Update the chain offset
-        chain_offset += ix
-    
-    # Generate the mutation list but with residue numbers changed
-    # according to the mutfile convention
-    pose_mut_list = []
-
-    # For each mutation and associated extra data
-    for mut, *extra_data in mut_list:
-
-        # Get the mutation with the pose numbering 
-        new_mut = \
-            [(chain, wtr, pdbnum2posenum[(chain, numr)], mutr) \
-              for (chain, wtr, numr, mutr) in mut]
-
-        # Append it to the final list together with its associated
-        # extra data
-        pose_mut_list.append(tuple([tuple(new_mut), *extra_data]))
-    
-    # Return the new mutations' list
-    return pose_mut_list
+    # Get the mutation with the pose numbering 
+    return \
+        tuple([(chain, wtr, pdbnum2posenum[(chain, numr)], mutr) \
+               for (chain, wtr, numr, mutr) in mut])
 
 
 def _generate_mutation_dir_path(mut_dict):
@@ -1244,13 +2427,298 @@ def _generate_mutation_dir_path(mut_dict):
     return dir_path, dir_name
 
 
-def get_mutations(list_file,
-                  res_list_file,
-                  pdb_file,
-                  res_numbering,
-                  extra,
-                  n_struct):
-    """Get the list of mutations to be performed.
+def _get_wt_reference_dir_path(positions):
+    """Given the positions (chain, wild-type residue, residue
+    number) mutated in a mutation, get the path to the directory
+    where the wild-type reference shared by all mutations at the
+    same positions is computed.
+    """
+
+    # Initialize a list for the formatted positions
+    fmt_pos = []
+
+    # For each position (sorted, so that the order in which the
+    # positions were listed does not matter)
+    for chain, wtr, numr in sorted(set(positions)):
+
+        # Strip Rosetta identifiers of non canonical residues
+        # from the name of the residue
+        wtr = wtr.strip("X[]")
+
+        # If the chain has a chain ID
+        if chain != "_":
+            fmt_pos.append(f"{chain}{CHAIN_SEP}{wtr}{numr}")
+
+        # If the chain has no ID
+        else:
+            fmt_pos.append(f"{wtr}{numr}")
+
+    # Return the path to the directory
+    return os.path.join(WT_REF_DIR_NAME, DIR_MUT_SEP.join(fmt_pos))
+
+
+def get_wt_reference_dir_path(mut_dict):
+    """Given a mutation, get the path to the directory where the
+    wild-type reference shared by all mutations at the same
+    positions is computed.
+    """
+
+    # Get the keys of the attributes defining the position
+    keys = (CHAIN, WTR, NUMR)
+
+    # Return the path to the directory
+    return _get_wt_reference_dir_path(\
+        [operator.itemgetter(*keys)(single_mut) \
+         for single_mut in mut_dict[MUT]])
+
+
+def get_wt_reference_dir_path_from_name(mut_name):
+    """Given the name of a mutation as written in the mutinfo
+    file, get the path to the directory where the wild-type
+    reference shared by all mutations at the same positions is
+    computed.
+    """
+
+    # Return the path to the directory
+    return _get_wt_reference_dir_path(\
+        [tuple(single_mut.split(COMP_SEP)[:3]) \
+         for single_mut in mut_name.split(MULTI_MUT_SEP)])
+
+
+def get_step_wd(step,
+                run_dir):
+    """Get the working directory of a step.
+    """
+
+    # Get the step working directory
+    step_wd = step["wd"]
+
+    # If the specified directory was ".", run in the running
+    # directory without generating a sub-directory for the step
+    if step_wd == ".":
+        return run_dir
+
+    # Otherwise, set a new directory
+    return os.path.join(run_dir, step_wd)
+
+
+def get_ddg_runs(step_name,
+                 step,
+                 step_wd,
+                 step_opts,
+                 mutations):
+    """Generate the runs to be performed by a ΔΔG step, given
+    an iterable of pairs of mutations (with the numbering used
+    for running and with the original numbering). Each run is a
+    tuple (mutation, working directory, options to be used,
+    whether the run can be batched with others, mutation in the
+    PDB numbering). Runs are generated lazily, so that the
+    mutations can be streamed.
+    """
+
+    # Get whether the wild-type reference should be computed only
+    # once for all mutations at the same position(s)
+    share_wt = step.get("sharewt", False)
+
+    # If it should
+    if share_wt:
+
+        # Get the options to compute only the wild-type reference
+        # and those to compute only the mutant
+        wt_opts, mut_opts = get_shared_wt_options(step_opts)
+
+    # Otherwise
+    else:
+
+        # Each run computes both the wild-type and the mutant
+        mut_opts = step_opts
+
+    # Create an empty set to store the wild-type references
+    # already generated
+    wt_refs = set()
+
+    # For each mutation
+    for mut, mut_orig in mutations:
+
+        # If the wild-type reference is shared
+        if share_wt:
+
+            # Get the directory of the wild-type reference
+            wt_dir_path = get_wt_reference_dir_path(mut_orig)
+
+            # If no mutation at the same positions was found before
+            if wt_dir_path not in wt_refs:
+
+                # Add the reference to the set
+                wt_refs.add(wt_dir_path)
+
+                # Generate the run computing the wild-type reference
+                # for the group (these runs are never batched
+                # together)
+                yield (mut,
+                       os.path.join(step_wd, wt_dir_path),
+                       wt_opts,
+                       False,
+                       mut_orig)
+
+        # Generate the run for the mutation (only cartesian ΔΔG
+        # runs can be batched together)
+        yield (mut,
+               os.path.join(step_wd, mut_orig[MUT_DIR_PATH]),
+               mut_opts,
+               step_name in ("cartesian", "cartesian2020"),
+               mut_orig)
+
+
+def iter_pending_runs(runs,
+                      step_name,
+                      manifest,
+                      resume,
+                      counts):
+    """Generate lazily the runs that still have to be performed,
+    skipping those already completed if the run is being resumed.
+    The number of runs skipped is stored in 'counts' under the
+    'completed' key.
+    """
+
+    # For each run
+    for run in runs:
+
+        # Get the working directory and the options
+        mut_wd, run_opts = run[1], run[2]
+
+        # If the run is being resumed
+        if resume:
+
+            # If the run was already completed
+            if check_run_completed(wd = mut_wd,
+                                   step_name = step_name,
+                                   step_opts = run_opts,
+                                   manifest = manifest):
+
+                # Skip it
+                counts["completed"] += 1
+                continue
+
+            # Otherwise, make sure a crash log left by the previous
+            # run is not mistaken for a crash of the new one
+            archive_crash_log(wd = mut_wd)
+
+            # And that the new run does not append to the
+            # incomplete output of the previous one
+            for out_file in get_run_output_files(\
+                step_name = step_name,
+                step_opts = run_opts):
+                archive_file(path = os.path.join(mut_wd, out_file))
+
+        # Yield the run
+        yield run
+
+
+def get_run_chunks(runs,
+                   chunk_size = None):
+    """Split an iterable of runs into lists of at most
+    'chunk_size' runs each, generated lazily. If no chunk size
+    is given, a single chunk with all runs is generated.
+    """
+
+    # Get an iterator over the runs
+    runs = iter(runs)
+
+    # While there are runs left
+    while True:
+
+        # Get the next chunk
+        chunk = list(itertools.islice(runs, chunk_size))
+
+        # Stop if there are no runs left
+        if not chunk:
+            return
+
+        # Yield the chunk
+        yield chunk
+
+
+def _get_mutation_dicts(mut,
+                        extra_data,
+                        extra,
+                        n_struct):
+    """Get the dictionaries describing a mutation (one per
+    structure to be generated, if multiple structures will be
+    generated for each mutation).
+    """
+
+    # Create a dictionary where the mutation's attributes
+    # will be stored
+    mut_dict = {MUT : []}
+    
+    # For each mutation attribute
+    for chain, wtr, numr, mutr in mut:
+        
+        # If the wild-type residue is noncanonical
+        if len(wtr) > 1:
+            wtr = f"X[{wtr}]"
+        
+        # If the mutant residue is noncanonical
+        if len(mutr) > 1:
+            mutr = f"X[{mutr}]"             
+        
+        # Update the mutation dictionary
+        mut_dict[MUT].append({CHAIN : chain,
+                              WTR : wtr,
+                              NUMR : numr,
+                              MUTR : mutr})
+    
+    # If there are extra data associated with the mutation      
+    if extra:
+        
+        # Add them with the corresponding key
+        for key, data in zip(extra, extra_data):
+            mut_dict[key] = data
+    
+    # If multiple structures will be generatred for each mutation,
+    # add the mutation as many times as the structures requested,
+    # with a new key identifying the structure number. Otherwise,
+    # simply add the mutation.
+    muts = \
+        [{**mut_dict, STRUCT : str(struct + 1)} \
+         for struct in range(n_struct)] if n_struct \
+        else [mut_dict]
+
+    # For each mutation dictionary
+    for mut_dict in muts:
+        
+        # Add the mutation directory name and directory path
+        mut_dir_path, mut_dir_name = \
+            _generate_mutation_dir_path(mut_dict)
+        mut_dict[MUT_DIR_PATH] = mut_dir_path
+        mut_dict[MUT_DIR_NAME] = mut_dir_name
+
+    # Return the dictionaries
+    return muts
+
+
+def iter_mutations(list_file,
+                   res_list_file,
+                   pdb_file,
+                   res_numbering,
+                   extra,
+                   n_struct,
+                   max_combs = None,
+                   sampling = None,
+                   seed = None,
+                   exclude = (),
+                   verbose = True):
+    """Generate the mutations to be performed one at a time,
+    as pairs of dictionaries (the mutation with the residue
+    numbering used to run the protocol and the mutation with
+    the original numbering). Only one mutation at a time is kept
+    in memory, so that very large scans can be streamed.
+    'max_combs', 'sampling' and 'seed' bound the combinations of
+    mutations generated by saturation mutagenesis. The mutations
+    whose names are in 'exclude' are not generated. If 'verbose'
+    is False, duplicate mutations and sampled combinations are
+    not reported.
     """
 
     # Check the pose numbering argument
@@ -1264,8 +2732,10 @@ def get_mutations(list_file,
     #---------------------- Saturation or not? -----------------------#
 
 
-    # Get the mutations/positions list
-    mut_list = _get_mut_list(list_file)
+    # Get the mutations/positions
+    mut_list = \
+        _iter_mut_list(list_file = list_file,
+                       warn_duplicates = verbose)
 
     # If a list of residue types has been passed, assume it is a
     # saturation mutagenesis scan
@@ -1274,110 +2744,87 @@ def get_mutations(list_file,
         # Get the list of residue types
         res_list = get_res_list(res_list_file)
         
-        # Treat the mutations' list as a list of positions
-        # and generate the new list of mutations
-        mut_list = _get_saturation_mut_list(mut_list, res_list)
-
-    # Generate a copy of the original mutation list (in case it
-    # gets changed because of a different residue numbering)
-    mut_list_original = copy.deepcopy(mut_list)
+        # Treat the mutations as positions and generate the new
+        # mutations
+        mut_list = \
+            _iter_saturation_mut_list(pos_list = mut_list,
+                                      res_list = res_list,
+                                      max_combs = max_combs,
+                                      sampling = sampling,
+                                      seed = seed,
+                                      verbose = verbose)
 
 
     #----------------------- Residue numbering -----------------------#
 
 
     # If the protocol requires the residue numbering to follow
-    # the Rosetta pose numbering convention
-    if res_numbering == "pose":
-        
-        # Convert the numbering from PDB to pose numbering
-        mut_list = _convert_to_pose_numbering(mut_list, pdb_file)
-
-    # Otherwise, assume it follows the PDB convention (requires no
-    # conversion)
+    # the Rosetta pose numbering convention, get the mapping
+    # between the PDB numbering and the pose numbering
+    pdbnum2posenum = \
+        residueindex.get_pose_numbering_map(pdb_file) \
+        if res_numbering == "pose" \
+        else None
 
 
     #------------------------ List generation ------------------------#
 
 
-    # Create an empty list to store the mutations
-    mutations = []
-    
-    # For each mutations' list (original and final)
-    for mutl in [mut_list, mut_list_original]:
+    # ((("A","C","151","Y"), ("A","S","154","N")), *extra_data)
+    for mut_orig, *extra_data in mut_list:
 
-        # Initialize an empty list to store the single mutations
-        # defined in each mutation
-        muts = []
+        # Get the mutation's dictionaries (with the original
+        # numbering)
+        muts_orig = \
+            _get_mutation_dicts(mut_orig, extra_data, extra, n_struct)
 
-        # ((("A","C","151","Y"), ("A","S","154","N")), *extra_data)
-        for mut, *extra_data in mutl:
+        # If the mutation was excluded, skip it (before converting
+        # it, since it may refer to residues missing from the
+        # structure)
+        if muts_orig[0][MUT_DIR_NAME] in exclude:
+            continue
 
-            # Create a dictionary where the mutation's attributes
-            # will be stored
-            mut_dict = {MUT : []}
-            
-            # For each mutation attribute
-            for chain, wtr, numr, mutr in mut:
-                
-                # If the wild-type residue is noncanonical
-                if len(wtr) > 1:
-                    wtr = f"X[{wtr}]"
-                
-                # If the mutant residue is noncanonical
-                if len(mutr) > 1:
-                    mutr = f"X[{mutr}]"             
-                
-                # Update the mutation dictionary
-                mut_dict[MUT].append({CHAIN : chain,
-                                      WTR : wtr,
-                                      NUMR : numr,
-                                      MUTR : mutr})
-            
-            # If there are extra data associated with the mutation      
-            if extra:
-                
-                # Add them with the corresponding key
-                for key, data in zip(extra, extra_data):
-                    mut_dict[key] = data
-            
-            # If multiple structures will be generatred for each mutation
-            if n_struct:
-                
-                # Add the mutation as many times as the structures
-                # requested, with a new key identifying the structure
-                # number
-                for struct in range(n_struct):
-                    
-                    # Create a fresh copy of the dictionary to be modified
-                    mut_dict_copy = dict(mut_dict)
-                    
-                    # Update the copy
-                    mut_dict_copy.update({STRUCT : str(struct + 1)})
-                    
-                    # Append the copy to the list of mutations
-                    muts.append(mut_dict_copy)
+        # Get the mutation with the numbering used to run the
+        # protocol (the PDB numbering requires no conversion)
+        mut = \
+            _convert_to_pose_numbering(mut_orig, pdbnum2posenum) \
+            if pdbnum2posenum is not None else mut_orig
 
-            # If only one structure will be generated
-            else:
+        # Yield the mutation's dictionaries (with the final and
+        # the original numbering)
+        yield from \
+            zip(_get_mutation_dicts(mut, extra_data, extra, n_struct),
+                muts_orig)
 
-                # Simply append the mutation dictionary
-                muts.append(mut_dict)
 
-        # For each mutation dictionary
-        for mut_dict in muts:
-            
-            # Add the mutation directory name and directory path
-            mut_dir_path, mut_dir_name = \
-                _generate_mutation_dir_path(mut_dict)
-            mut_dict[MUT_DIR_PATH] = mut_dir_path
-            mut_dict[MUT_DIR_NAME] = mut_dir_name
-
-        # Append the current list of mutations to the final list
-        mutations.append(muts)
+def get_mutations(list_file,
+                  res_list_file,
+                  pdb_file,
+                  res_numbering,
+                  extra,
+                  n_struct):
+    """Get the list of mutations to be performed (a list with
+    the mutations with the numbering used to run the protocol
+    and a list with the mutations with the original numbering).
+    """
+
+    # Create empty lists to store the mutations
+    mutations, mutations_original = [], []
+
+    # For each mutation
+    for mut, mut_orig in iter_mutations(list_file = list_file,
+                                        res_list_file = res_list_file,
+                                        pdb_file = pdb_file,
+                                        res_numbering = res_numbering,
+                                        extra = extra,
+                                        n_struct = n_struct):
+
+        # Add it to the lists
+        mutations.append(mut)
+        mutations_original.append(mut_orig)
    
-    # Return the list of mutations
-    return mutations
+    # Return the lists of mutations
+    return [mutations, mutations_original]
 
 
 def write_mutinfo_file(mutations_original,
@@ -1560,35 +3007,12 @@ def check_pdb_file(pdb_file,
     """Check a PDB file before passing it to Rosetta.
     """
     
-    # Create the PDB parser
-    parser = PDB.PDBParser()
-    
-    # Try to get the structure
-    try:
-        structure = parser.get_structure("structure", pdb_file)
-    
-    # In case the PDB file was not found
-    except FileNotFoundError:
-        
-        # Raise an error
-        errstr = f"PDB file {pdb_file} not found."
-        raise FileNotFoundError(errstr)
-    
-    # In case something went wrong in accessing/opening the file
-    except IOError:
-        
-        # Raise an error
-        errstr = f"Could not open PDB file {pdb_file}."
-        raise IOError(errstr)
-    
-    # In case something else went wrong
-    except Exception as e:
-        
-        # Re-raise the error
-        raise Exception(e)
+    # Get the index of the residues of the structure (an error
+    # is raised if the file could not be found or opened)
+    index = residueindex.get_residue_index(pdb_file)
 
     # If the PDB file contains more than one model
-    if len(structure) > 1: 
+    if index["n_models"] > 1: 
         
         # Raise an exception since multi-model structures
         # are not allowed
@@ -1596,7 +3020,7 @@ def check_pdb_file(pdb_file,
         raise ValueError(errstr)
     
     # Get the number of chains in the structure
-    num_chains = len(structure[0])
+    num_chains = len(index["chain_ids"])
     
     # Check if multiple chains are allowed
     if not allow_multi_chains and num_chains > 1:
@@ -1606,18 +3030,15 @@ def check_pdb_file(pdb_file,
         errstr = "Multi-chains structures are not allowed."
         raise ValueError(errstr)
     
-    # Check if the absence of chain IDs is allowed
+    # Check if the absence of chain IDs is allowed (it is already
+    # guaranteed that there is only one model)
     if not allow_no_chain_ids:
         
-        # For each chain in the first model of the structure (it
-        # is already guaranteed that there is only one model)
-        for chain in structure[0]:
-            
-            # Raise an exception if there are no chain IDs but
-            # chain IDs were mandatory
-            if not chain.get_id():
-                errstr = "All chains must have a chain ID."
-                raise ValueError(errstr)
+        # Raise an exception if there are no chain IDs but
+        # chain IDs were mandatory
+        if (index["chain_ids"] == "").any():
+            errstr = "All chains must have a chain ID."
+            raise ValueError(errstr)
     
     # Return the PDB file
     return pdb_file
@@ -1787,7 +3208,8 @@ def run_relax(step_features,
               step_opts,
               curr_pdb_file,
               settings,
-              n_proc):
+              n_proc,
+              events_file = None):
     """Prepare the input files and run the 'relax' step.
     """
 
@@ -1819,7 +3241,16 @@ def run_relax(step_features,
                     use_mpi = settings["mpi"]["usempi"],
                     mpi_exec = settings["mpi"]["mpiexec"],
                     mpi_args = settings["mpi"]["mpiargs"],
-                    mpi_n_proc = n_proc)
+                    mpi_n_proc = n_proc,
+                    retry_opts = settings["retry"],
+                    timeout = \
+                        settings["limits"]["timeout"]["relax"],
+                    max_memory = settings["limits"]["maxmemory"],
+                    scratch_opts = \
+                        scratch.get_scratch_options(settings,
+                                                    "relax"),
+                    events_file = events_file,
+                    event_data = {"step" : "relax"})
 
     # Return the process
     return process
@@ -1829,8 +3260,12 @@ def run_structure_selection(step_opts,
                             curr_pdb_file,
                             prev_opts,
                             prev_wd,
-                            run_dir):
+                            run_dir,
+                            wait_on = None):
     """Prepare the input files and run the 'structure_selection' step.
+
+    NB: 'wait_on' is passed to ensure it is finished before
+    the selection starts (because of the Dask task graph).
     """  
 
     # Get the input file, the file type and the selection criterion
@@ -1872,7 +3307,8 @@ def run_cartesian(step_features,
                   step,
                   step_opts,
                   curr_pdb_file,
-                  settings):
+                  settings,
+                  events_file = None):
     """Prepare the input files and run the 'cartesian' step.
     """
 
@@ -1908,6 +3344,42 @@ def run_cartesian(step_features,
             exec_path = exec_path,
             exec_suffix = exec_suffix)
 
+    # Get the directory where the results are cached, if any
+    cache_dir = settings["cache"]["cachedir"]
+
+    # If caching was requested
+    if cache_dir is not None:
+
+        # Get the key identifying the results in the cache
+        cache_key = \
+            caching.get_cache_key(options = opts_mut,
+                                  mut = mut,
+                                  executable = executable,
+                                  in_files = [curr_pdb_file])
+
+        # If the results can be restored from the cache (without
+        # overwriting the input files written for the current run)
+        if caching.restore_from_cache(\
+            cache_dir = cache_dir,
+            key = cache_key,
+            wd = mut_wd,
+            link = settings["cache"]["link"],
+            keep = (os.path.basename(flagsfile),
+                    os.path.basename(mutfile))):
+
+            # No process needs to be launched
+            process = get_cached_process()
+
+            # Check whether the restored run is complete
+            process["completed"] = \
+                get_completed_runs(processes = [process],
+                                   step_name = "cartesian",
+                                   step_opts = step_opts,
+                                   wds = [mut_wd])
+
+            # Return the process
+            return process
+
     # Launch the process
     process = \
         run_rosetta(executable = executable,
@@ -1917,7 +3389,416 @@ def run_cartesian(step_features,
                     use_mpi = settings["mpi"]["usempi"],
                     mpi_exec = settings["mpi"]["mpiexec"],
                     mpi_args = settings["mpi"]["mpiargs"],
-                    mpi_n_proc = 1)
+                    mpi_n_proc = 1,
+                    retry_opts = settings["retry"],
+                    timeout = \
+                        settings["limits"]["timeout"]["cartesian"],
+                    max_memory = settings["limits"]["maxmemory"],
+                    scratch_opts = \
+                        scratch.get_scratch_options(settings,
+                                                    "cartesian"),
+                    out_files = \
+                        get_run_output_files(step_name = "cartesian",
+                                             step_opts = step_opts),
+                    events_file = events_file,
+                    event_data = \
+                        {"step" : "cartesian",
+                         "n_muts" : \
+                            0 if is_option_true(step_opts, "wt_only") \
+                            else 1})
+
+    # Check whether the run is complete
+    process["completed"] = \
+        get_completed_runs(processes = [process],
+                           step_name = "cartesian",
+                           step_opts = step_opts,
+                           wds = [mut_wd])
+
+    # If caching was requested and the run is complete
+    if cache_dir is not None and process["completed"][mut_wd]:
+
+        # Store the results in the cache
+        caching.store_in_cache(cache_dir = cache_dir,
+                               key = cache_key,
+                               wd = mut_wd)
+
+    # Return the process
+    return process
+
+
+def get_run_batches(runs,
+                    batch_size):
+    """Group the runs of a ΔΔG step into batches that will be
+    run by a single Rosetta process each. Each run is a tuple
+    (mutation, working directory, options, whether the run can
+    be batched). Runs that cannot be batched form a batch on
+    their own.
+    """
+
+    # Create an empty list to store the batches
+    batches = []
+
+    # Create an empty list to store the batch being filled
+    curr_batch = []
+
+    # For each run
+    for run in runs:
+
+        # If the run cannot be batched or no batching was requested
+        if not run[3] or batch_size <= 1:
+
+            # The run forms a batch on its own
+            batches.append([run])
+            continue
+
+        # Add the run to the current batch
+        curr_batch.append(run)
+
+        # If the current batch is full
+        if len(curr_batch) == batch_size:
+
+            # Store it and start a new one
+            batches.append(curr_batch)
+            curr_batch = []
+
+    # Store the last batch, if not empty
+    if curr_batch:
+        batches.append(curr_batch)
+
+    # Return the batches
+    return batches
+
+
+def get_batch_dir_path(muts_wd):
+    """Get the path (relative to the step directory) to the
+    directory where a batch of mutations is run, given the
+    working directories of the mutations. The same mutations
+    always map to the same directory, so that resumed runs do
+    not get confused by leftovers of previous runs.
+    """
+
+    # Get a hash identifying the mutations in the batch
+    batch_hash = \
+        hashlib.sha1(\
+            "\n".join(os.path.abspath(wd) for wd in muts_wd).encode())
+
+    # Return the path to the batch directory
+    return os.path.join(BATCH_DIR_NAME,
+                        f"batch_{batch_hash.hexdigest()[:12]}")
+
+
+def get_mut_label_cartddg(label):
+    """Get the positions and residue types (one-letter codes)
+    of the single mutations in the label Rosetta gives to a
+    mutation in the output of a cartesian ΔΔG run (e.g.
+    'MUT_25ALA' or 'MUT_25ALA_30GLY'), as a set of (position,
+    residue type) tuples.
+    """
+
+    # Create an empty set to store the single mutations
+    smuts = set()
+
+    # For each position and residue type in the label
+    for numr, res in re.findall(r"(\d+)([A-Z]+)", label[4:]):
+
+        # Convert three-letter residue names to one-letter codes
+        if len(res) == 3:
+            try:
+                res = index_to_one(three_to_index(res))
+            except (KeyError, ValueError):
+                pass
+
+        # Add the single mutation
+        smuts.add((numr, res))
+
+    # Return the single mutations
+    return frozenset(smuts)
+
+
+def split_output_cartddg(ddg_out,
+                         muts,
+                         muts_ddg_out):
+    """Split the output file of a cartesian ΔΔG run performed
+    on several mutations into one output file per mutation.
+    Each block of the output is assigned to the mutation whose
+    positions and residue types match its MUT label, so that
+    mutations skipped or not reached by the run (i.e. because
+    it crashed) get no output file.
+    """
+
+    # Create an empty list to store the lines belonging to each
+    # block and the MUT label of each block
+    blocks = []
+    labels = []
+
+    # The status (WT or MUT label) of the last line read
+    last_status = None
+
+    with open(ddg_out, "r") as f:
+
+        # For each line
+        for line in f:
+
+            # Ignore lines not reporting scores
+            if not line.startswith("COMPLEX:"):
+                continue
+
+            # WT or MUT label
+            status = line.split()[2].rstrip(":")
+
+            # A new mutation starts if the wild-type rounds follow
+            # the mutant ones or if the mutant changes
+            if last_status is None \
+            or (status.startswith("WT") \
+                and last_status.startswith("MUT")) \
+            or (status.startswith("MUT") \
+                and last_status.startswith("MUT") \
+                and status != last_status):
+                blocks.append([])
+                labels.append(None)
+
+            # Add the line to the current block
+            blocks[-1].append(line)
+            last_status = status
+
+            # Store the MUT label of the block
+            if status.startswith("MUT"):
+                labels[-1] = status
+
+    # Group the blocks by the single mutations in their labels
+    # (blocks without mutant rounds cannot be assigned to any
+    # mutation), keeping their order
+    blocks_by_mut = {}
+    for label, lines in zip(labels, blocks):
+        if label is not None:
+            blocks_by_mut.setdefault(get_mut_label_cartddg(label),
+                                     []).append(lines)
+
+    # For each mutation and associated output file
+    for mut, mut_ddg_out in zip(muts, muts_ddg_out):
+
+        # Get the positions and residue types of its single
+        # mutations
+        smuts = frozenset((str(smut[NUMR]), smut[MUTR]) \
+                          for smut in mut[MUT])
+
+        # Get the first block not assigned yet matching them
+        # (if none, the mutation gets no output file)
+        mut_blocks = blocks_by_mut.get(smuts)
+        if not mut_blocks:
+            continue
+        lines = mut_blocks.pop(0)
+
+        # Write the output file (through a temporary file so that
+        # partially written outputs are never seen as complete)
+        tmp_ddg_out = f"{mut_ddg_out}.tmp"
+        with open(tmp_ddg_out, "w") as out:
+            out.writelines(lines)
+        os.replace(tmp_ddg_out, mut_ddg_out)
+
+
+def run_cartesian_batch(step_features,
+                        exec_path,
+                        exec_suffix,
+                        muts,
+                        muts_wd,
+                        batch_wd,
+                        step,
+                        step_opts,
+                        curr_pdb_file,
+                        settings,
+                        events_file = None):
+    """Prepare the input files and run the 'cartesian' step
+    on several mutations with a single Rosetta process, then
+    split the results into the mutations' directories.
+    """
+
+    # Get the keyword used to specify the mutfile
+    # in the configuration file
+    mutfile_key = get_option_key(options = step_opts,
+                                 option = "mutfile")
+
+    # Update the options (add input PDB file)
+    opts_mut = update_options(options = step_opts,
+                              pdb_file = curr_pdb_file)
+
+    # Get the executable needed to run the step
+    executable = \
+        get_rosetta_executable(\
+            exec_name = step_features["executable"],
+            exec_path = exec_path,
+            exec_suffix = exec_suffix)
+
+    # Get the directory where the results are cached, if any
+    cache_dir = settings["cache"]["cachedir"]
+
+    # Create empty lists to store the mutations (and their working
+    # directories and cache keys) that need to be run
+    run_muts = []
+    run_muts_wd = []
+    run_keys = []
+
+    # Create an empty list to store the working directories of
+    # the mutations restored from the cache
+    restored_muts_wd = []
+
+    # For each mutation and associated working directory
+    for mut, mut_wd in zip(muts, muts_wd):
+
+        # Write the mutfile and the flags file in the mutation's
+        # directory, as if the mutation was run on its own
+        write_mutfile(mut = mut,
+                      mutfile = os.path.join(mut_wd,
+                                             step_opts[mutfile_key]))
+        write_flagsfile(options = opts_mut,
+                        flagsfile = os.path.join(mut_wd,
+                                                 step["flagsfile"]))
+
+        # Set the cache key to None by default
+        cache_key = None
+
+        # If caching was requested
+        if cache_dir is not None:
+
+            # Get the key identifying the results in the cache
+            cache_key = \
+                caching.get_cache_key(options = opts_mut,
+                                      mut = mut,
+                                      executable = executable,
+                                      in_files = [curr_pdb_file])
+
+            # If the results can be restored from the cache
+            # (without overwriting the input files written for
+            # the current run), the mutation does not need to
+            # be run
+            if caching.restore_from_cache(\
+                cache_dir = cache_dir,
+                key = cache_key,
+                wd = mut_wd,
+                link = settings["cache"]["link"],
+                keep = (os.path.basename(step["flagsfile"]),
+                        os.path.basename(step_opts[mutfile_key]))):
+                restored_muts_wd.append(mut_wd)
+                continue
+
+        # Add the mutation to those that need to be run
+        run_muts.append(mut)
+        run_muts_wd.append(mut_wd)
+        run_keys.append(cache_key)
+
+    # Check whether the runs restored from the cache are complete
+    completed = \
+        get_completed_runs(processes = [get_cached_process()],
+                           step_name = "cartesian",
+                           step_opts = step_opts,
+                           wds = restored_muts_wd)
+
+    # If all mutations were restored from the cache,
+    # no process needs to be launched
+    if not run_muts:
+        process = get_cached_process()
+        process["completed"] = completed
+        return process
+
+    # Set the flags file and Rosetta output for the batch
+    flagsfile = os.path.join(batch_wd, step["flagsfile"])
+    output = os.path.join(batch_wd, step["output"])
+
+    # Write the mutfile containing all mutations to be run
+    write_mutfile(mut = run_muts,
+                  mutfile = os.path.join(batch_wd,
+                                         step_opts[mutfile_key]))
+
+    # Write the flags file for the batch
+    write_flagsfile(options = opts_mut,
+                    flagsfile = flagsfile)
+
+    # Get the names of the files the batch writes its results to
+    out_files = get_run_output_files(step_name = "cartesian",
+                                     step_opts = step_opts)
+
+    # Move away the outputs of a previous, interrupted run of the
+    # same batch, if any, so that the batch does not append to them
+    archive_crash_log(wd = batch_wd)
+    for out_file in out_files:
+        archive_file(path = os.path.join(batch_wd, out_file))
+
+    # Get the time limit of the step (it is set for a single
+    # mutation, so it is scaled by the number of mutations the
+    # batch runs)
+    timeout = settings["limits"]["timeout"]["cartesian"]
+    if timeout is not None:
+        timeout *= len(run_muts)
+
+    # Launch the process
+    process = \
+        run_rosetta(executable = executable,
+                    flagsfile = flagsfile,
+                    output = output,
+                    wd = batch_wd,
+                    use_mpi = settings["mpi"]["usempi"],
+                    mpi_exec = settings["mpi"]["mpiexec"],
+                    mpi_args = settings["mpi"]["mpiargs"],
+                    mpi_n_proc = 1,
+                    retry_opts = settings["retry"],
+                    timeout = timeout,
+                    max_memory = settings["limits"]["maxmemory"],
+                    scratch_opts = \
+                        scratch.get_scratch_options(settings,
+                                                    "cartesian"),
+                    out_files = out_files,
+                    events_file = events_file,
+                    event_data = {"step" : "cartesian",
+                                  "n_muts" : len(run_muts)})
+
+    # Get the name of the ΔΔG output file
+    ddg_out = get_ddg_output_file(step_name = "cartesian",
+                                  step_opts = step_opts)
+
+    # If the output file was written
+    if os.path.exists(os.path.join(batch_wd, ddg_out)):
+
+        # Split it into the mutations' directories
+        split_output_cartddg(\
+            ddg_out = os.path.join(batch_wd, ddg_out),
+            muts = run_muts,
+            muts_ddg_out = [os.path.join(wd, ddg_out) \
+                            for wd in run_muts_wd])
+
+    # Check whether the runs performed by the batch are complete
+    completed.update(\
+        get_completed_runs(processes = [process],
+                           step_name = "cartesian",
+                           step_opts = step_opts,
+                           wds = run_muts_wd))
+
+    # Get the path to the crash log of the batch
+    crash_log = os.path.join(batch_wd, ROSETTA_CRASH_LOG)
+
+    # For each mutation run and associated cache key
+    for mut_wd, cache_key in zip(run_muts_wd, run_keys):
+
+        # Copy the Rosetta output in the mutation's directory
+        if os.path.exists(output):
+            shutil.copy2(output, os.path.join(mut_wd, step["output"]))
+
+        # If the mutation was completed
+        if completed[mut_wd]:
+
+            # Store the results in the cache, if requested
+            if cache_key is not None:
+                caching.store_in_cache(cache_dir = cache_dir,
+                                       key = cache_key,
+                                       wd = mut_wd)
+
+        # If the mutation was not completed and the batch crashed,
+        # report the crash in the mutation's directory
+        elif os.path.exists(crash_log):
+            shutil.copy2(crash_log,
+                         os.path.join(mut_wd, ROSETTA_CRASH_LOG))
+
+    # Store which runs are complete with the process
+    process["completed"] = completed
 
     # Return the process
     return process
@@ -1931,7 +3812,8 @@ def run_flexddg(step_features,
                 step,
                 step_opts,
                 curr_pdb_file,
-                settings):
+                settings,
+                events_file = None):
     """Prepare the input files and run the 'flexddg' step.
     """
 
@@ -1974,6 +3856,50 @@ def run_flexddg(step_features,
             exec_path = exec_path,
             exec_suffix = exec_suffix)
 
+    # Get the directory where the results are cached, if any
+    cache_dir = settings["cache"]["cachedir"]
+
+    # If caching was requested
+    if cache_dir is not None:
+
+        # Get the path to the RosettaScript
+        rosetta_script = \
+            opts_mut[get_option_key(options = opts_mut,
+                                    option = "protocol")]
+
+        # Get the key identifying the results in the cache (the
+        # extraction of the structures is part of the results)
+        cache_key = \
+            caching.get_cache_key(\
+                options = opts_mut,
+                mut = mut,
+                executable = executable,
+                in_files = [curr_pdb_file, rosetta_script],
+                extra = step["extract_structures"])
+
+        # If the results can be restored from the cache (without
+        # overwriting the input files written for the current run)
+        if caching.restore_from_cache(\
+            cache_dir = cache_dir,
+            key = cache_key,
+            wd = mut_wd,
+            link = settings["cache"]["link"],
+            keep = (os.path.basename(flagsfile),
+                    os.path.basename(resfile))):
+
+            # No process needs to be launched
+            process = get_cached_process()
+
+            # Check whether the restored run is complete
+            process["completed"] = \
+                get_completed_runs(processes = [process],
+                                   step_name = "flexddg",
+                                   step_opts = step_opts,
+                                   wds = [mut_wd])
+
+            # Return the process
+            return process
+
     # Launch the process
     process = \
         run_rosetta(executable = executable,
@@ -1983,7 +3909,20 @@ def run_flexddg(step_features,
                     use_mpi = settings["mpi"]["usempi"],
                     mpi_exec = settings["mpi"]["mpiexec"],
                     mpi_args = settings["mpi"]["mpiargs"],
-                    mpi_n_proc = 1)
+                    mpi_n_proc = 1,
+                    retry_opts = settings["retry"],
+                    timeout = \
+                        settings["limits"]["timeout"]["flexddg"],
+                    max_memory = settings["limits"]["maxmemory"],
+                    scratch_opts = \
+                        scratch.get_scratch_options(settings,
+                                                    "flexddg"),
+                    out_files = \
+                        get_run_output_files(step_name = "flexddg",
+                                             step_opts = step_opts),
+                    events_file = events_file,
+                    event_data = {"step" : "flexddg",
+                                  "n_muts" : 1})
 
     # Set the calculation as the last process performed
     last_process = process
@@ -2069,7 +4008,17 @@ def run_flexddg(step_features,
                             use_mpi = settings["mpi"]["usempi"],
                             mpi_exec = settings["mpi"]["mpiexec"],
                             mpi_args = settings["mpi"]["mpiargs"],
-                            mpi_n_proc = 1)
+                            mpi_n_proc = 1,
+                            retry_opts = settings["retry"],
+                            timeout = \
+                                settings["limits"]["timeout"][\
+                                    "flexddg_extract"],
+                            max_memory = settings["limits"]["maxmemory"],
+                            scratch_opts = \
+                                scratch.get_scratch_options(settings,
+                                                            "flexddg_extract"),
+                            events_file = events_file,
+                            event_data = {"step" : "flexddg_extract"})
 
             # Set the extraction as the last process performed
             last_process = process_extract
@@ -2078,18 +4027,38 @@ def run_flexddg(step_features,
             # have now been extracted
             is_struct_extracted = True
 
+            # If the extraction was superseded by a duplicate of the
+            # run, the structures may have been renamed already
+            if process_extract.get("superseded"):
+                is_struct_extracted, is_struct_renamed = \
+                    check_structures_extraction(wd = mut_wd)
+
         
         # If the structures have been extracted but not renamed
         if (is_struct_extracted) and (not is_struct_renamed):
 
-            # Try to rename the structures
-            process_rename = \
-                rename_structures_flexddg(\
-                    path = mut_wd,
-                    r_script_options = r_script_options)
-
-            # Set the renaming as the last process performed
-            last_process = process_rename
+            # Try to rename the structures (the renaming does not
+            # launch any process, so it does not replace the last
+            # process performed)
+            rename_structures_flexddg(\
+                path = mut_wd,
+                r_script_options = r_script_options)
+
+    # Check whether the run is complete (the extraction, if
+    # performed, must have exited cleanly, too)
+    last_process["completed"] = \
+        get_completed_runs(processes = [process, last_process],
+                           step_name = "flexddg",
+                           step_opts = step_opts,
+                           wds = [mut_wd])
+
+    # If caching was requested and the run is complete
+    if cache_dir is not None and last_process["completed"][mut_wd]:
+
+        # Store the results in the cache
+        caching.store_in_cache(cache_dir = cache_dir,
+                               key = cache_key,
+                               wd = mut_wd)
 
     # Return the last process
-    return last_process
\ No newline at end of file
+    return last_process
@@ -1,15 +1,15 @@
 # coding: utf-8
-from Bio import PDB
-from Bio.PDB.Polypeptide import three_to_one
+from RosettaDDGPrediction import residueindex
 import sys
 
-parser = PDB.PDBParser()
-s = parser.get_structure('test', sys.argv[1])
-
-m = s[0]
+index = residueindex.get_residue_index(sys.argv[1])
+one_letter = residueindex.get_one_letter_codes(index)
 
 with open('poslist.txt', 'w') as fh:
-    for c in m.get_chains():
-        for r in c.get_residues():
-            fh.write(f"{c.id}.{three_to_one(r.resname)}.{str(r.id[1])} {c.id}\n")
-
+    for c, res, resnum in zip(index["chain"].tolist(),
+                              one_letter.tolist(),
+                              index["resnum"].tolist()):
+        # skip residues that are not amino acids
+        if res == "X":
+            continue
+        fh.write(f"{c}.{res}.{resnum} {c}\n")
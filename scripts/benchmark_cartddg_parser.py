@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Benchmark the vectorized parser of cartesian_ddg output files
+# (aggregation.parse_outputs_cartddg) against the line-by-line
+# parser it replaced, on synthetic .ddg files, and check that
+# both return the same data.
+#
+# usage: python benchmark_cartddg_parser.py [-n 5000] [-r 3]
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from RosettaDDGPrediction import aggregation
+from RosettaDDGPrediction.defaults import ROSETTA_DF_COLS
+
+# energy terms of the ref2015_cart scoring function
+TERMS = ["fa_atr", "fa_rep", "fa_sol", "fa_intra_rep",
+         "fa_intra_sol_xover4", "lk_ball_wtd", "fa_elec",
+         "hbond_sr_bb", "hbond_lr_bb", "hbond_bb_sc", "hbond_sc",
+         "dslf_fa13", "omega", "fa_dun", "p_aa_pp", "yhh_planarity",
+         "ref", "rama_prepro", "cart_bonded"]
+
+
+def write_ddg_file(path, n_rounds):
+    # write a file with the same layout as cartesian_ddg outputs
+    with open(path, "w") as f:
+        for state in ("WT_", "MUT_25A"):
+            for r in range(1, n_rounds + 1):
+                vals = "".join(f" {t}: {random.uniform(-10, 10):.3f}"
+                               for t in TERMS)
+                f.write(f"COMPLEX:   Round{r}: {state}:  "
+                        f"{random.uniform(-500, -400):.3f} {vals}\n")
+
+
+def parse_by_line(ddg_out):
+    # the line-by-line parser (the previous implementation of
+    # aggregation.parse_output_cartddg)
+    wt_dgs, mut_dgs = aggregation.read_output_cartddg(ddg_out, TERMS)
+    n_structs = [str(i) for i in range(1, len(wt_dgs) + 1)]
+    df_wt = pd.DataFrame(wt_dgs)
+    df_wt[ROSETTA_DF_COLS["state"]] = "wt"
+    df_wt[ROSETTA_DF_COLS["struct_num"]] = n_structs
+    df_wt[ROSETTA_DF_COLS["scf_name"]] = "ref2015_cart"
+    df_mut = pd.DataFrame(mut_dgs)
+    df_mut[ROSETTA_DF_COLS["state"]] = "mut"
+    df_mut[ROSETTA_DF_COLS["struct_num"]] = n_structs
+    df_mut[ROSETTA_DF_COLS["scf_name"]] = "ref2015_cart"
+    return pd.concat([df_wt, df_mut]).reset_index(drop = True)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--nfiles", type = int, default = 5000)
+parser.add_argument("-r", "--nrounds", type = int, default = 3)
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+
+    # create the files
+    files = [os.path.join(tmp_dir, f"mutation{i}.ddg")
+             for i in range(args.nfiles)]
+    for f in files:
+        write_ddg_file(f, args.nrounds)
+
+    # line-by-line parser, one file at a time
+    start = time.perf_counter()
+    old = [parse_by_line(f) for f in files]
+    t_old = time.perf_counter() - start
+
+    # vectorized parser, all files in one call
+    start = time.perf_counter()
+    new = aggregation.parse_outputs_cartddg(files, TERMS, "ref2015_cart")
+    t_new = time.perf_counter() - start
+
+    # check that the outputs are identical
+    for f, old_df in zip(files, old):
+        pd.testing.assert_frame_equal(
+            new.loc[f].reset_index(drop = True), old_df)
+
+print(f"{args.nfiles} files, {args.nrounds} rounds per state")
+print(f"line-by-line parser: {t_old:.3f} s")
+print(f"vectorized parser:   {t_new:.3f} s ({t_old / t_new:.1f}x faster)")
+print("outputs are identical")
@@ -63,6 +63,7 @@ entry_points = {
         "rosetta_ddg_check_run = RosettaDDGPrediction.rosetta_ddg_check_run:main",
         "rosetta_ddg_aggregate = RosettaDDGPrediction.rosetta_ddg_aggregate:main",
         "rosetta_ddg_plot = RosettaDDGPrediction.rosetta_ddg_plot:main",
+        "rosetta_ddg_poslist = RosettaDDGPrediction.rosetta_ddg_poslist:main",
     ],
 }
 
@@ -0,0 +1,83 @@
+# Fixtures writing small Rosetta outputs (cartesian_ddg .ddg files
+# and Flex ddG .db3 databases) to be used by the tests.
+
+import sqlite3
+
+import pytest
+
+
+# energy terms written in the synthetic outputs
+TERMS = ["fa_atr", "fa_rep", "fa_sol", "fa_elec", "cart_bonded"]
+
+# states scored by the Flex ddG protocol
+FLEXDDG_STATES = ["bound_wt", "unbound_wt", "bound_mut", "unbound_mut"]
+
+
+def ddg_lines(label, n_rounds, wt = True, mut = True, start = 0.0):
+    # lines written by cartesian_ddg for a mutation ('label' is
+    # the MUT label, e.g. 'MUT_25ALA')
+    lines = []
+    for state, run in (("WT_", wt), (label, mut)):
+        if not run:
+            continue
+        for r in range(1, n_rounds + 1):
+            terms = "".join(f" {t}: {start + r + i:.3f}"
+                            for i, t in enumerate(TERMS))
+            lines.append(f"COMPLEX:   Round{r}: {state}:  "
+                         f"{start - r:.3f} {terms}\n")
+    return lines
+
+
+@pytest.fixture
+def write_ddg(tmp_path):
+    # write a .ddg file made of the given lines
+    def write(lines, name = "mutation.ddg"):
+        path = tmp_path / name
+        path.write_text("".join(lines))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def write_db3(tmp_path):
+    # write a Flex ddG .db3 database with 'n_steps' backrub steps,
+    # with the structures numbered consecutively for each step,
+    # batch (state) after batch. 'last_states' are the states
+    # scored at the last step (all of them by default)
+    def write(n_steps, last_states = None, name = "ddg.db3",
+              terms = TERMS):
+        path = tmp_path / name
+        con = sqlite3.connect(path)
+        con.executescript(
+            "CREATE TABLE batches(batch_id INTEGER PRIMARY KEY, "
+            "name TEXT);"
+            "CREATE TABLE structure_scores(batch_id INTEGER, "
+            "struct_id INTEGER, score_type_id INTEGER, "
+            "score_value REAL);"
+            "CREATE TABLE score_function_method_options("
+            "batch_id INTEGER PRIMARY KEY, score_function_name TEXT);"
+            "CREATE TABLE score_types(batch_id INTEGER, "
+            "score_type_id INTEGER, score_type_name TEXT);")
+        types = ["total_score"] + list(terms)
+        for b, state in enumerate(FLEXDDG_STATES, 1):
+            con.execute("INSERT INTO batches VALUES (?, ?)",
+                        (b, f"{state}_dbreport"))
+            con.execute("INSERT INTO score_function_method_options "
+                        "VALUES (?, ?)", (b, "ref2015"))
+            con.executemany("INSERT INTO score_types VALUES (?, ?, ?)",
+                            [(b, t, n) for t, n in enumerate(types, 1)])
+        struct_id = 0
+        for step in range(1, n_steps + 1):
+            for b, state in enumerate(FLEXDDG_STATES, 1):
+                struct_id += 1
+                if step == n_steps and last_states is not None \
+                and state not in last_states:
+                    continue
+                con.executemany(
+                    "INSERT INTO structure_scores VALUES (?, ?, ?, ?)",
+                    [(b, struct_id, t, step * 10.0 + b + t / 100)
+                     for t in range(1, len(types) + 1)])
+        con.commit()
+        con.close()
+        return str(path)
+    return write
@@ -0,0 +1,141 @@
+# Tests for the asyncio engine (asyncengine.AsyncioClient), which
+# runs the tasks of a run and their Rosetta processes on the local
+# node without Dask workers.
+
+import collections
+import json
+import os
+import threading
+
+import pytest
+
+from RosettaDDGPrediction import asyncengine, backends, util
+
+
+@pytest.fixture
+def client():
+    client = asyncengine.AsyncioClient(n_proc = 2)
+    yield client
+    client.close()
+
+
+def make_executable(tmp_path, script, name = "rosetta"):
+    # write a shell script to be run as '<script> @ <flagsfile>'
+    path = tmp_path / name
+    path.write_text(f"#!/bin/sh\n{script}\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def run_rosetta(wd, executable, **kwargs):
+    return util.run_rosetta(executable = executable,
+                            flagsfile = "flags.txt",
+                            output = os.path.join(wd, "rosetta.out"),
+                            wd = wd,
+                            use_mpi = False,
+                            mpi_exec = None,
+                            mpi_args = [],
+                            mpi_n_proc = 1,
+                            **kwargs)
+
+
+def test_get_client():
+    settings = {"backend" : {"type" : "asyncio"},
+                "resources" : {"useresources" : False}}
+    client, cluster = backends.get_client(settings = settings,
+                                          n_proc = 3)
+    assert isinstance(client, asyncengine.AsyncioClient)
+    assert client.n_cores == 3
+    assert cluster is None
+    client.close()
+
+
+def test_dependencies(client):
+    # futures among the arguments, also inside containers and
+    # named tuples, are replaced by their results
+    Pair = collections.namedtuple("Pair", ["first", "second"])
+    a = client.submit(lambda: 1)
+    b = client.submit(lambda x: x + 1, a)
+    c = client.submit(lambda pair, rest: (pair, rest),
+                      Pair(a, b),
+                      rest = {"list" : [a, b]})
+    assert client.gather(c) == (Pair(1, 2), {"list" : [1, 2]})
+
+
+def test_priority():
+    # with a single thread, the ready tasks are run highest
+    # priority first
+    client = asyncengine.AsyncioClient(n_proc = 1, n_threads = 1)
+    started, order = threading.Event(), []
+    blocker = client.submit(started.wait)
+    futures = [client.submit(order.append, p, priority = p)
+               for p in (0, 2, 1)]
+    started.set()
+    client.gather([blocker] + futures)
+    assert order == [2, 1, 0]
+    client.close()
+
+
+def test_errors(client):
+    future = client.submit(lambda: 1 / 0)
+    backends.wait([future])
+    assert future.status == "error"
+    with pytest.raises(ZeroDivisionError):
+        client.gather([future])
+
+
+def test_as_completed(client):
+    futures = [client.submit(lambda x: x, i) for i in range(5)]
+    assert sorted(f.result() for f in backends.as_completed(futures)) \
+           == list(range(5))
+
+
+def test_run_rosetta(client, tmp_path):
+    # the process is reaped by the engine, and the resources it
+    # used are recorded
+    wd = str(tmp_path / "run")
+    events_file = str(tmp_path / "events.jsonl")
+    executable = make_executable(tmp_path, "echo done")
+    process = client.gather(client.submit(run_rosetta, wd, executable,
+                                          events_file = events_file))
+    assert process["returncode"] == 0
+    assert process["failure"] is None
+    with open(os.path.join(wd, "rosetta.out")) as f:
+        assert f.read() == "done\n"
+    with open(events_file) as f:
+        events = [json.loads(line) for line in f]
+    finished = [e for e in events if e["event"] == "finished"]
+    assert len(finished) == 1
+    assert finished[0]["task"] is not None
+    assert finished[0]["cpu"] is not None
+    assert finished[0]["maxrss"] > 0
+
+
+def test_cores_limit(client, tmp_path):
+    # no more processes than cores run at the same time
+    counter = tmp_path / "running"
+    counter.mkdir()
+    executable = \
+        make_executable(tmp_path,
+                        f"touch {counter}/$$\n"
+                        f"ls {counter} | wc -l >> {tmp_path}/counts\n"
+                        f"sleep 0.2\n"
+                        f"rm {counter}/$$")
+    futures = [client.submit(run_rosetta, str(tmp_path / f"run{i}"),
+                             executable)
+               for i in range(6)]
+    assert all(p["returncode"] == 0 for p in client.gather(futures))
+    with open(tmp_path / "counts") as f:
+        assert max(int(line) for line in f) <= 2
+
+
+def test_timeout(client, tmp_path):
+    # the process and the processes it spawned are killed once the
+    # time limit is reached
+    wd = str(tmp_path / "run")
+    executable = make_executable(tmp_path, "sleep 60 &\nwait")
+    process = client.gather(client.submit(run_rosetta, wd, executable,
+                                          timeout = 0.5))
+    assert process["killed"] == "timeout"
+    assert process["failure"] == "timeout"
+    assert process["elapsed"] < 30
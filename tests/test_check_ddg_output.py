@@ -0,0 +1,87 @@
+# Tests for util.check_ddg_output on complete and truncated
+# outputs of the cartesian and flexddg steps.
+
+from conftest import ddg_lines
+from RosettaDDGPrediction import util
+
+
+CARTESIAN_OPTS = {"-ddg:iterations" : 3,
+                  "-ddg:out" : "mutation.ddg"}
+
+FLEXDDG_OPTS = {"-parser:script_vars" : {"backrubntrials" : 35000,
+                                         "backrubtrajstride" : 7000,
+                                         "ddgdbfile" : "ddg.db3"}}
+
+
+def check(step_name, out_file, step_opts):
+    return util.check_ddg_output(step_name = step_name,
+                                 out_file = out_file,
+                                 step_opts = step_opts)
+
+
+def test_cartesian_complete(write_ddg):
+    out = write_ddg(ddg_lines("MUT_25ALA", 3))
+    assert check("cartesian", out, CARTESIAN_OPTS)
+
+
+def test_cartesian_missing_mutant_rounds(write_ddg):
+    # the run was killed after the first round of the mutant
+    out = write_ddg(ddg_lines("MUT_25ALA", 3)[:4])
+    assert not check("cartesian", out, CARTESIAN_OPTS)
+
+
+def test_cartesian_wild_type_only(write_ddg):
+    # the run was killed before the mutant was modelled
+    out = write_ddg(ddg_lines("MUT_25ALA", 3, mut = False))
+    assert not check("cartesian", out, CARTESIAN_OPTS)
+    # unless only the wild-type was requested
+    assert check("cartesian", out,
+                 {**CARTESIAN_OPTS, "-ddg:wt_only" : True})
+
+
+def test_cartesian_truncated_line(write_ddg):
+    # the run was killed while writing the last round
+    lines = ddg_lines("MUT_25ALA", 3)
+    out = write_ddg(lines[:-1] + [lines[-1][:40]])
+    assert not check("cartesian", out, CARTESIAN_OPTS)
+
+
+def test_cartesian_empty_or_missing(write_ddg, tmp_path):
+    assert not check("cartesian", write_ddg([]), CARTESIAN_OPTS)
+    assert not check("cartesian", str(tmp_path / "missing.ddg"),
+                     CARTESIAN_OPTS)
+
+
+def test_flexddg_complete(write_db3):
+    out = write_db3(n_steps = 5)
+    assert check("flexddg", out, FLEXDDG_OPTS)
+    # the default trajectory (35000 trials, stride 7000) is used
+    # if it is not set in the options
+    assert check("flexddg", out, {})
+
+
+def test_flexddg_truncated_trajectory(write_db3):
+    # all states are scored at every stride, so a run killed
+    # partway through the trajectory looks complete at its last
+    # step
+    out = write_db3(n_steps = 2)
+    assert not check("flexddg", out, FLEXDDG_OPTS)
+    # unless the trajectory was meant to be that short
+    short_opts = \
+        {"-parser:script_vars" : {"backrubntrials" : 14000,
+                                  "backrubtrajstride" : 7000}}
+    assert check("flexddg", out, short_opts)
+
+
+def test_flexddg_missing_final_states(write_db3):
+    # the run was killed while scoring the last step
+    out = write_db3(n_steps = 5,
+                    last_states = ["bound_wt", "unbound_wt"])
+    assert not check("flexddg", out, FLEXDDG_OPTS)
+
+
+def test_flexddg_not_a_database(write_ddg, tmp_path):
+    out = write_ddg(["not a database\n"], name = "ddg.db3")
+    assert not check("flexddg", out, FLEXDDG_OPTS)
+    assert not check("flexddg", str(tmp_path / "missing.db3"),
+                     FLEXDDG_OPTS)
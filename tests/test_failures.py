@@ -0,0 +1,83 @@
+# Tests for failures.classify_failure, which classifies failed
+# Rosetta runs from their return code, crash log and output.
+
+import pytest
+
+from RosettaDDGPrediction import failures
+from RosettaDDGPrediction.defaults import ROSETTA_CRASH_LOG
+
+
+def classify(tmp_path, returncode, output = "", crash_log = None,
+             killed = None):
+    out_file = tmp_path / "rosetta.out"
+    out_file.write_text(output)
+    if crash_log is not None:
+        (tmp_path / ROSETTA_CRASH_LOG).write_text(crash_log)
+    return failures.classify_failure(returncode = returncode,
+                                     wd = str(tmp_path),
+                                     output = str(out_file),
+                                     killed = killed)
+
+
+def test_success(tmp_path):
+    assert classify(tmp_path, 0, output = "protocol finished\n") is None
+
+
+def test_success_with_crash_log(tmp_path):
+    # Rosetta may exit with 0 after writing a crash log
+    assert classify(tmp_path, 0, crash_log = "ERROR: something\n") \
+           == "unknown"
+
+
+@pytest.mark.parametrize("killed, failure",
+                         [("timeout", "timeout"), ("oom", "oom"),
+                          ("supersede", "cancelled"),
+                          ("cancel", "cancelled"), (None, "signal")])
+def test_kill_reasons(tmp_path, killed, failure):
+    # SIGKILL is sent for running past the time limit, by the
+    # kernel for running out of memory, on request and by the
+    # queuing systems, so only the reason it was sent for tells
+    # the failures apart
+    assert classify(tmp_path, -9, killed = killed) == failure
+    assert classify(tmp_path, 137, killed = killed) == failure
+
+
+@pytest.mark.parametrize("returncode, failure",
+                         [(-11, "segfault"), (139, "segfault"),
+                          (-15, "signal"), (143, "signal"),
+                          (1, "unknown")])
+def test_return_codes(tmp_path, returncode, failure):
+    # signals are reported either as negative return codes or, by
+    # MPI launchers, as 128 + the signal number
+    assert classify(tmp_path, returncode) == failure
+
+
+@pytest.mark.parametrize("text, failure",
+                         [("terminate called after throwing an "
+                           "instance of 'std::bad_alloc'", "oom"),
+                          ("Segmentation fault (core dumped)",
+                           "segfault"),
+                          ("ERROR: Cannot open file 'input.pdb'",
+                           "input"),
+                          ("ERROR: Option matching -ddg:foo not found "
+                           "in command line top-level context", "input"),
+                          ("ERROR: Assertion failed", "unknown"),
+                          # messages mentioning missing files outside
+                          # of Rosetta errors are not input errors
+                          ("core.io: no such file 'x.params', using "
+                           "defaults", "unknown"),
+                          ("protocols.relax: structure does not exist "
+                           "yet, creating it", "unknown")])
+def test_output_patterns(tmp_path, text, failure):
+    assert classify(tmp_path, 1, output = f"core.init: ...\n{text}\n") \
+           == failure
+
+
+def test_crash_log_patterns(tmp_path):
+    crash_log = \
+        "[START_CRASH_REPORT]\n" \
+        "[START_MESSAGE]\n" \
+        "[ ERROR ] UtilityExitException\n" \
+        "ERROR: Error: can't read sequence!\n" \
+        "[END_MESSAGE]\n"
+    assert classify(tmp_path, 1, crash_log = crash_log) == "input"
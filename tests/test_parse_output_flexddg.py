@@ -0,0 +1,91 @@
+# Tests for aggregation.parse_output_flexddg, which pivots and
+# filters the scores in SQL, against the pandas pivot it replaced.
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import TERMS
+from RosettaDDGPrediction import aggregation
+from RosettaDDGPrediction.defaults import ROSETTA_DF_COLS
+
+
+def parse_with_pandas(db3_out, traj_stride, struct_num, scf_name):
+    # the previous implementation, which read all the scores and
+    # pivoted them with pandas
+    con = sqlite3.connect(db3_out)
+    n_batches = con.execute("SELECT max(batch_id) FROM batches")\
+                   .fetchone()[0]
+    df = pd.read_sql_query(
+        "SELECT batches.name, structure_scores.struct_id, "
+        "score_types.score_type_name, structure_scores.score_value, "
+        "score_function_method_options.score_function_name "
+        "FROM structure_scores "
+        "INNER JOIN batches "
+        "ON batches.batch_id=structure_scores.batch_id "
+        "INNER JOIN score_function_method_options "
+        "ON score_function_method_options.batch_id=batches.batch_id "
+        "INNER JOIN score_types "
+        "ON score_types.batch_id=structure_scores.batch_id "
+        "AND score_types.score_type_id=structure_scores.score_type_id",
+        con)
+    con.close()
+    df[ROSETTA_DF_COLS["b_steps"]] = \
+        df[ROSETTA_DF_COLS["struct_id"]].apply(
+            lambda x: traj_stride * (1 + (int(x - 1) // n_batches)))
+    df[ROSETTA_DF_COLS["state"]] = \
+        df[ROSETTA_DF_COLS["name"]].str.replace("_dbreport$", "",
+                                                regex = True)
+    df = df.pivot_table(index = [ROSETTA_DF_COLS["state"],
+                                 ROSETTA_DF_COLS["b_steps"],
+                                 ROSETTA_DF_COLS["scf_name"]],
+                        columns = ROSETTA_DF_COLS["sc_type"],
+                        values = ROSETTA_DF_COLS["sc_value"])\
+           .reset_index()
+    df[ROSETTA_DF_COLS["struct_num"]] = struct_num
+    df[ROSETTA_DF_COLS["scf_name"]] = scf_name
+    df.columns.names = [None]
+    return df
+
+
+def normalize(df):
+    # sort rows and columns, so that only the contents are compared
+    return df.sort_values([ROSETTA_DF_COLS["state"],
+                           ROSETTA_DF_COLS["b_steps"]])\
+             .reset_index(drop = True)\
+             .sort_index(axis = 1)
+
+
+@pytest.mark.parametrize("n_steps", [1, 3, 5])
+def test_same_as_pandas_pivot(write_db3, n_steps):
+    db3_out = write_db3(n_steps = n_steps)
+    new = aggregation.parse_output_flexddg(db3_out = db3_out,
+                                           traj_stride = 7000,
+                                           struct_num = 1,
+                                           scf_name = "ref2015")
+    old = parse_with_pandas(db3_out, 7000, 1, "ref2015")
+    # only the structures at the end of the trajectory are kept
+    b_steps_col = ROSETTA_DF_COLS["b_steps"]
+    old = old[old[b_steps_col] == old[b_steps_col].max()]
+    assert (new[b_steps_col] == 7000 * n_steps).all()
+    pd.testing.assert_frame_equal(normalize(new), normalize(old),
+                                  check_dtype = False)
+
+
+def test_selected_contributions(write_db3):
+    db3_out = write_db3(n_steps = 3)
+    contributions = TERMS[:2]
+    new = aggregation.parse_output_flexddg(\
+            db3_out = db3_out,
+            traj_stride = 7000,
+            struct_num = 1,
+            scf_name = "ref2015",
+            list_contributions = contributions)
+    old = parse_with_pandas(db3_out, 7000, 1, "ref2015")
+    b_steps_col = ROSETTA_DF_COLS["b_steps"]
+    old = old[old[b_steps_col] == old[b_steps_col].max()]
+    # only the contributions requested and the total score are kept
+    old = old.drop(columns = TERMS[2:])
+    pd.testing.assert_frame_equal(normalize(new), normalize(old),
+                                  check_dtype = False)
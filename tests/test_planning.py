@@ -0,0 +1,47 @@
+# Tests for planning._get_critical_path, which finds the longest
+# chain of dependent tasks in the plan of a run.
+
+from RosettaDDGPrediction import planning
+
+
+def make_task(task_id, depends_on, cost, estimated_s):
+    return {"id" : task_id,
+            "depends_on" : depends_on,
+            "cost" : cost,
+            "estimated_s" : estimated_s}
+
+
+def make_tasks(relax_s = None, ddg_s = (None, None)):
+    ddg_ids = ["cartesian:a", "cartesian:b"]
+    return [make_task("relax", [], 1000.0, relax_s),
+            make_task("structure_selection", ["relax"], None, 0),
+            make_task(ddg_ids[0], ["structure_selection"], 20.0,
+                      ddg_s[0]),
+            make_task(ddg_ids[1], ["structure_selection"], 30.0,
+                      ddg_s[1])]
+
+
+def test_critical_path_without_timings():
+    # without past timings, the chain is found from the relative
+    # costs of the tasks and goes from the first to the last step
+    path, length = planning._get_critical_path(make_tasks())
+    assert path == ["relax", "structure_selection", "cartesian:b"]
+    assert length is None
+
+
+def test_critical_path_with_timings():
+    # the estimated times take precedence over the costs
+    path, length = \
+        planning._get_critical_path(make_tasks(relax_s = 600,
+                                               ddg_s = (90, 60)))
+    assert path == ["relax", "structure_selection", "cartesian:a"]
+    assert length == 690
+
+
+def test_critical_path_partial_timings():
+    # if only some tasks could be timed, the costs are used for all
+    path, length = \
+        planning._get_critical_path(make_tasks(relax_s = 600,
+                                               ddg_s = (90, None)))
+    assert path == ["relax", "structure_selection", "cartesian:b"]
+    assert length is None
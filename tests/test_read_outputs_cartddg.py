@@ -0,0 +1,45 @@
+# Tests for aggregation.read_outputs_cartddg, which reads several
+# cartesian_ddg output files as a single table.
+
+import numpy as np
+import pytest
+
+from conftest import TERMS, ddg_lines
+from RosettaDDGPrediction import aggregation
+
+
+def test_same_as_line_by_line(write_ddg):
+    ddg_outs = [write_ddg(ddg_lines("MUT_25ALA", 3), name = "a.ddg"),
+                write_ddg(ddg_lines("MUT_30GLY", 2, start = 100),
+                          name = "b.ddg")]
+    dgs, cols = aggregation.read_outputs_cartddg(ddg_outs, TERMS)
+    dgs_by_line, cols_by_line = \
+        aggregation._read_outputs_cartddg_by_line(ddg_outs, TERMS)
+    assert cols == cols_by_line
+    for (wt, mut), (wt_by_line, mut_by_line) in zip(dgs, dgs_by_line):
+        np.testing.assert_array_equal(wt, wt_by_line)
+        np.testing.assert_array_equal(mut, mut_by_line)
+
+
+def test_different_contributions(write_ddg):
+    # files reporting different numbers of contributions are read
+    # line by line
+    lines = ddg_lines("MUT_30GLY", 2)
+    short_lines = [" ".join(line.split()[:-2]) + "\n" for line in lines]
+    ddg_outs = [write_ddg(ddg_lines("MUT_25ALA", 2), name = "a.ddg"),
+                write_ddg(short_lines, name = "b.ddg")]
+    dgs, cols = aggregation.read_outputs_cartddg(ddg_outs, TERMS)
+    assert cols == TERMS + ["total_score"]
+    assert np.isnan(dgs[1][0][:, len(TERMS) - 1]).all()
+
+
+def test_short_and_long_line(write_ddg):
+    # a truncated line followed by a line with extra fields has,
+    # overall, the right number of fields, but must not be read
+    lines = ddg_lines("MUT_25ALA", 2)
+    tokens = lines[1].split()
+    lines[1] = " ".join(tokens[:-2]) + "\n"
+    lines[2] = lines[2].rstrip("\n") + " " + " ".join(tokens[-2:]) + "\n"
+    ddg_out = write_ddg(["header\n"] + lines, name = "bad.ddg")
+    with pytest.raises(ValueError, match = r"Line 3 of .*bad\.ddg"):
+        aggregation.read_outputs_cartddg([ddg_out], TERMS)
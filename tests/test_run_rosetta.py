@@ -0,0 +1,141 @@
+# Tests for util.run_rosetta, running small shell scripts in place
+# of the Rosetta executables.
+
+import os
+
+from RosettaDDGPrediction import util
+from RosettaDDGPrediction.defaults import (
+    CHAIN,
+    MUT,
+    MUTR,
+    NUMR,
+    WTR
+)
+
+
+def make_executable(tmp_path, script, name = "rosetta"):
+    # write a shell script to be run as '<script> @ <flagsfile>'
+    path = tmp_path / name
+    path.write_text(f"#!/bin/sh\n{script}\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def run(executable, wd, **kwargs):
+    return util.run_rosetta(executable = executable,
+                            flagsfile = "flags.txt",
+                            output = os.path.join(wd, "rosetta.out"),
+                            wd = wd,
+                            use_mpi = False,
+                            mpi_exec = None,
+                            mpi_args = [],
+                            mpi_n_proc = 1,
+                            **kwargs)
+
+
+def test_retry_archives_outputs(tmp_path):
+    # the first attempt writes part of the output and dies (as if
+    # killed by the queuing system), the second one completes
+    wd = str(tmp_path / "run")
+    executable = \
+        make_executable(tmp_path,
+                        "echo round >> mutation.ddg\n"
+                        "if [ ! -e attempted ]; then\n"
+                        "  touch attempted; kill -9 $$\n"
+                        "fi\n"
+                        "echo round >> mutation.ddg")
+    process = run(executable, wd,
+                  retry_opts = {"maxretries" : 1,
+                                "retryon" : ["signal"],
+                                "backoff" : 0,
+                                "backofffactor" : 1},
+                  out_files = ["mutation.ddg"])
+    assert process["returncode"] == 0
+    assert process["failure"] is None
+    assert process["attempts"] == 2
+    # the second attempt did not append to the output of the first
+    with open(os.path.join(wd, "mutation.ddg")) as f:
+        assert f.read() == "round\nround\n"
+    with open(os.path.join(wd, "mutation.ddg.1")) as f:
+        assert f.read() == "round\n"
+
+
+def test_no_retries_by_default(tmp_path):
+    wd = str(tmp_path / "run")
+    executable = make_executable(tmp_path, "kill -9 $$")
+    process = run(executable, wd)
+    assert process["failure"] == "signal"
+    assert process["attempts"] == 1
+
+
+def test_kernel_oom_kill(tmp_path, monkeypatch):
+    # a SIGKILL is reported as running out of memory only if the
+    # kernel killed a process for that while the run was going
+    counts = iter([0, 1])
+    monkeypatch.setattr(util.failures, "get_oom_kills",
+                        lambda: next(counts))
+    wd = str(tmp_path / "run")
+    executable = make_executable(tmp_path, "kill -9 $$")
+    process = run(executable, wd)
+    assert process["killed"] == "oom"
+    assert process["failure"] == "oom"
+
+
+def test_permanent_failures_not_retried(tmp_path):
+    wd = str(tmp_path / "run")
+    executable = \
+        make_executable(tmp_path,
+                        "echo 'ERROR: Cannot open file' ; exit 1")
+    process = run(executable, wd,
+                  retry_opts = {"maxretries" : 2,
+                                "retryon" : ["oom", "unknown"],
+                                "backoff" : 0,
+                                "backofffactor" : 1})
+    assert process["failure"] == "input"
+    assert process["attempts"] == 1
+
+
+def test_timeout_kills_process_group(tmp_path):
+    # the process and the processes it spawned (i.e. the MPI ranks)
+    # are killed once the time limit is reached
+    wd = str(tmp_path / "run")
+    executable = make_executable(tmp_path, "sleep 60 &\nwait")
+    process = run(executable, wd, timeout = 0.5)
+    assert process["timedout"]
+    assert process["killed"] == "timeout"
+    assert process["failure"] == "timeout"
+    assert process["elapsed"] < 30
+
+
+def test_batch_timeout_scaled(tmp_path, monkeypatch):
+    # the time limit of the cartesian step is set for a single
+    # mutation, so a batch gets the limit times its size
+    timeouts = []
+    def fake_run_rosetta(**kwargs):
+        timeouts.append(kwargs["timeout"])
+        return {**util.get_cached_process(), "returncode" : 1}
+    monkeypatch.setattr(util, "run_rosetta", fake_run_rosetta)
+    exec_path = tmp_path / "bin"
+    exec_path.mkdir()
+    make_executable(exec_path, "exit 0", name = "cartesian_ddg")
+    muts = [{MUT : [{CHAIN : "A", WTR : "L", NUMR : n, MUTR : "A"}]}
+            for n in (25, 30, 40)]
+    util.run_cartesian_batch(\
+        step_features = {"executable" : "cartesian_ddg"},
+        exec_path = str(exec_path),
+        exec_suffix = None,
+        muts = muts,
+        muts_wd = [str(tmp_path / f"mut{i}") for i in range(3)],
+        batch_wd = str(tmp_path / "batch"),
+        step = {"flagsfile" : "flags.txt", "output" : "rosetta.out"},
+        step_opts = {"-ddg:mut_file" : "mutation.mutfile",
+                     "-ddg:out" : "mutation.ddg"},
+        curr_pdb_file = str(tmp_path / "input.pdb"),
+        settings = {"cache" : {"cachedir" : None},
+                    "mpi" : {"usempi" : False, "mpiexec" : None,
+                             "mpiargs" : []},
+                    "retry" : {"maxretries" : 0},
+                    "limits" : {"timeout" : {"cartesian" : 100},
+                                "maxmemory" : None},
+                    "scratch" : {"enabled" : False}})
+    assert timeouts == [300]
@@ -0,0 +1,33 @@
+# Tests for speculation._get_stragglers, which spots the runs taking
+# far longer than expected.
+
+from RosettaDDGPrediction import speculation
+
+
+SPEC_OPTS = {"factor" : 2.0, "mintime" : 0, "minsamples" : 2}
+
+
+def test_stragglers_from_completed_runs():
+    # the runs already completed and dropped from the runs being
+    # watched still give the expected time of the pending ones
+    runs = [{"wd" : "slow", "step" : "ddg", "cost" : 1.0},
+            {"wd" : "fast", "step" : "ddg", "cost" : 1.0}]
+    done_runs = [{"wd" : "done1", "step" : "ddg", "cost" : 1.0},
+                 {"wd" : "done2", "step" : "ddg", "cost" : 2.0}]
+    walls = {"done1" : 10.0, "done2" : 20.0}
+    started = {"slow" : 0.0, "fast" : 90.0}
+    stragglers = speculation._get_stragglers(runs = runs,
+                                             started = started,
+                                             walls = walls,
+                                             spec_opts = SPEC_OPTS,
+                                             now = 100.0,
+                                             done_runs = done_runs)
+    assert [(run["wd"], elapsed, expected)
+            for run, elapsed, expected in stragglers] == \
+        [("slow", 100.0, 10.0)]
+    # without them, the expected time cannot be estimated
+    assert speculation._get_stragglers(runs = runs,
+                                       started = started,
+                                       walls = walls,
+                                       spec_opts = SPEC_OPTS,
+                                       now = 100.0) == []
@@ -0,0 +1,71 @@
+# Tests for util.split_output_cartddg, which splits the output of
+# a cartesian_ddg run on a batch of mutations into one output per
+# mutation.
+
+import os
+
+from conftest import ddg_lines
+from RosettaDDGPrediction import util
+from RosettaDDGPrediction.defaults import (
+    CHAIN,
+    MUT,
+    MUTR,
+    NUMR,
+    WTR
+)
+
+
+def make_mut(*smuts):
+    # a mutation made of single mutations (position, mutant residue)
+    return {MUT : [{CHAIN : "A", WTR : "L", NUMR : numr, MUTR : mutr}
+                   for numr, mutr in smuts]}
+
+
+def split(ddg_out, muts, tmp_path):
+    outs = [str(tmp_path / f"mut{i}.ddg") for i in range(len(muts))]
+    util.split_output_cartddg(ddg_out = ddg_out,
+                              muts = muts,
+                              muts_ddg_out = outs)
+    return [open(o).readlines() if os.path.exists(o) else None
+            for o in outs]
+
+
+def test_split_all_mutations(write_ddg, tmp_path):
+    blocks = [ddg_lines("MUT_25ALA", 3),
+              ddg_lines("MUT_30GLY", 3, start = 100)]
+    ddg_out = write_ddg(blocks[0] + blocks[1])
+    outs = split(ddg_out, [make_mut((25, "A")), make_mut((30, "G"))],
+                 tmp_path)
+    assert outs == blocks
+
+
+def test_split_missing_mutation(write_ddg, tmp_path):
+    # Rosetta skipped the second mutation, so the third one must not
+    # be assigned to it
+    blocks = [ddg_lines("MUT_25ALA", 3),
+              ddg_lines("MUT_40LYS", 3, start = 100)]
+    ddg_out = write_ddg(blocks[0] + blocks[1])
+    muts = [make_mut((25, "A")), make_mut((30, "G")),
+            make_mut((40, "K"))]
+    assert split(ddg_out, muts, tmp_path) == [blocks[0], None, blocks[1]]
+
+
+def test_split_crashed_run(write_ddg, tmp_path):
+    # the run crashed while modelling the wild-type of the second
+    # mutation, so only the first one gets an output
+    blocks = [ddg_lines("MUT_25ALA", 3),
+              ddg_lines("MUT_30GLY", 3, mut = False)]
+    ddg_out = write_ddg(blocks[0] + blocks[1])
+    muts = [make_mut((25, "A")), make_mut((30, "G"))]
+    assert split(ddg_out, muts, tmp_path) == [blocks[0], None]
+
+
+def test_split_multiple_mutation(write_ddg, tmp_path):
+    # mutations at several positions are matched as a whole, and
+    # the same position mutated to different residues is told apart
+    blocks = [ddg_lines("MUT_25ALA_30GLY", 2),
+              ddg_lines("MUT_25VAL", 2, start = 100)]
+    ddg_out = write_ddg(blocks[0] + blocks[1])
+    muts = [make_mut((25, "V")), make_mut((25, "A"), (30, "G")),
+            make_mut((25, "A"))]
+    assert split(ddg_out, muts, tmp_path) == [blocks[1], blocks[0], None]